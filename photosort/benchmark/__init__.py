@@ -0,0 +1,6 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
@@ -0,0 +1,105 @@
+# -*- mode: python; coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# python -m photosort.benchmark run --scale 10k --output results.json
+# python -m photosort.benchmark compare baseline.json results.json
+# python -m photosort.benchmark memory --entries 1000000
+# python -m photosort.benchmark startup --baseline startup.json
+
+import argparse
+import logging
+import sys
+
+from photosort.benchmark import memory
+from photosort.benchmark import runner
+from photosort.benchmark import startup
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m photosort.benchmark')
+    subparsers = parser.add_subparsers(dest='op')
+
+    run_parser = subparsers.add_parser('run', help="Run the benchmarks")
+    run_parser.add_argument('--scale', choices=sorted(runner.SCALES.keys()),
+                            default='10k', help="Number of files")
+    run_parser.add_argument('--files', type=int,
+                            help="Number of files, instead of a scale")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--duplicates', type=float, default=0.1,
+                            help="Ratio of duplicated files")
+    run_parser.add_argument('--movie-size', type=int, default=64,
+                            help="Size of the (sparse) movies in MB")
+    run_parser.add_argument('--workdir', help="Where to generate the files")
+    run_parser.add_argument('--keep', action='store_true',
+                            help="Keep the generated files")
+    run_parser.add_argument('--output', help="JSON file for the results")
+    run_parser.add_argument('--baseline',
+                            help="JSON results to compare with")
+    run_parser.add_argument('--threshold', type=float, default=0.1,
+                            help="Slowdown flagged as a regression")
+
+    compare_parser = subparsers.add_parser(
+        'compare', help="Compare results with a baseline")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="Slowdown flagged as a regression")
+
+    memory_parser = subparsers.add_parser(
+        'memory', help="Memory used per entry by the PhotoDB index")
+    memory_parser.add_argument('--entries', type=int, default=1000000)
+
+    startup_parser = subparsers.add_parser(
+        'startup', help="Time a sync of empty sources")
+    startup_parser.add_argument('--entries', type=int, default=100000,
+                                help="Entries in the DB")
+    startup_parser.add_argument('--runs', type=int, default=5,
+                                help="Syncs timed, the best one is kept")
+    startup_parser.add_argument('--workdir', help="Where to write the DB")
+    startup_parser.add_argument('--output', help="JSON file for the results")
+    startup_parser.add_argument('--baseline',
+                                help="JSON results to compare with")
+    startup_parser.add_argument('--threshold', type=float, default=0.2,
+                                help="Slowdown flagged as a regression")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.op == 'memory':
+        for kind, used in sorted(memory.run(args.entries).items()):
+            print("%-8s %8.1f bytes per entry" % (kind, used))
+        return 0
+
+    if args.op in ('run', 'startup'):
+        if args.op == 'run':
+            files = args.files or runner.SCALES[args.scale]
+            results = runner.run(files, args.seed, args.duplicates,
+                                 args.workdir, args.keep,
+                                 args.movie_size * 1024 * 1024)
+            print("\n".join(runner.report(results)))
+        else:
+            results = startup.run(args.entries, args.runs, args.workdir)
+            print("\n".join(startup.report(results)))
+        if args.output:
+            runner.write_results(results, args.output)
+        if not args.baseline:
+            return 0
+        baseline = runner.load_results(args.baseline)
+    else:
+        baseline = runner.load_results(args.baseline)
+        results = runner.load_results(args.results)
+
+    regressions = runner.compare(baseline, results, args.threshold)
+    for name, before, after in regressions:
+        print("REGRESSION %s: %.3fs -> %.3fs (%+.0f%%)" %
+              (name, before, after, 100.0 * (after - before) / before))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
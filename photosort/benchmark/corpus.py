@@ -0,0 +1,182 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# Reproducible synthetic media trees: JPEGs with EXIF dates, PNGs
+# without them, TIFF based RAW files, and sparse movies with their
+# creation time, plus a share of byte-identical duplicates. Only the
+# headers photosort reads are real, the image data is random bytes.
+
+import datetime
+import os
+import random
+import struct
+import time
+import zlib
+
+FILES_PER_DIR = 1000
+
+# share of each kind of file, the rest are movies
+KINDS = [('jpeg', 0.6), ('png', 0.15), ('raw', 0.2), ('movie', 0.05)]
+
+EXTENSIONS = {'jpeg': 'jpg', 'png': 'png', 'raw': 'cr2', 'movie': 'mov'}
+
+QUICKTIME_EPOCH_OFFSET = 2082844800
+
+# recipes kept to pick the originals of the duplicates from
+RECENT_RECIPES = 1000
+
+
+def _tiff_with_dates(date_str):
+    """
+    little endian TIFF header, IFD0 with DateTime and a pointer to
+    the Exif IFD, which holds DateTimeOriginal
+    """
+    ifd0_offset = 8
+    exif_ifd_offset = ifd0_offset + 2 + 12 * 2 + 4
+    data_offset = exif_ifd_offset + 2 + 12 + 4
+    ifd0 = struct.pack('<H', 2) + \
+        struct.pack('<HHII', 0x0132, 2, 20, data_offset) + \
+        struct.pack('<HHII', 0x8769, 4, 1, exif_ifd_offset) + '\x00' * 4
+    exif_ifd = struct.pack('<H', 1) + \
+        struct.pack('<HHII', 0x9003, 2, 20, data_offset + 20) + '\x00' * 4
+    return 'II*\x00' + struct.pack('<I', ifd0_offset) + ifd0 + exif_ifd + \
+        date_str + '\x00' + date_str + '\x00'
+
+
+def jpeg_with_exif(dt, payload):
+    tiff = _tiff_with_dates(dt.strftime('%Y:%m:%d %H:%M:%S'))
+    app1 = 'Exif\x00\x00' + tiff
+    return '\xff\xd8' + struct.pack('>BBH', 0xff, 0xe1, 2 + len(app1)) + \
+        app1 + struct.pack('>BBH', 0xff, 0xda, 2) + payload + '\xff\xd9'
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + \
+        struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def png(payload, width=32):
+    """
+    RGB PNG with the payload bytes as pixels, without EXIF data
+    """
+    row_size = 3 * width
+    height = max(1, len(payload) // row_size)
+    payload = payload.ljust(height * row_size, '\x00')
+    pixels = ''.join('\x00' + payload[row * row_size:(row + 1) * row_size]
+                     for row in range(height))
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return '\x89PNG\r\n\x1a\n' + _png_chunk('IHDR', header) + \
+        _png_chunk('IDAT', zlib.compress(pixels)) + _png_chunk('IEND', '')
+
+
+def raw_with_exif(dt, payload):
+    return _tiff_with_dates(dt.strftime('%Y:%m:%d %H:%M:%S')) + payload
+
+
+def _atom(atom_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), atom_type) + payload
+
+
+def write_movie(path, dt, payload, size):
+    """
+    writes a QuickTime movie of 'size' bytes, with the moov atom
+    after a sparse mdat, as cameras that don't optimize them do
+    """
+    creation_time = int(time.mktime(dt.timetuple())) + QUICKTIME_EPOCH_OFFSET
+    mvhd = _atom('mvhd', '\x00' * 4 +
+                 struct.pack('>IIII', creation_time, creation_time, 1000, 0) +
+                 '\x00' * 80)
+    moov = _atom('moov', mvhd)
+    ftyp = _atom('ftyp', 'qt  ')
+    mdat_size = max(size - len(ftyp) - len(moov), 16 + len(payload))
+    with open(path, 'wb') as f_out:
+        f_out.write(ftyp)
+        f_out.write(struct.pack('>I4sQ', 1, 'mdat', mdat_size))
+        f_out.write(payload)
+        f_out.seek(mdat_size - 16 - len(payload), os.SEEK_CUR)
+        f_out.write(moov)
+
+
+class Corpus:
+    """
+        Generates a tree of 'files' media files under 'root', the same
+        seed always produces the same tree. 'duplicate_ratio' of the
+        files repeat the contents of a previous one with another name.
+    """
+
+    def __init__(self, root, files, seed=0, duplicate_ratio=0.1,
+                 photo_size=2048, movie_size=64 * 1024 * 1024):
+        self.root = root
+        self.files = files
+        self.seed = seed
+        self.duplicate_ratio = duplicate_ratio
+        self.photo_size = photo_size
+        self.movie_size = movie_size
+
+    def _pick_kind(self, rng):
+        value = rng.random()
+        for kind, share in KINDS:
+            if value < share:
+                return kind
+            value -= share
+        return KINDS[-1][0]
+
+    def _write(self, path, kind, content_seed, dt):
+        bits = random.Random(content_seed).getrandbits(8 * self.photo_size)
+        payload = ('%0*x' % (2 * self.photo_size, bits)).decode('hex')
+        if kind == 'movie':
+            write_movie(path, dt, payload, self.movie_size)
+        else:
+            if kind == 'jpeg':
+                data = jpeg_with_exif(dt, payload)
+            elif kind == 'png':
+                data = png(payload)
+            else:
+                data = raw_with_exif(dt, payload)
+            with open(path, 'wb') as f_out:
+                f_out.write(data)
+
+        mtime = time.mktime(dt.timetuple())
+        os.utime(path, (mtime, mtime))
+
+    def generate(self):
+        """
+        writes the tree, returns a summary with the number of files
+        of each kind, the duplicates and the total (apparent) bytes
+        """
+        rng = random.Random(self.seed)
+        start = datetime.datetime(2005, 1, 1)
+        recipes = []
+        summary = {'files': self.files, 'duplicates': 0, 'bytes': 0,
+                   'seed': self.seed}
+        for kind, share in KINDS:
+            summary[kind] = 0
+
+        for i in range(self.files):
+            directory = os.path.join(self.root, 'd%04d' % (i // FILES_PER_DIR))
+            if i % FILES_PER_DIR == 0 and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            if recipes and rng.random() < self.duplicate_ratio:
+                kind, content_seed, dt = rng.choice(recipes)
+                summary['duplicates'] += 1
+            else:
+                kind = self._pick_kind(rng)
+                content_seed = rng.getrandbits(64)
+                dt = start + datetime.timedelta(
+                    seconds=rng.randint(0, 10 * 365 * 24 * 3600))
+                recipes.append((kind, content_seed, dt))
+                if len(recipes) > RECENT_RECIPES:
+                    recipes.pop(0)
+
+            path = os.path.join(directory,
+                                'f%07d.%s' % (i, EXTENSIONS[kind]))
+            self._write(path, kind, content_seed, dt)
+            summary[kind] += 1
+            summary['bytes'] += os.path.getsize(path)
+
+        return summary
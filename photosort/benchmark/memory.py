@@ -0,0 +1,97 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# Memory used per PhotoDB entry by the in-memory index, compared
+# with the dictionary of record dictionaries it used to be. Each
+# index is built in its own process, and measured by its RSS.
+
+import hashlib
+import multiprocessing
+import random
+import resource
+
+from photosort import dbindex
+
+
+def records(entries, seed=0):
+    """
+    yields (hash, record) pairs like the ones read from a CSV DB,
+    with new strings for every field
+    """
+    rng = random.Random(seed)
+    for i in range(entries):
+        day = i // 200
+        file_dir = '%d/%d_%02d_%02d' % (2005 + day // 365, 2005 + day // 365,
+                                        1 + day // 31 % 12, 1 + day % 28)
+        hash = hashlib.md5(str(i)).hexdigest()
+        if rng.random() < 0.9:
+            hash += ' - %s %02d:%02d:%02d' % (file_dir.split('/')[1].replace('_', '-'),
+                                              rng.randint(0, 23),
+                                              rng.randint(0, 59),
+                                              rng.randint(0, 59))
+            file_type = ''.join(['pho', 'to'])
+        else:
+            file_type = ''.join(['mov', 'ie'])
+        yield hash, {'dir': file_dir,
+                     'name': 'IMG_%07d.JPG' % i,
+                     'type': file_type,
+                     'size': rng.randint(100000, 10000000)}
+
+
+def build_dict(entries):
+    """
+    the dictionary of records with a set of hashes per size
+    """
+    hashes = {}
+    sizes = {}
+    for hash, record in records(entries):
+        hashes[hash] = record
+        sizes.setdefault(record['size'], set()).add(hash)
+    return hashes, sizes
+
+
+def build_compact(entries):
+    index = dbindex.CompactIndex()
+    for hash, record in records(entries):
+        index[hash] = record
+    return index
+
+
+INDEXES = {'dict': build_dict, 'compact': build_compact}
+
+
+def _rss():
+    try:
+        with open('/proc/self/statm') as f_in:
+            return int(f_in.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _measure(builder, entries, conn):
+    before = _rss()
+    index = builder(entries)
+    conn.send(_rss() - before)
+    conn.close()
+
+
+def bytes_per_entry(kind, entries):
+    """
+    builds the 'kind' index with 'entries' records in a new
+    process, returns the memory it used per entry
+    """
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_measure,
+                                      args=(INDEXES[kind], entries, child_conn))
+    process.start()
+    used = parent_conn.recv()
+    process.join()
+    return used / float(entries)
+
+
+def run(entries):
+    return dict((kind, bytes_per_entry(kind, entries)) for kind in INDEXES)
@@ -0,0 +1,230 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from photosort import media
+from photosort import photo
+from photosort import photodb
+from photosort import photosort as photosort_main
+from photosort import readiness
+from photosort import config
+from photosort import walk
+from photosort.benchmark import corpus
+
+SCALES = {'10k': 10000, '100k': 100000, '1M': 1000000}
+
+# files of the corpus hashed or parsed by the per file benchmarks
+SAMPLE_SIZE = 10000
+
+RESULTS_VERSION = 1
+
+
+class Benchmark:
+    """
+        Times the main operations of photosort over a synthetic corpus
+        generated in 'workdir': walking, hashing, EXIF parsing, the
+        PhotoDB, and complete sync and rebuilddb runs
+    """
+
+    def __init__(self, workdir, files, seed=0, duplicate_ratio=0.1,
+                 movie_size=64 * 1024 * 1024):
+        self._workdir = workdir
+        self._files = files
+        self._seed = seed
+        self._duplicate_ratio = duplicate_ratio
+        self._movie_size = movie_size
+        self._inbox = os.path.join(workdir, 'inbox')
+        self._output_dir = os.path.join(workdir, 'output')
+        self._config_file = os.path.join(self._output_dir, 'photosort.yml')
+        self.results = {}
+
+    def _time(self, name, function, count=None):
+        """
+        runs function, the number of items it processed is its result,
+        or count(result) if count is given
+        """
+        start = time.time()
+        result = function()
+        seconds = time.time() - start
+        items = count(result) if count is not None else result
+        self.results[name] = {'seconds': seconds,
+                              'items': items,
+                              'rate': items / max(seconds, 1e-6)}
+        return result
+
+    def _write_config(self):
+        data = {'sources': {'inbox': {'dir': self._inbox,
+                                      'ready_observations': 1}},
+                'output': {'dir': self._output_dir,
+                           'dir_pattern': '%(year)d/%(year)04d_%(month)02d_%(day)02d',
+                           'duplicates_dir': 'duplicates',
+                           'chmod': '0o774',
+                           'log_file': 'photosort.log',
+                           'db_file': 'photosort.db',
+                           'hash_cache': '',
+                           'ready_observations': 1}}
+        with open(self._config_file, 'w') as f_out:
+            yaml.safe_dump(data, f_out)
+
+    def _walker(self, directory, ignores=[]):
+        # the corpus was just written, don't wait for it to settle
+        return walk.WalkForMedia(directory, ignores,
+                                 tracker=readiness.ReadinessTracker(1))
+
+    def _sample(self):
+        walker = self._walker(self._inbox)
+        sample = []
+        for entry in walker.find_candidates():
+            sample.append(entry)
+            if len(sample) == SAMPLE_SIZE:
+                break
+        return sample
+
+    def _walk(self):
+        walker = self._walker(self._inbox)
+        return len(list(walker.find_media()))
+
+    def _hash(self, sample):
+        for entry in sample:
+            media.MediaFile(entry.path, entry.stat).hash()
+        return len(sample)
+
+    def _exif(self, sample):
+        photos = [entry for entry in sample
+                  if media.MediaFile.guess_file_type(entry.name) == 'photo']
+        for entry in photos:
+            photo.Photo(entry.path, entry.stat)._exif_datetime()
+        return len(photos)
+
+    def _photo_sort(self):
+        return photosort_main.PhotoSort(self._config_file, logging.WARNING)
+
+    def _sorted_sample(self):
+        walker = self._walker(self._output_dir,
+                              [os.path.join(self._output_dir, 'duplicates')])
+        sample = []
+        for entry in walker.find_candidates():
+            sample.append(media.MediaFile.build_for(entry.path, entry.stat))
+            if len(sample) == SAMPLE_SIZE:
+                break
+        return sample
+
+    def _db(self):
+        return photodb.PhotoDB.build_for(config.Config(self._config_file))
+
+    def _is_duplicate(self, db, sample):
+        for media_file in sample:
+            db.is_duplicate(media_file)
+        return len(sample)
+
+    def run(self):
+        """
+        generates the corpus and runs all the benchmarks, returns
+        the results as a dictionary
+        """
+        os.makedirs(self._inbox)
+        os.makedirs(self._output_dir)
+        self._write_config()
+
+        start = time.time()
+        summary = corpus.Corpus(self._inbox, self._files, self._seed,
+                                self._duplicate_ratio,
+                                movie_size=self._movie_size).generate()
+        summary['seconds'] = time.time() - start
+
+        sample = self._sample()
+        self._time('walk', self._walk)
+        self._time('hash', lambda: self._hash(sample))
+        self._time('exif', lambda: self._exif(sample))
+        media.MediaFile.hash_cache = None
+
+        self._time('sync', lambda: self._photo_sort().sync(),
+                   lambda result: self._files)
+
+        db = self._time('photodb_load', self._db, len)
+        db._dirty = db._unjournaled = True  # so the file is rewritten
+        self._time('photodb_write', db.write, lambda result: len(db))
+        sorted_sample = self._sorted_sample()
+        self._time('photodb_is_duplicate',
+                   lambda: self._is_duplicate(db, sorted_sample))
+
+        os.remove(os.path.join(self._output_dir, 'photosort.db'))
+        self._time('rebuild_db', lambda: self._photo_sort().rebuild_db(),
+                   lambda result: len(self._db()))
+
+        return {'version': RESULTS_VERSION,
+                'files': self._files,
+                'seed': self._seed,
+                'duplicate_ratio': self._duplicate_ratio,
+                'corpus': summary,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': self.results}
+
+
+def run(files, seed=0, duplicate_ratio=0.1, workdir=None, keep=False,
+        movie_size=64 * 1024 * 1024):
+    """
+    runs the benchmarks in a new directory inside workdir
+    """
+    tmpdir = tempfile.mkdtemp(prefix='photosort-benchmark-', dir=workdir)
+    try:
+        return Benchmark(tmpdir, files, seed, duplicate_ratio,
+                         movie_size).run()
+    finally:
+        if keep:
+            logging.warning("benchmark tree kept in %s" % tmpdir)
+        else:
+            shutil.rmtree(tmpdir, True)
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    returns the benchmarks of current that took more than 'threshold'
+    (relative) longer than in baseline, as (name, before, after) tuples
+    """
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        if result['seconds'] > before['seconds'] * (1 + threshold):
+            regressions.append((name, before['seconds'], result['seconds']))
+    return regressions
+
+
+def report(results):
+    """
+    returns the results as lines of text
+    """
+    lines = ["%d files, seed %d, %d duplicates" %
+             (results['files'], results['seed'],
+              results['corpus']['duplicates'])]
+    for name, result in sorted(results['results'].items()):
+        lines.append("%-22s %10d items %10.3fs %12.1f/s" %
+                     (name, result['items'], result['seconds'],
+                      result['rate']))
+    return lines
+
+
+def load_results(filename):
+    with open(filename, 'r') as f_in:
+        return json.load(f_in)
+
+
+def write_results(results, filename):
+    with open(filename, 'w') as f_out:
+        json.dump(results, f_out, indent=2, sort_keys=True)
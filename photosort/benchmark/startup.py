@@ -0,0 +1,108 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# Wall time of a complete 'photosort sync' process when the sources
+# have nothing to sort, what a cron job pays most of the time, over
+# an output dir with a big DB. The bare interpreter startup is timed
+# too, as a reference of the machine speed.
+
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+import photosort
+from photosort import photodb
+from photosort import config
+from photosort.benchmark import memory
+from photosort.benchmark import runner
+
+SYNC_SCRIPT = ("import sys; from photosort import photosort; "
+               "sys.argv = ['photosort', 'sync', '--config', sys.argv[1]]; "
+               "photosort.main()")
+
+
+def _write_tree(workdir, entries):
+    """
+    writes a config with two empty sources, and a DB with 'entries'
+    records, returns the config file name
+    """
+    output_dir = os.path.join(workdir, 'output')
+    sources = {}
+    for name in ('inbox', 'card'):
+        sources[name] = {'dir': os.path.join(workdir, name)}
+        os.makedirs(sources[name]['dir'])
+    os.makedirs(output_dir)
+
+    config_file = os.path.join(workdir, 'photosort.yml')
+    with open(config_file, 'w') as f_out:
+        yaml.safe_dump({'sources': sources,
+                        'output': {'dir': output_dir,
+                                   'dir_pattern': '%(year)d/%(year)04d_%(month)02d_%(day)02d',
+                                   'duplicates_dir': 'duplicates',
+                                   'chmod': '0o774',
+                                   'log_file': 'photosort.log',
+                                   'db_file': 'photosort.db'}}, f_out)
+
+    db = photodb.PhotoDB(config.Config(config_file))
+    for hash, record in memory.records(entries):
+        db._store(hash, record)
+    db.write()
+    return config_file
+
+
+def _best_time(command, runs):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(photosort.__file__)))] +
+        [path for path in [env.get('PYTHONPATH')] if path])
+    best = None
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_call(command, env=env)
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+
+def run(entries=100000, runs=5, workdir=None):
+    """
+    times empty inbox syncs with a DB of 'entries' records, returns the
+    best of 'runs' in the format of the runner results
+    """
+    tmpdir = tempfile.mkdtemp(prefix='photosort-startup-', dir=workdir)
+    try:
+        config_file = _write_tree(tmpdir, entries)
+        results = {}
+        for name, command in (
+                ('interpreter', [sys.executable, '-c', 'pass']),
+                ('sync_empty_inbox',
+                 [sys.executable, '-c', SYNC_SCRIPT, config_file])):
+            seconds = _best_time(command, runs)
+            results[name] = {'seconds': seconds, 'items': runs,
+                             'rate': 1 / max(seconds, 1e-6)}
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+    return {'version': runner.RESULTS_VERSION,
+            'entries': entries,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results}
+
+
+def report(results):
+    lines = ["empty inbox sync, %d DB entries" % results['entries']]
+    for name, result in sorted(results['results'].items()):
+        lines.append("%-22s %10.3fs" % (name, result['seconds']))
+    return lines
@@ -0,0 +1,80 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import csv
+import logging
+import os
+import time
+
+
+class Checkpoint:
+    """
+        Progress of a rebuilddb: the directories (relative to 'root')
+        whose files have all been indexed. They are appended to the
+        checkpoint file in batches, with save(), once the entries
+        indexed from them are durable in the DB.
+    """
+
+    def __init__(self, filename, root, interval=60):
+        self._filename = filename
+        self._root = root
+        self._interval = interval
+        self._pending = []
+        self._last_save = time.time()
+        self.completed = set()
+
+    def load(self):
+        """
+        reads the directories completed by an interrupted run
+        """
+        self.completed = set()
+        try:
+            with open(self._filename, 'rb') as f_in:
+                data = f_in.read()
+        except IOError:
+            return self.completed
+
+        # a line torn by a crash is just a directory indexed again
+        data = data[:data.rfind('\n') + 1]
+        for row in csv.reader(data.splitlines(True)):
+            if row:
+                self.completed.add(row[0])
+        return self.completed
+
+    def _relative(self, directory):
+        return os.path.relpath(directory, self._root)
+
+    def is_completed(self, directory):
+        return self._relative(directory) in self.completed
+
+    def done(self, directory):
+        relative = self._relative(directory)
+        self.completed.add(relative)
+        self._pending.append(relative)
+
+    def due(self):
+        return bool(self._pending) and \
+            time.time() - self._last_save >= self._interval
+
+    def save(self):
+        if self._pending:
+            with open(self._filename, 'ab') as f_out:
+                csv.writer(f_out, lineterminator='\n').writerows(
+                    [relative] for relative in self._pending)
+                f_out.flush()
+                os.fsync(f_out.fileno())
+            logging.info("rebuilddb: checkpoint, %d directories indexed" %
+                         len(self.completed))
+        self._pending = []
+        self._last_save = time.time()
+
+    def remove(self):
+        self._pending = []
+        try:
+            os.remove(self._filename)
+        except OSError:
+            pass
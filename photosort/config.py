@@ -34,12 +34,136 @@ class Config:
     def sources(self):
         return self._data['sources']
 
+    def source_readiness(self, source):
+        """
+            (observations, seconds, interval) a file of the source must
+            be seen unchanged, or left unmodified, to be considered
+            ready, and the seconds between the observations counted
+        """
+        return self._readiness(self._data['sources'][source])
+
+    def output_readiness(self):
+        """
+            the same thresholds, for the files indexed by rebuilddb
+        """
+        return self._readiness(self._data['output'])
+
+    def _readiness(self, section):
+        # the observations are spaced as the walks of the poll monitor
+        return (section.get('ready_observations', 2),
+                section.get('ready_seconds', 30),
+                section.get('ready_interval', 10))
+
+    def source_io_concurrency(self, source):
+        """
+            concurrent reads of the device of the source, None
+            to choose it from the filesystem type
+        """
+        return self._data['sources'][source].get('io_concurrency')
+
+    def output_io_concurrency(self):
+        """
+            concurrent reads and writes of the device of the output dir
+        """
+        return self._data['output'].get('io_concurrency')
+
     def log_file(self):
         return self._relative_or_absolute_to_output(self._data['output']['log_file'])
 
     def db_file(self):
         return self._relative_or_absolute_to_output(self._data['output']['db_file'])
 
+    def db_snapshot_file(self):
+        """
+            Binary snapshot of the CSV DB ('db_snapshot', the DB file
+            plus .snap by default), None if it's disabled with an empty
+            value or another engine is used
+        """
+        if self.db_engine() != 'csv':
+            return None
+        filename = self._data['output'].get('db_snapshot',
+                                            self.db_file() + '.snap')
+        if not filename:
+            return None
+        return self._relative_or_absolute_to_output(filename)
+
+    def db_journal_file(self):
+        """
+            Journal of the changes to the CSV DB ('db_journal', the DB
+            file plus .journal by default), None if it's disabled with
+            an empty value or another engine is used
+        """
+        if self.db_engine() != 'csv':
+            return None
+        filename = self._data['output'].get('db_journal',
+                                            self.db_file() + '.journal')
+        if not filename:
+            return None
+        return self._relative_or_absolute_to_output(filename)
+
+    def db_journal_limits(self):
+        """
+            (bytes, seconds) the journal can grow to, or be kept, before
+            the DB file is rewritten with its changes
+        """
+        output = self._data['output']
+        return (output.get('db_journal_max_bytes', 4 * 1024 * 1024),
+                output.get('db_journal_max_age', 3600))
+
+    def db_engine(self):
+        """
+            Storage engine for the photo database, 'csv' (default)
+            or 'sqlite'
+        """
+        return self._data['output'].get('db_engine', 'csv')
+
+    def hash_cache_file(self):
+        """
+            File for the persistent hash cache, None if
+            it has been disabled with an empty 'hash_cache'
+        """
+        filename = self._data['output'].get('hash_cache',
+                                            'photosort.hashcache')
+        if not filename:
+            return None
+        return self._relative_or_absolute_to_output(filename)
+
+    def time_skew_file(self):
+        """
+            File where the clock skew of each mount is kept between
+            runs, None if it has been disabled with an empty 'time_skew_cache'
+        """
+        filename = self._data['output'].get('time_skew_cache',
+                                            'photosort.timeskew')
+        if not filename:
+            return None
+        return self._relative_or_absolute_to_output(filename)
+
+    def time_skew_ttl(self):
+        """
+            seconds a measured clock skew is used before probing again
+        """
+        return self._data['output'].get('time_skew_ttl', 3600)
+
+    def rebuild_checkpoint_interval(self):
+        """
+            seconds between the checkpoints of rebuilddb
+        """
+        return self._data['output'].get('rebuild_checkpoint_interval', 60)
+
+    def store_xattrs(self):
+        """
+            Keep the digests of the sorted files in their extended
+            attributes, and trust them when the files didn't change
+        """
+        return bool(self._data['output'].get('xattrs', False))
+
+    def verify_copies(self):
+        """
+            Read back the files copied across devices to check them
+        """
+        return bool(self._data['output'].get('verify_copies', False))
+
     def duplicates_dir(self):
         return self._relative_or_absolute_to_output(
             self._data['output']['duplicates_dir'])
@@ -62,6 +186,36 @@ class Config:
             else:
                 raise
 
+    def _monitor_option(self, option, default):
+        return (self._data.get('monitor') or {}).get(option, default)
+
+    def monitor_backend(self):
+        """
+            'inotify', 'poll' or 'auto' (default), which uses
+            inotify when available
+        """
+        return self._monitor_option('backend', 'auto')
+
+    def monitor_rescan_interval(self):
+        """
+            seconds between full rescans of the sources when
+            monitoring with inotify
+        """
+        return self._monitor_option('rescan_interval', 3600)
+
+    def _sync_option(self, option, default):
+        return (self._data.get('sync') or {}).get(option, default)
+
+    def sync_workers(self, stage):
+        """
+            number of threads for a stage of the sync pipeline:
+            'readiness', 'hash' or 'move'
+        """
+        return self._sync_option(stage + '_workers', 2)
+
+    def sync_queue_size(self):
+        return self._sync_option('queue_size', 64)
+
     def output_chmod(self):
         return int(self._data['output']['chmod'],8) # octal conversion
 
@@ -0,0 +1,176 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# File copies assisted by the kernel where possible: reflink clones
+# on copy-on-write filesystems, then copy_file_range and sendfile,
+# which don't move the data through user space, and a buffered loop
+# as the last resort (or when the data must be hashed on the way)
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import logging
+import os
+import time
+
+FICLONE = 0x40049409            # _IOW(0x94, 9, int) from <linux/fs.h>
+
+KERNEL_CHUNK = 64 * 1024 * 1024
+BUFFER_SIZE = 1024 * 1024
+
+# errors telling the method doesn't apply to these files
+UNSUPPORTED = frozenset([errno.ENOSYS, errno.EXDEV, errno.EINVAL,
+                         errno.ENOTTY, errno.EOPNOTSUPP, errno.EBADF])
+
+
+class Unsupported(Exception):
+    pass
+
+
+class CopyResult(collections.namedtuple('CopyResult',
+                                        ['method', 'size', 'seconds',
+                                         'digest'])):
+    """
+    how a file was copied: the method used, the bytes copied, the
+    time it took, and the digest of the data if it was hashed
+    """
+    def rate(self):
+        """
+        throughput in bytes per second
+        """
+        return self.size / max(self.seconds, 1e-6)
+
+
+_libc = None
+
+
+def _libc_function(name, restype, argtypes):
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+    try:
+        function = getattr(_libc, name)
+    except AttributeError:
+        raise Unsupported("%s not available" % name)
+    function.restype = restype
+    function.argtypes = argtypes
+    return function
+
+
+def _reflink(fd_in, fd_out, size):
+    try:
+        fcntl.ioctl(fd_out, FICLONE, fd_in)
+    except (IOError, OSError) as e:
+        if e.errno in UNSUPPORTED:
+            raise Unsupported(str(e))
+        raise
+    return size
+
+
+def _kernel_loop(function, fd_in, fd_out, size):
+    """
+    calls function(fd_in, fd_out, count) until size bytes are copied,
+    the file positions of both descriptors are used and advanced
+    """
+    copied = 0
+    while copied < size:
+        result = function(fd_in, fd_out, min(KERNEL_CHUNK, size - copied))
+        if result < 0:
+            err = ctypes.get_errno()
+            if copied == 0 and err in UNSUPPORTED:
+                raise Unsupported(os.strerror(err))
+            raise OSError(err, os.strerror(err))
+        if result == 0:
+            # some filesystems copy nothing instead of failing
+            if copied == 0:
+                raise Unsupported("no data copied")
+            raise IOError("short copy, %d of %d bytes" % (copied, size))
+        copied += result
+    return copied
+
+
+def _copy_file_range(fd_in, fd_out, size):
+    function = _libc_function('copy_file_range', ctypes.c_ssize_t,
+                              [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                               ctypes.c_void_p, ctypes.c_size_t,
+                               ctypes.c_uint])
+    return _kernel_loop(lambda fd_in, fd_out, count:
+                        function(fd_in, None, fd_out, None, count, 0),
+                        fd_in, fd_out, size)
+
+
+def _sendfile(fd_in, fd_out, size):
+    function = _libc_function('sendfile', ctypes.c_ssize_t,
+                              [ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+                               ctypes.c_size_t])
+    return _kernel_loop(lambda fd_in, fd_out, count:
+                        function(fd_out, fd_in, None, count),
+                        fd_in, fd_out, size)
+
+
+def _buffered(f_in, f_out, hasher, blocksize=BUFFER_SIZE):
+    copied = 0
+    buf = f_in.read(blocksize)
+    while len(buf) > 0:
+        if hasher is not None:
+            hasher.update(buf)
+        f_out.write(buf)
+        copied += len(buf)
+        buf = f_in.read(blocksize)
+    return copied
+
+
+def _hash_file(f_in, hasher, blocksize=BUFFER_SIZE):
+    buf = f_in.read(blocksize)
+    while len(buf) > 0:
+        hasher.update(buf)
+        buf = f_in.read(blocksize)
+
+
+KERNEL_METHODS = [('reflink', _reflink),
+                  ('copy_file_range', _copy_file_range),
+                  ('sendfile', _sendfile)]
+
+
+def copy_file(src, dst, hasher=None):
+    """
+    copies the contents of src into dst, returns a CopyResult. When a
+    hasher is given the data is hashed on the way, then only reflinks
+    are tried before the buffered copy, so the source is read once
+    """
+    start = time.time()
+    with open(src, 'rb') as f_in:
+        with open(dst, 'wb') as f_out:
+            fd_in = f_in.fileno()
+            fd_out = f_out.fileno()
+            size = os.fstat(fd_in).st_size
+            copied = 0
+            method = None
+
+            for name, function in KERNEL_METHODS:
+                if hasher is not None and name != 'reflink':
+                    break
+                try:
+                    copied = function(fd_in, fd_out, size)
+                except Unsupported as e:
+                    logging.debug("%s copy of %s not possible: %s" %
+                                  (name, src, e))
+                    continue
+                method = name
+                if hasher is not None:
+                    _hash_file(f_in, hasher)
+                break
+
+            if method is None:
+                method = 'buffered'
+                copied = _buffered(f_in, f_out, hasher)
+
+    digest = hasher.hexdigest() if hasher is not None else None
+    return CopyResult(method, copied, time.time() - start, digest)
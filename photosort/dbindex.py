@@ -0,0 +1,282 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import array
+import binascii
+
+TYPES = ('photo', 'movie', 'unknown')
+TYPE_IDS = dict((file_type, index) for index, file_type in enumerate(TYPES))
+
+NO_SIZE = -1
+NO_DATE = -1
+
+DATE_SEPARATOR = ' - '
+DATE_FORMAT = '%04d-%02d-%02d %02d:%02d:%02d'
+
+
+def _pack_date(date_str):
+    """
+    'YYYY-MM-DD HH:MM:SS' as the YYYYMMDDHHMMSS integer, or None
+    if it's not exactly in that format
+    """
+    try:
+        value = int(date_str[0:4] + date_str[5:7] + date_str[8:10] +
+                    date_str[11:13] + date_str[14:16] + date_str[17:19])
+    except ValueError:
+        return None
+    if value < 0 or _unpack_date(value) != date_str:
+        return None
+    return value
+
+
+def _unpack_date(value):
+    value, second = divmod(value, 100)
+    value, minute = divmod(value, 100)
+    value, hour = divmod(value, 100)
+    value, day = divmod(value, 100)
+    year, month = divmod(value, 100)
+    return DATE_FORMAT % (year, month, day, hour, minute, second)
+
+
+def split_hash(hash):
+    """
+    returns (16 byte digest, date) for hashes made of an md5 and
+    an optional date, None for the rest
+    """
+    md5, separator, date_str = hash.partition(DATE_SEPARATOR)
+    if len(md5) != 32:
+        return None
+    try:
+        digest = binascii.unhexlify(md5)
+    except TypeError:
+        return None
+    if binascii.hexlify(digest) != md5:
+        return None     # upper case
+    if not separator:
+        return digest, NO_DATE
+    date = _pack_date(date_str)
+    if date is None:
+        return None
+    return digest, date
+
+
+def join_hash(digest, date):
+    hash = binascii.hexlify(digest)
+    if date != NO_DATE:
+        hash += DATE_SEPARATOR + _unpack_date(date)
+    return hash
+
+
+def make_record(directory, name, file_type, size):
+    return {'dir': directory,
+            'name': name,
+            'type': TYPES[file_type],
+            'size': size if size != NO_SIZE else None}
+
+
+class CompactIndex:
+    """
+        Dictionary of PhotoDB records ({'dir', 'name', 'type', 'size'})
+        by hash, stored in columns instead of a dict per entry:
+
+          - the md5 of the hash as a 16 byte string, and the EXIF date
+            appended to the hash of photos as an integer column
+          - directories stored once, and referenced by index
+          - types, sizes and dates in arrays
+
+        Records are built when they are looked up, so changing them
+        doesn't change the index. Hashes that aren't an md5 (with an
+        optional date) are kept in a plain dictionary, and so are the
+        ones whose md5 already has a row with another date (i.e. a RAW
+        indexed without its EXIF date, and then with it).
+    """
+
+    def __init__(self):
+        self._rows = {}             # 16 byte digest -> row
+        self._other = {}            # any other hash -> record
+        self._dirs = []
+        self._dir_ids = {}          # directory -> index in _dirs
+        self._digests = []          # digest of each row, None if deleted
+        self._names = []
+        self._row_dirs = array.array('i')
+        self._types = array.array('b')
+        self._sizes = array.array('l')
+        self._dates = array.array('l')
+        self._size_rows = {}        # size -> row, or list of rows
+        self._free = []             # rows of deleted entries
+
+    def _hash_of(self, row):
+        return join_hash(self._digests[row], self._dates[row])
+
+    def _record_of(self, row):
+        return make_record(self._dirs[self._row_dirs[row]], self._names[row],
+                           self._types[row], self._sizes[row])
+
+    def _dir_id(self, directory):
+        try:
+            return self._dir_ids[directory]
+        except KeyError:
+            self._dirs.append(directory)
+            return self._dir_ids.setdefault(directory, len(self._dirs) - 1)
+
+    def _add_size(self, size, row):
+        rows = self._size_rows.get(size)
+        if rows is None:
+            self._size_rows[size] = row
+        elif isinstance(rows, list):
+            rows.append(row)
+        else:
+            self._size_rows[size] = [rows, row]
+
+    def _remove_size(self, size, row):
+        rows = self._size_rows.get(size)
+        if isinstance(rows, list):
+            rows.remove(row)
+            if len(rows) == 1:
+                self._size_rows[size] = rows[0]
+        elif rows == row:
+            del self._size_rows[size]
+
+    def _remove_row(self, digest):
+        row = self._rows.pop(digest)
+        if self._sizes[row] != NO_SIZE:
+            self._remove_size(self._sizes[row], row)
+        self._digests[row] = None
+        self._names[row] = None
+        self._free.append(row)
+        return row
+
+    def __len__(self):
+        return len(self._rows) + len(self._other)
+
+    def _row_of(self, key):
+        """
+        row of the (digest, date) key, None if it hasn't one
+        """
+        if key is None:
+            return None
+        row = self._rows.get(key[0])
+        if row is None or self._dates[row] != key[1]:
+            return None
+        return row
+
+    def __contains__(self, hash):
+        return self._row_of(split_hash(hash)) is not None or \
+            hash in self._other
+
+    def get(self, hash, default=None):
+        row = self._row_of(split_hash(hash))
+        if row is not None:
+            return self._record_of(row)
+        record = self._other.get(hash)
+        return dict(record) if record is not None else default
+
+    def __getitem__(self, hash):
+        record = self.get(hash)
+        if record is None:
+            raise KeyError(hash)
+        return record
+
+    def __setitem__(self, hash, record):
+        key = split_hash(hash)
+        file_type = TYPE_IDS.get(record.get('type'))
+        if key is None or file_type is None or hash in self._other:
+            self._other[hash] = dict(record)
+            return
+
+        digest, date = key
+        if digest in self._rows:
+            if self._dates[self._rows[digest]] != date:
+                self._other[hash] = dict(record)
+                return
+            self._remove_row(digest)
+
+        size = record.get('size')
+        if size is None:
+            size = NO_SIZE
+        values = (self._dir_id(record['dir']), file_type, size, date)
+        if self._free:
+            row = self._free.pop()
+            self._digests[row] = digest
+            self._names[row] = record['name']
+            (self._row_dirs[row], self._types[row],
+             self._sizes[row], self._dates[row]) = values
+        else:
+            row = len(self._digests)
+            self._digests.append(digest)
+            self._names.append(record['name'])
+            for column, value in zip((self._row_dirs, self._types,
+                                      self._sizes, self._dates), values):
+                column.append(value)
+
+        self._rows[digest] = row
+        if size != NO_SIZE:
+            self._add_size(size, row)
+
+    def __delitem__(self, hash):
+        key = split_hash(hash)
+        if self._row_of(key) is not None:
+            self._remove_row(key[0])
+        else:
+            del self._other[hash]
+
+    def __iter__(self):
+        for digest, row in self._rows.iteritems():
+            yield self._hash_of(row)
+        for hash in self._other.keys():
+            yield hash
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        for digest, row in self._rows.iteritems():
+            yield self._hash_of(row), self._record_of(row)
+        for hash, record in self._other.items():
+            yield hash, dict(record)
+
+    def values(self):
+        for hash, record in self.items():
+            yield record
+
+    def sorted_rows(self):
+        """
+        yields (digest, date, size, directory, name, type) for the
+        entries with a row, sorted by digest
+        """
+        for digest in sorted(self._rows):
+            row = self._rows[digest]
+            yield (digest, self._dates[row], self._sizes[row],
+                   self._dirs[self._row_dirs[row]], self._names[row],
+                   self._types[row])
+
+    def other_items(self):
+        """
+        (hash, record) of the entries without a row
+        """
+        return [(hash, dict(record)) for hash, record in self._other.items()]
+
+    def other_keys(self):
+        """
+        (digest, date) of the md5 hashes of the entries without a row
+        """
+        return set(key for key in (split_hash(hash) for hash in self._other)
+                   if key is not None)
+
+    def hashes_with_size(self, size):
+        """
+        returns the set of hashes of the entries of the given size
+        """
+        hashes = set(hash for hash, record in self._other.items()
+                     if record.get('size') == size)
+        rows = self._size_rows.get(size)
+        if rows is None:
+            return hashes
+        if not isinstance(rows, list):
+            rows = [rows]
+        hashes.update(self._hash_of(row) for row in rows)
+        return hashes
@@ -0,0 +1,142 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# Minimal EXIF reader for the date tags, it only reads the headers
+# of JPEG files (APP1 segment) and TIFF based RAW files (IFD0 and
+# the Exif IFD), without decoding any image data
+
+import logging
+import struct
+
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_DATETIME_DIGITIZED = 0x9004
+
+# same names PIL.ExifTags uses
+DATE_TAGS = {TAG_DATETIME: 'DateTime',
+             TAG_DATETIME_ORIGINAL: 'DateTimeOriginal',
+             TAG_DATETIME_DIGITIZED: 'DateTimeDigitized'}
+
+TYPE_ASCII = 2
+TYPE_LONG = 4
+
+TIFF_HEADERS = {'II*\x00': '<',     # TIFF, CR2, ARW, NEF, DNG...
+                'MM\x00*': '>',
+                'IIRO': '<',        # Olympus ORF
+                'IIRS': '<',
+                'MMOR': '>',
+                'IIU\x00': '<'}     # Panasonic RAW/RW2
+
+JPEG_SOI = '\xff\xd8'
+JPEG_APP1 = 0xe1
+JPEG_SOS = 0xda
+JPEG_EOI = 0xd9
+EXIF_HEADER = 'Exif\x00\x00'
+
+MAX_IFD_ENTRIES = 1024
+MAX_DATE_LENGTH = 64    # they are 20 bytes, longer ones are corrupt
+MAX_JPEG_SEGMENTS = 64
+
+
+def _find_jpeg_tiff_header(f_in):
+    """
+    walks the JPEG segments up to the image data, returns the file
+    offset of the TIFF header inside the APP1 EXIF segment, or None
+    """
+    offset = len(JPEG_SOI)
+    for i in range(MAX_JPEG_SEGMENTS):
+        f_in.seek(offset)
+        header = f_in.read(4)
+        if len(header) < 4 or header[0] != '\xff':
+            return None
+
+        marker, length = struct.unpack('>xBH', header)
+        if marker in (JPEG_SOS, JPEG_EOI):
+            return None
+
+        if marker == JPEG_APP1:
+            if f_in.read(len(EXIF_HEADER)) == EXIF_HEADER:
+                return offset + 4 + len(EXIF_HEADER)
+
+        offset += 2 + length
+    return None
+
+
+def _read_ifd(f_in, base, offset, endian):
+    """
+    returns {tag: value} for the ASCII and LONG entries of the IFD at
+    'offset' from the TIFF header at 'base'
+    """
+    f_in.seek(base + offset)
+    data = f_in.read(2)
+    if len(data) < 2:
+        return {}
+    count = min(struct.unpack(endian + 'H', data)[0], MAX_IFD_ENTRIES)
+    data = f_in.read(12 * count)
+
+    entries = {}
+    for i in range(len(data) // 12):
+        tag, tag_type, length, value = struct.unpack_from(endian + 'HHII',
+                                                          data, 12 * i)
+        if tag_type == TYPE_LONG and length == 1:
+            entries[tag] = value
+        elif tag_type == TYPE_ASCII and tag in DATE_TAGS and \
+                length <= MAX_DATE_LENGTH:
+            entries[tag] = (length, data[12 * i + 8:12 * i + 12], value)
+
+    for tag, value in entries.items():
+        if isinstance(value, tuple):
+            length, inline, value_offset = value
+            if length <= 4:
+                text = inline[:length]
+            else:
+                f_in.seek(base + value_offset)
+                text = f_in.read(length)
+            entries[tag] = text.rstrip('\x00 ')
+    return entries
+
+
+def _read_tiff_dates(f_in, base):
+    f_in.seek(base)
+    header = f_in.read(8)
+    if len(header) < 8 or header[:4] not in TIFF_HEADERS:
+        return {}
+
+    endian = TIFF_HEADERS[header[:4]]
+    ifd0_offset = struct.unpack(endian + 'I', header[4:])[0]
+
+    entries = _read_ifd(f_in, base, ifd0_offset, endian)
+    exif_offset = entries.get(TAG_EXIF_IFD)
+    if exif_offset:
+        entries.update(_read_ifd(f_in, base, exif_offset, endian))
+
+    return dict((DATE_TAGS[tag], value) for tag, value in entries.items()
+                if tag in DATE_TAGS and value)
+
+
+def read_exif_dates(filename):
+    """
+    returns a dictionary with the EXIF date tags found in filename
+    ('DateTimeOriginal', 'DateTimeDigitized', 'DateTime'), or None
+    if the file format is not JPEG or TIFF based
+    """
+    with open(filename, 'rb') as f_in:
+        magic = f_in.read(4)
+        try:
+            if magic[:2] == JPEG_SOI:
+                base = _find_jpeg_tiff_header(f_in)
+                if base is None:
+                    return {}
+            elif magic in TIFF_HEADERS:
+                base = 0
+            else:
+                return None
+            return _read_tiff_dates(f_in, base)
+        except struct.error as e:
+            logging.debug("Truncated EXIF data in %s: %s" % (filename, e))
+            return None
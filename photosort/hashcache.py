@@ -0,0 +1,125 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import logging
+import os
+import sqlite3
+import threading
+
+
+class HashCache:
+    """
+    Persistent cache of file digests, keyed by the stat identity of
+    the files (device, inode, size, mtime), so unchanged files don't
+    need to be read again to know their hash
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, filename, base=None):
+        """
+        'base' is the file of another cache, only read, where the
+        digests not found in this one are looked up
+        """
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+        self._base_conn = None
+        if base is not None and os.path.exists(base):
+            self._base_conn = sqlite3.connect(base, timeout=60,
+                                              check_same_thread=False)
+            self._base_conn.text_factory = str
+            if self._base_conn.execute(
+                    "SELECT name FROM sqlite_master "
+                    "WHERE type = 'table' AND name = 'digests'").fetchone() \
+                    is None:
+                self._base_conn.close()
+                self._base_conn = None
+
+        # shared with other photosort processes, wait for their locks
+        self._conn = sqlite3.connect(filename, timeout=60,
+                                     check_same_thread=False)
+        self._conn.text_factory = str
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS digests ("
+                               " dev INTEGER NOT NULL,"
+                               " ino INTEGER NOT NULL,"
+                               " algorithm TEXT NOT NULL,"
+                               " size INTEGER NOT NULL,"
+                               " mtime REAL NOT NULL,"
+                               " digest TEXT NOT NULL,"
+                               " PRIMARY KEY (dev, ino, algorithm))")
+
+    def lookup(self, st, algorithm='md5'):
+        """
+        returns the cached digest for the file with stat result 'st',
+        or None if it's unknown or the file changed since it was stored
+        """
+        key = (st.st_dev, st.st_ino, algorithm)
+        with self._lock:
+            try:
+                row = self._pending[key]
+            except KeyError:
+                row = self._select(self._conn, key)
+                if row is None and self._base_conn is not None:
+                    row = self._select(self._base_conn, key)
+
+            if row is not None and row[0] == st.st_size and \
+                    row[1] == st.st_mtime:
+                self.hits += 1
+                return row[2]
+
+            self.misses += 1
+            return None
+
+    def _select(self, conn, key):
+        return conn.execute("SELECT size, mtime, digest FROM digests "
+                            "WHERE dev = ? AND ino = ? AND algorithm = ?",
+                            key).fetchone()
+
+    def store(self, st, digest, algorithm='md5'):
+        key = (st.st_dev, st.st_ino, algorithm)
+        with self._lock:
+            self._pending[key] = (st.st_size, st.st_mtime, digest)
+            if len(self._pending) >= self.BATCH_SIZE:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)",
+                [key + value for key, value in self._pending.items()])
+        self._pending = {}
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def merge_from(self, filename):
+        """
+        stores the digests of another cache file in this one
+        """
+        with self._lock:
+            self._flush()
+            self._conn.execute("ATTACH DATABASE ? AS other", (filename,))
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO digests "
+                        "SELECT dev, ino, algorithm, size, mtime, digest "
+                        "FROM other.digests")
+            finally:
+                self._conn.execute("DETACH DATABASE other")
+
+    def report(self):
+        logging.info("hash cache: %d hits, %d misses" %
+                     (self.hits, self.misses))
@@ -0,0 +1,180 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct('iIII')    # wd, mask, cookie, len
+
+
+def _libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+    libc.inotify_init1     # raises AttributeError if not available
+    return libc
+
+
+def is_available():
+    """
+    tells if the inotify API is available in this system
+    """
+    try:
+        _libc()
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+class Inotify:
+    """
+    Minimal ctypes binding of the Linux inotify API
+    """
+    def __init__(self):
+        self._libc = _libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self._fd, path, mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read_events(self, timeout=None):
+        """
+        waits up to timeout seconds (forever if None) for events,
+        returns a list of (wd, mask, cookie, name) tuples
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+
+class TreeWatcher:
+    """
+        Watches directory trees recursively for files completely
+        written or moved into them
+    """
+
+    DIR_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+    def __init__(self, rootdirs):
+        self._inotify = Inotify()
+        self._dirs = {}     # watch descriptor -> directory
+        for rootdir in rootdirs:
+            self.watch_tree(rootdir)
+
+    def watch_tree(self, rootdir):
+        """
+        adds watches for rootdir and all its non hidden subdirectories,
+        returns the files already found on them
+        """
+        found = []
+        for root, subFolders, files in os.walk(rootdir):
+            subFolders[:] = [sf for sf in subFolders if not sf.startswith('.')]
+            try:
+                wd = self._inotify.add_watch(root, self.DIR_MASK)
+            except OSError as e:
+                logging.warning("Unable to watch %s: %s" % (root, e))
+                continue
+            self._dirs[wd] = root
+            found.extend(os.path.join(root, file) for file in files)
+        return found
+
+    def _handle(self, events, paths):
+        overflow = False
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+
+            directory = self._dirs.get(wd)
+            if directory is None or name.startswith('.'):
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # files may have been written before the watch was set
+                    paths.update(self.watch_tree(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                paths.add(path)
+        return overflow
+
+    def wait(self, timeout=None, quiet=1.0, max_delay=10.0):
+        """
+        waits up to timeout seconds (forever if None) for changes,
+        bursts of events are coalesced until no events arrive for
+        'quiet' seconds, or for 'max_delay' seconds at most.
+
+        returns a (paths, overflow) tuple, where overflow tells that
+        events were lost and the trees need a full rescan
+        """
+        paths = set()
+        overflow = self._handle(self._inotify.read_events(timeout), paths)
+
+        if paths or overflow:
+            deadline = time.time() + max_delay
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                events = self._inotify.read_events(min(quiet, remaining))
+                if not events:
+                    break
+                overflow = self._handle(events, paths) or overflow
+
+        return paths, overflow
+
+    def close(self):
+        self._inotify.close()
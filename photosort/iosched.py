@@ -0,0 +1,203 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+import stats
+
+NETWORK_FILESYSTEMS = frozenset(['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3',
+                                 'sshfs', 'fuse.sshfs', '9p', 'afs', 'ceph',
+                                 'glusterfs', 'fuse.glusterfs', 'davfs',
+                                 'fuse.s3fs'])
+
+# default concurrent reads/writes per device
+NETWORK_LIMIT = 2
+ROTATIONAL_LIMIT = 1
+LOCAL_LIMIT = 4
+
+
+def _unescape_mount(field):
+    return field.replace('\\040', ' ').replace('\\011', '\t') \
+                .replace('\\012', '\n').replace('\\134', '\\')
+
+
+def filesystem_type(path, mounts_file='/proc/mounts'):
+    """
+    type of the filesystem mounted on path (i.e. 'ext4' or 'nfs4'),
+    None if it can't be told
+    """
+    path = os.path.realpath(path)
+    found, found_type = '', None
+    try:
+        with open(mounts_file, 'r') as f_in:
+            for line in f_in:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = _unescape_mount(fields[1])
+                if (path == mount or
+                        path.startswith(mount.rstrip('/') + '/')) and \
+                        len(mount) >= len(found):
+                    found, found_type = mount, fields[2]
+    except IOError:
+        return None
+    return found_type
+
+
+def is_rotational(st_dev):
+    """
+    tells if the block device st_dev is a spinning disk, None if
+    it isn't a block device or it's unknown
+    """
+    device = '/sys/dev/block/%d:%d' % (os.major(st_dev), os.minor(st_dev))
+    for queue in (os.path.join(device, 'queue'),            # whole disk
+                  os.path.join(device, '..', 'queue')):     # partition
+        try:
+            with open(os.path.join(queue, 'rotational'), 'r') as f_in:
+                return f_in.read().strip() == '1'
+        except IOError:
+            continue
+    return None
+
+
+def default_limit(path, st_dev):
+    """
+    concurrency for the device of path: low for network filesystems
+    and spinning disks, which slow down with random accesses
+    """
+    if filesystem_type(path) in NETWORK_FILESYSTEMS:
+        return NETWORK_LIMIT
+    if is_rotational(st_dev):
+        return ROTATIONAL_LIMIT
+    return LOCAL_LIMIT
+
+
+class _Device:
+    """
+        slots of a device, the threads waiting for one are served
+        by inode order, for locality on disk
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiting = []      # heap of (inode, arrival)
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, inode):
+        with self._cond:
+            if self.active < self.limit and not self._waiting:
+                self.active += 1
+                return
+            key = (inode, next(self._arrivals))
+            heapq.heappush(self._waiting, key)
+            while self.active >= self.limit or self._waiting[0] != key:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self.active += 1
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+
+class _Slots:
+
+    def __init__(self, devices):
+        self._devices = devices     # [(device, inode)] sorted by st_dev
+
+    def __enter__(self):
+        start = time.time()
+        acquired = []
+        try:
+            for device, inode in self._devices:
+                device.acquire(inode)
+                acquired.append(device)
+        except:
+            for device in reversed(acquired):
+                device.release()
+            raise
+        if stats.enabled:
+            stats.record('io_wait', time.time() - start)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        for device, inode in reversed(self._devices):
+            device.release()
+        return False
+
+
+class _NoSlots:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+NO_SLOTS = _NoSlots()
+
+
+class IOScheduler:
+    """
+        Limits the concurrent reads and writes of each device (by
+        st_dev). The limit of a device is the one configured for a
+        directory on it with set_limit, or default_limit() otherwise.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limits = {}       # directory -> configured limit
+        self._devices = {}      # st_dev -> _Device
+
+    def set_limit(self, directory, limit):
+        """
+        limits the concurrency of the device of directory, which is
+        looked up when it's first used (it may not be mounted yet)
+        """
+        with self._lock:
+            self._limits[directory] = limit
+
+    def _configured_limit(self, st_dev):
+        for directory, limit in sorted(self._limits.items()):
+            try:
+                if limit and os.stat(directory).st_dev == st_dev:
+                    return limit
+            except OSError:
+                continue
+        return None
+
+    def _device(self, path, st):
+        with self._lock:
+            device = self._devices.get(st.st_dev)
+            if device is None:
+                limit = self._configured_limit(st.st_dev)
+                if limit is None:
+                    limit = default_limit(path, st.st_dev)
+                logging.debug("I/O concurrency for %s (device %d): %d" %
+                              (path, st.st_dev, limit))
+                device = self._devices[st.st_dev] = _Device(limit)
+            return device
+
+    def slots(self, *files):
+        """
+        context manager holding a slot of the device of each (path,
+        stat) in files while the block runs
+        """
+        devices = {}
+        for path, st in files:
+            if st.st_dev not in devices:
+                devices[st.st_dev] = (self._device(path, st), st.st_ino)
+        return _Slots([devices[st_dev] for st_dev in sorted(devices)])
@@ -0,0 +1,159 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# Append-only journal of the changes made to the CSV PhotoDB since it
+# was last written. Each change is a CSV row:
+#
+#   op, time, hash, directory, name, type, size, crc32
+#
+# where op is ADD ('+') or REMOVE ('-'), and the crc32 covers the rest of the row, so
+# a record torn by a crash is told apart and dropped.
+
+import csv
+import logging
+import os
+import time
+import zlib
+
+ADD = '+'
+REMOVE = '-'
+OPS = (ADD, REMOVE)
+
+
+def _crc(fields):
+    return '%08x' % (zlib.crc32('\x00'.join(fields)) & 0xffffffff)
+
+
+class Journal:
+    """
+        Records are flushed to the file as they are appended, and
+        fsync'ed every 'sync_records' records or 'sync_seconds' seconds
+        (and on sync()), so a crash loses at most that much
+    """
+
+    def __init__(self, filename, sync_records=64, sync_seconds=1.0):
+        self._filename = filename
+        self._sync_records = sync_records
+        self._sync_seconds = sync_seconds
+        self._f_out = None
+        self._writer = None
+        self._unsynced = 0
+        self._last_sync = time.time()
+        self.started = None     # time of the first record
+
+    def _rows(self):
+        """
+        yields the valid rows of the journal, None after them if
+        the journal ends with a torn or corrupted record
+        """
+        with open(self._filename, 'rb') as f_in:
+            reader = csv.reader(f_in)
+            while True:
+                try:
+                    row = reader.next()
+                except StopIteration:
+                    return
+                except csv.Error:
+                    row = []
+                if len(row) != 8 or row[0] not in OPS or \
+                        _crc(row[:7]) != row[7]:
+                    yield None
+                    return
+                yield row
+
+    def replay(self):
+        """
+        yields (op, hash, record) for the records of the journal,
+        a torn record at the end (and anything after it) is dropped
+        """
+        if not os.path.exists(self._filename):
+            return
+
+        rows = list(self._rows())
+        if rows and rows[-1] is None:
+            rows.pop()
+            logging.warning("DB journal %s ends with a corrupted record, "
+                            "%d records recovered" % (self._filename,
+                                                      len(rows)))
+            self._rewrite(rows)
+
+        if rows:
+            self.started = float(rows[0][1])
+        for op, when, hash, file_dir, file_name, file_type, size, crc in rows:
+            yield op, hash, {'dir': file_dir,
+                             'name': file_name,
+                             'type': file_type,
+                             'size': int(size) if size else None}
+
+    def _rewrite(self, rows):
+        """
+        replaces the journal with the given valid rows, so new
+        records aren't appended after a torn one
+        """
+        tmp_filename = self._filename + '.tmp'
+        with open(tmp_filename, 'wb') as f_out:
+            csv.writer(f_out).writerows(rows)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.rename(tmp_filename, self._filename)
+
+    def append(self, op, hash, record):
+        if self._f_out is None:
+            self._f_out = open(self._filename, 'ab')
+            self._writer = csv.writer(self._f_out)
+        now = time.time()
+        if self.started is None:
+            self.started = now
+
+        size = record.get('size')
+        fields = [op, '%.3f' % now, hash, record['dir'], record['name'],
+                  record['type'], str(size) if size is not None else '']
+        self._writer.writerow(fields + [_crc(fields)])
+        self._f_out.flush()
+
+        self._unsynced += 1
+        if self._unsynced >= self._sync_records or \
+                now - self._last_sync >= self._sync_seconds:
+            self.sync()
+
+    def sync(self):
+        if self._f_out is not None and self._unsynced:
+            os.fsync(self._f_out.fileno())
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def size(self):
+        try:
+            return os.path.getsize(self._filename)
+        except OSError:
+            return 0
+
+    def age(self):
+        """
+        seconds since the first record was appended, 0 when empty
+        """
+        if self.started is None:
+            return 0
+        return time.time() - self.started
+
+    def close(self):
+        if self._f_out is not None:
+            self.sync()
+            self._f_out.close()
+            self._f_out = None
+            self._writer = None
+
+    def reset(self):
+        """
+        empties the journal, once its records are in the DB file
+        """
+        self.close()
+        try:
+            os.remove(self._filename)
+        except OSError:
+            pass
+        self.started = None
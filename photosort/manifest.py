@@ -0,0 +1,80 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# Directories of the output dir as they were when the last incremental
+# rebuilddb indexed them, one CSV row each:
+#
+#   directory, mtime, count, subdirectory, subdirectory, ...
+#
+# the directory relative to the output dir, its mtime, the number of
+# media files indexed from it, and the names of its subdirectories.
+
+import csv
+import logging
+import os
+
+
+class Manifest:
+    """
+        A directory whose mtime hasn't changed since it was recorded
+        had no files added, removed or renamed, so its files don't
+        need to be listed again, and its subdirectories are the
+        recorded ones.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self.dirs = {}      # directory -> (mtime, count, subdirectories)
+
+    def load(self):
+        self.dirs = {}
+        try:
+            with open(self._filename, 'rb') as f_in:
+                for row in csv.reader(f_in):
+                    self.dirs[row[0]] = (float(row[1]), int(row[2]), row[3:])
+        except IOError:
+            pass
+        except (csv.Error, IndexError, ValueError) as e:
+            logging.warning("Ignoring the rebuilddb manifest %s: %s" %
+                            (self._filename, e))
+            self.dirs = {}
+        return self.dirs
+
+    def unchanged_subdirs(self, directory, mtime):
+        """
+        returns the subdirectories recorded for directory if its
+        mtime is the recorded one, None otherwise
+        """
+        known = self.dirs.get(directory)
+        if known is None or known[0] != mtime:
+            return None
+        return known[2]
+
+    def count(self, directory):
+        return self.dirs[directory][1]
+
+    def write(self, dirs):
+        """
+        replaces the manifest with the given directories
+        """
+        self.dirs = dirs
+        tmp_filename = self._filename + '.tmp'
+        with open(tmp_filename, 'wb') as f_out:
+            writer = csv.writer(f_out, lineterminator='\n')
+            for directory in sorted(dirs):
+                mtime, count, subdirs = dirs[directory]
+                writer.writerow([directory, repr(mtime), count] + subdirs)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.rename(tmp_filename, self._filename)
+
+    def remove(self):
+        self.dirs = {}
+        try:
+            os.remove(self._filename)
+        except OSError:
+            pass
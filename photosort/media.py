@@ -5,6 +5,7 @@ __email__ = "miguelangel@ajo.es"
 __copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
 __license__ = "GPLv3"
 
+import errno
 import filecmp
 import hashlib
 import logging
@@ -14,34 +15,75 @@ import stat
 import sys
 import datetime
 import shutil
+import time
+
+import copyfile
+import iosched
+import stats
+import xattrs
+
+PHOTO_EXTENSIONS = frozenset(['jpeg', 'jpg', 'cr2', 'raw', 'png', 'arw', 'thm', 'orf'])
+MOVIE_EXTENSIONS = frozenset(['mpeg', 'mpg', 'mov', 'mp4', 'avi'])
+MEDIA_EXTENSIONS = PHOTO_EXTENSIONS | MOVIE_EXTENSIONS
 
 
 class MediaFile:
 
-    def __init__(self, filename):
+    # hashcache.HashCache shared by all the media files, if any
+    hash_cache = None
+
+    # read back the copies made across devices to check their digest
+    verify_copies = False
+
+    # iosched.IOScheduler limiting the reads and copies per device, if any
+    io_scheduler = None
+
+    # keep the digests in extended attributes of the files, and use them
+    use_xattrs = False
+
+    def __init__(self, filename, st=None):
         self._filename = filename
+        self._stat = st     # stat result from the walker, if any
         self._file_type = MediaFile.guess_file_type(filename)
         self._hash = None
+        self._digest = None
+        self._partial_digest = None
+        self._datetime = None
+        self._xattrs = None
+        self.copy_result = None     # how it was last moved
 
     @staticmethod
     def guess_file_type(filename):
 
         extension = filename.lower().split('.')[-1]
-        if extension in ('jpeg', 'jpg', 'cr2', 'raw', 'png', 'arw', 'thm', 'orf'):
+        if extension in PHOTO_EXTENSIONS:
             return 'photo'
-        if extension in ('mpeg', 'mpg', 'mov', 'mp4', 'avi'):
+        if extension in MOVIE_EXTENSIONS:
             return 'movie'
         return 'unknown'
 
     @staticmethod
-    def build_for(filename):
+    def io_slots(*files):
+        """
+        context manager holding an I/O slot for the devices of the
+        (path, stat) files, when there is a scheduler
+        """
+        if MediaFile.io_scheduler is None:
+            return iosched.NO_SLOTS
+        return MediaFile.io_scheduler.slots(*files)
+
+    @staticmethod
+    def build_for(filename, st=None):
 
         file_type = MediaFile.guess_file_type(filename)
         if file_type is 'photo':
             import photo    # delayed import to avoid circular dependencies
-            return photo.Photo(filename)
+            return photo.Photo(filename, st)
+        elif file_type is 'movie':
+            import movie
+            return movie.Movie(filename, st)
         else:
-            return MediaFile(filename)
+            return MediaFile(filename, st)
 
     def get_filename(self):
         return os.path.basename(self._filename)
@@ -52,26 +94,148 @@ class MediaFile:
     def get_path(self):
         return self._filename
 
-    def hash(self, hasher=None, blocksize=65536):
-        if self._hash is not None:
-            return self._hash
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self._filename)
+        return self._stat
+
+    def size(self):
+        return self.stat().st_size
+
+    def _stored_xattrs(self):
+        """
+        the values kept in the extended attributes of the file, if
+        they are still valid for it
+        """
+        if not MediaFile.use_xattrs:
+            return {}
+        if self._xattrs is None:
+            self._xattrs = xattrs.read(self._filename, self.stat()) or {}
+        return self._xattrs
+
+    def _xattr_values(self):
+        """
+        values to keep in the extended attributes besides the digest
+        """
+        return {}
+
+    def store_xattrs(self):
+        """
+        keeps the digest of the file in its extended attributes,
+        when they are enabled and the digest is known
+        """
+        if not MediaFile.use_xattrs or self._digest is None:
+            return
+        values = {'digest': self._digest, 'algorithm': 'md5'}
+        values.update(self._xattr_values())
+        stored = self._stored_xattrs()
+        if [name for name, value in values.items()
+                if stored.get(name) != value]:
+            if xattrs.write(self._filename, self.stat(), values):
+                self._xattrs = values
+
+    @stats.timed('hash')
+    def _content_hash(self, hasher=None, blocksize=65536):
+        """
+        hexadecimal digest of the file contents, the hash cache
+        is checked first when the default hasher is used
+        """
+        if hasher is None and self._digest is not None:
+            return self._digest
+
+        if hasher is None and \
+                self._stored_xattrs().get('algorithm') == 'md5':
+            self._digest = self._xattrs['digest']
+            return self._digest
+
+        cache = MediaFile.hash_cache if hasher is None else None
+        if cache is not None:
+            st = os.stat(self._filename)
+            digest = cache.lookup(st)
+            if digest is not None:
+                self._digest = digest
+                return digest
 
         if hasher is None:
             hasher = hashlib.md5()
+            default_hasher = True
+        else:
+            default_hasher = False
 
-        with open(self._filename, 'rb') as afile:
+        nbytes = 0
+        with MediaFile.io_slots((self._filename, self.stat())), \
+                open(self._filename, 'rb') as afile:
             buf = afile.read(blocksize)
             while len(buf) > 0:
                 hasher.update(buf)
+                nbytes += len(buf)
                 buf = afile.read(blocksize)
+        if stats.enabled:
+            stats.count_bytes('hash', nbytes)
+
+        digest = hasher.hexdigest()
+        if default_hasher:
+            self._digest = digest
+        if cache is not None:
+            cache.store(st, digest)
+        return digest
+
+    @staticmethod
+    @stats.timed('partial_hash')
+    def partial_hash_of(filename, blocksize=65536, st=None):
+        """
+        digest of the first and the last blocks of a file
+        """
+        hasher = hashlib.md5()
+        if MediaFile.io_scheduler is not None and st is None:
+            st = os.stat(filename)
+        with MediaFile.io_slots((filename, st)), open(filename, 'rb') as afile:
+            hasher.update(afile.read(blocksize))
+            afile.seek(0, os.SEEK_END)
+            end = afile.tell()
+            if end > blocksize:
+                afile.seek(max(blocksize, end - blocksize))
+                hasher.update(afile.read(blocksize))
+        if stats.enabled:
+            stats.count_bytes('partial_hash', min(end, 2 * blocksize))
+        return hasher.hexdigest()
+
+    def partial_hash(self):
+        """
+        cheap head+tail digest, used to tell files apart before
+        reading them completely to calculate the hash
+        """
+        if self._partial_digest is None:
+            self._partial_digest = MediaFile.partial_hash_of(
+                self._filename, st=self.stat())
+        return self._partial_digest
 
-            self._hash = hasher.hexdigest()
+    def hash(self, hasher=None, blocksize=65536):
+        if self._hash is not None:
             return self._hash
 
+        self._hash = self._content_hash(hasher, blocksize)
+        return self._hash
+
+    def known_hash(self):
+        """
+        the hash if it has been calculated already, None otherwise
+        """
+        return self._hash
+
     def datetime(self):
+        """
+        date and time of the media, read once per object
+        """
+        if self._datetime is None:
+            self._datetime = self._read_datetime()
+        return self._datetime
 
-        ct1 = os.path.getmtime(self._filename)
-        ct2 = os.path.getctime(self._filename)
+    def _read_datetime(self):
+
+        st = self.stat()
+        ct1 = st.st_mtime
+        ct2 = st.st_ctime
 
         ct = min(ct1,ct2) # it can differ from windows to UN*X
 
@@ -107,6 +271,67 @@ class MediaFile:
                 os.mkdir(total_path,mode | stat.S_IXUSR)
 
 
+    def _copy_to(self, new_filename):
+        """
+        copies the file to new_filename, with the copy engine, hashing
+        it on the way if the digest isn't known yet. The copy is written
+        aside and renamed into place once complete (and verified)
+        """
+        hasher = hashlib.md5() if self._digest is None else None
+        tmp_filename = new_filename + '.photosort-tmp'
+        new_dir = os.path.dirname(new_filename) or '.'
+        try:
+            with MediaFile.io_slots((self._filename, self.stat()),
+                                    (new_dir, os.stat(new_dir))):
+                result = copyfile.copy_file(self._filename, tmp_filename,
+                                            hasher)
+            digest = result.digest or self._digest
+            if result.size != self.stat().st_size:
+                raise IOError("incomplete copy of %s, %d of %d bytes" %
+                              (self._filename, result.size, self.size()))
+
+            if MediaFile.verify_copies:
+                copied = MediaFile(tmp_filename)
+                if copied._content_hash(hashlib.md5()) != digest:
+                    raise IOError("verification of the copy of %s failed" %
+                                  self._filename)
+
+            shutil.copystat(self._filename, tmp_filename)
+            os.rename(tmp_filename, new_filename)
+        except:
+            if os.path.exists(tmp_filename):
+                os.unlink(tmp_filename)
+            raise
+
+        self._digest = digest
+        return result
+
+    def _move_file(self, new_filename):
+        """
+        renames the file when new_filename is on the same device,
+        otherwise it's copied, returns the copyfile.CopyResult
+        """
+        start = time.time()
+        size = self.size()
+        src_dev = self.stat().st_dev
+        dst_dev = os.stat(os.path.dirname(new_filename) or '.').st_dev
+        if src_dev == dst_dev:
+            try:
+                os.rename(self._filename, new_filename)
+                return copyfile.CopyResult('rename', size,
+                                           time.time() - start, None)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+
+        result = self._copy_to(new_filename)
+        os.unlink(self._filename)
+        logging.info("%s copied with %s, %d bytes at %.1f MB/s" %
+                     (new_filename, result.method, result.size,
+                      result.rate() / 1048576))
+        return result
+
+    @stats.timed('move')
     def rename_as(self,new_filename,file_mode = 0o774):
 
         try:
@@ -116,8 +341,14 @@ class MediaFile:
             return False
 
         try:
-            result = shutil.move(self._filename, new_filename)
+            self.copy_result = self._move_file(new_filename)
+            if stats.enabled and self.copy_result.method != 'rename':
+                stats.count_bytes('move', self.copy_result.size)
             os.chmod(new_filename,file_mode)
+            self._stat = None
+            self._xattrs = None
+            if self._digest is not None and MediaFile.hash_cache is not None:
+                MediaFile.hash_cache.store(os.stat(new_filename), self._digest)
         except OSError as e:
             logging.error("Unable to move: %s" % e)
             return False
@@ -126,17 +357,14 @@ class MediaFile:
             logging.error("Unable to move: %s" % e)
             return False
 
-        except shutil.Error as e:
-            logging.error("Unable to move: %s" % e)
-            return False
-
         except:
             raise
 
         return True
 
-    def calculate_datetime(self,format):
-        dt = self.datetime()
+    def calculate_datetime(self,format,dt=None):
+        if dt is None:
+            dt = self.datetime()
         data = {'year': dt.year, 'month': dt.month, 'day': dt.day,
                 'hour': dt.hour, 'minute': dt.minute, 'second': dt.second }
 
@@ -144,7 +372,8 @@ class MediaFile:
 
     def move_to_directory_with_date(self,directory,dir_format,file_format='',file_mode=0o774):
 
-        out_dir = directory + "/" + self.calculate_datetime(dir_format)
+        dt = self.datetime()
+        out_dir = directory + "/" + self.calculate_datetime(dir_format, dt)
 
         try:
             os.mkdir(out_dir)
@@ -153,7 +382,7 @@ class MediaFile:
             pass # it already exists
 
         if file_format:
-            file_prefix = self.calculate_datetime(file_format) + self.get_filename()
+            file_prefix = self.calculate_datetime(file_format, dt) + self.get_filename()
         else:
             file_prefix = self.get_filename()
         new_filename = out_dir + "/" + file_prefix
@@ -161,6 +390,9 @@ class MediaFile:
 
         if self.rename_as(new_filename, file_mode):
             self._filename = new_filename
+            if self._digest is not None:
+                logging.debug("%s moved with md5 %s" %
+                              (new_filename, self._digest))
             return True
         else:
             return False
@@ -0,0 +1,108 @@
+# -*- mode: python; coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import datetime
+import logging
+import os
+import struct
+import sys
+
+import media
+
+# movies with QuickTime/ISO base media atoms
+ATOM_EXTENSIONS = ('mov', 'mp4')
+
+# seconds from 1904-01-01 (QuickTime epoch) to 1970-01-01
+QUICKTIME_EPOCH_OFFSET = 2082844800
+
+MAX_ATOMS = 1024
+
+
+def _atoms(f_in, start, end):
+    """
+    yields (type, payload offset, payload size) for the atoms between
+    the start and end offsets, only the atom headers are read
+    """
+    offset = start
+    for i in range(MAX_ATOMS):
+        if offset + 8 > end:
+            return
+        f_in.seek(offset)
+        size, atom_type = struct.unpack('>I4s', f_in.read(8))
+        header_size = 8
+        if size == 1:       # 64 bit size follows the type
+            size = struct.unpack('>Q', f_in.read(8))[0]
+            header_size = 16
+        elif size == 0:     # the atom extends to the end
+            size = end - offset
+
+        if size < header_size:
+            logging.debug("Corrupted %s atom at offset %d" %
+                          (atom_type, offset))
+            return
+
+        yield atom_type, offset + header_size, size - header_size
+        offset += size
+
+
+def read_creation_time(filename):
+    """
+    returns the creation time stored in the moov/mvhd atom, as
+    seconds since the QuickTime epoch, or None if not found
+    """
+    with open(filename, 'rb') as f_in:
+        f_in.seek(0, os.SEEK_END)
+        file_size = f_in.tell()
+        try:
+            for atom_type, offset, size in _atoms(f_in, 0, file_size):
+                if atom_type != 'moov':
+                    continue
+                for child_type, child_offset, child_size in \
+                        _atoms(f_in, offset, offset + size):
+                    if child_type == 'mvhd':
+                        f_in.seek(child_offset)
+                        data = f_in.read(12)
+                        if ord(data[0]) == 1:
+                            return struct.unpack_from('>Q', data, 4)[0]
+                        return struct.unpack_from('>I', data, 4)[0]
+                return None
+        except struct.error:
+            logging.debug("Truncated atoms in %s" % filename)
+    return None
+
+
+class Movie(media.MediaFile):
+
+    def _container_datetime(self):
+        extension = self._filename.lower().split('.')[-1]
+        if extension not in ATOM_EXTENSIONS:
+            return None
+
+        creation_time = read_creation_time(self._filename)
+        if not creation_time:
+            return None
+        try:
+            return datetime.datetime.fromtimestamp(creation_time -
+                                                   QUICKTIME_EPOCH_OFFSET)
+        except (ValueError, OverflowError, OSError) as e:
+            logging.debug("Invalid creation time %d in %s: %s" %
+                          (creation_time, self._filename, e))
+            return None
+
+    def _read_datetime(self):
+        dt = self._container_datetime()
+        logging.debug("date and time: " + str(dt))
+        if dt is None:
+            dt = media.MediaFile._read_datetime(self)
+
+        return dt
+
+
+if __name__ == "__main__":
+    movie = Movie(sys.argv[1])
+    print(movie)
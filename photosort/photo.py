@@ -13,15 +13,34 @@ import sys
 import time
 import logging
 
+import exif
 import media
+import stats
 
 class Photo(media.MediaFile):
 
-    def __init__(self, filename):
-        media.MediaFile.__init__(self, filename)
+    def __init__(self, filename, st=None):
+        media.MediaFile.__init__(self, filename, st)
         self.__exif_data = None
+        self.__exif_datetime = None
+        self.__exif_datetime_read = False
 
+    @stats.timed('exif')
     def _exif_data(self):
+        """Returns a dictionary with the exif date tags, read from
+         the file headers, or from the PIL Image item for formats
+         the header reader doesn't know. The file is only read
+         the first time. """
+        if self.__exif_data is not None:
+            return self.__exif_data
+
+        exif_data = exif.read_exif_dates(self._filename)
+        if exif_data is not None:
+            self.__exif_data = exif_data
+            return exif_data
+        return self._pil_exif_data()
+
+    def _pil_exif_data(self):
         """Returns a dictionary from the exif data of an
          PIL Image item. """
         self.__exif_data = {}
@@ -29,14 +48,14 @@ class Photo(media.MediaFile):
             image = Image.open(self._filename)
         except IOError as e:
             if str(e).startswith("cannot identify image file"):
-                return {}
+                return self.__exif_data
             else:
                 raise
 
         try:
             info = image._getexif()
         except (AttributeError, IndexError):
-            return {}
+            return self.__exif_data
 
 
         if info:
@@ -47,6 +66,35 @@ class Photo(media.MediaFile):
         return self.__exif_data
 
     def _exif_datetime(self):
+        if not self.__exif_datetime_read:
+            self.__exif_datetime = self._stored_exif_datetime()
+            if self.__exif_datetime is False:
+                self.__exif_datetime = self._parse_exif_datetime()
+            self.__exif_datetime_read = True
+        return self.__exif_datetime
+
+    def _stored_exif_datetime(self):
+        """
+        the EXIF date kept in the extended attributes, False if
+        there isn't one to trust
+        """
+        value = self._stored_xattrs().get('exif_datetime')
+        if value is None:
+            return False
+        if not value:
+            return None     # the photo has no EXIF date
+        try:
+            return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return False
+
+    def _xattr_values(self):
+        exif_datetime = self._exif_datetime()
+        if exif_datetime is None:
+            return {'exif_datetime': ''}
+        return {'exif_datetime': str(exif_datetime)}
+
+    def _parse_exif_datetime(self):
         exif_datetime_str = ""
 
         exif_data = self._exif_data()
@@ -84,11 +132,11 @@ class Photo(media.MediaFile):
         else:
             return None
 
-    def datetime(self):
+    def _read_datetime(self):
         dt = self._exif_datetime()
         logging.debug("date and time: " + str(dt))
         if dt is None:
-            dt = media.MediaFile.datetime(self)
+            dt = media.MediaFile._read_datetime(self)
 
         return dt
 
@@ -100,7 +148,7 @@ class Photo(media.MediaFile):
         if self._hash is not None:
             return self._hash
 
-        media_hash = media.MediaFile.hash(self)
+        media_hash = self._content_hash()
         exif_datetime = self._exif_datetime()
 
         if exif_datetime is not None:
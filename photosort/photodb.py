@@ -8,58 +8,323 @@ __copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
 __license__ = "GPLv3"
 
 import csv
+import heapq
 import logging
 import os.path
+import sqlite3
+
+import dbindex
+import journal
+import media
+import snapshot
+import stats
+
+SQLITE_MAGIC = 'SQLite format 3\x00'
+
+
+def is_sqlite_file(filename):
+    """
+    checks the header of filename to tell SQLite databases
+    apart from the CSV ones
+    """
+    try:
+        with open(filename, 'rb') as f_in:
+            return f_in.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+    except IOError:
+        return False
+
 
 class PhotoDB:
-    def __init__(self, config):
+    def __init__(self, config, db_file=None):
 
-        self._db_file = config.db_file()
+        if db_file is None:
+            db_file = config.db_file()
+            snapshot_file = config.db_snapshot_file()
+            journal_file = config.db_journal_file()
+        else:
+            snapshot_file = None    # partial DBs, i.e. of rebuilddb
+            journal_file = None
+        self._db_file = db_file
+        self._snapshot_file = snapshot_file
+        self._snapshot = None
+        self._journal = None
+        if journal_file is not None:
+            self._journal = journal.Journal(journal_file)
+        self._journal_limits = config.db_journal_limits()
+        self._dirty = False         # changes not in the DB file
+        self._unjournaled = False   # changes not in the journal either
         self._output_dir = config.output_dir()
         self._file_mode = config.output_chmod()
-        self._hashes = {}
+        self._hashes = dbindex.CompactIndex()
+        self._removed = set()       # hashes still in the snapshot
+        self._unsized = set()
+        self._partials = {}
         self.load()
 
+    @staticmethod
+    def build_for(config):
+        """
+        returns the PhotoDB implementation for the storage
+        engine selected in the configuration
+        """
+        engine = config.db_engine()
+        if engine == 'sqlite':
+            return SQLitePhotoDB(config)
+        elif engine == 'csv':
+            return PhotoDB(config)
+        else:
+            raise ValueError("Unknown DB engine: %s" % engine)
+
+    def _read_csv(self, filename):
+        """
+        yields (hash, record) for each of the entries of a CSV DB file
+        """
+        with open(filename, 'r') as f_in:
+            dbreader = csv.reader(f_in, delimiter=',')
+            try:
+                names = dbreader.next()
+            except StopIteration:
+                logging.info("DB was empty")
+                return
+
+            for row in dbreader:
+                file_dir, file_name, file_type, hash = row[:4]
+                if len(row) > 4 and row[4]:
+                    size = int(row[4])
+                else:
+                    size = None     # DB written before sizes were stored
+                yield hash, {'dir': file_dir,
+                             'name': file_name,
+                             'type': file_type,
+                             'size': size}
+
+    @stats.timed('db_load')
     def load(self, merge=False, filename=None):
         """
         loads an existing DB
 
         If 'merge' is True, the values of previously loaded DBs (if any)
         are kept.
-        If the path of a file is passed in 'filename', then
+        If the path of a file is passed in 'filename', then that file
+        is loaded instead of the configured DB file
         """
 
         if filename is None:
             filename = self._db_file
 
         if not merge:
-            self._hashes = {}
+            self._close_snapshot()
+            self._hashes = dbindex.CompactIndex()
+            self._removed = set()
+            self._unsized = set()
+        self._partials = {}
+        own_file = not merge and filename == self._db_file
         try:
             logging.info("----------")
             logging.info("DB Loading %s" % filename)
-            with open(filename, 'r') as f_in:
-                dbreader = csv.reader(f_in, delimiter=',')
-                try:
-                    names = dbreader.next()
-                except StopIteration:
-                    logging.info("DB was empty")
-                    return
-
-                for file_dir, file_name, file_type, hash in dbreader:
-                    self._hashes[hash] = {'dir': file_dir,
-                                              'name': file_name,
-                                              'type': file_type}
+            if own_file and self._load_snapshot():
+                self._replay_journal()
+                self._fill_missing_sizes()
+                return
+            for hash, record in self._read_csv(filename):
+                self._store(hash, record)
             logging.info("DB Load finished, %d entries" % len(self._hashes))
+            if stats.enabled:
+                stats.count_bytes('db_load', os.path.getsize(filename))
+            if own_file:
+                self._dirty = False
+                self._unjournaled = False
+                self._write_snapshot()
         except IOError as e:
             if e.errno==2:
-                logging.debug("DB file %s doesn't exist " % self._db_file + \
+                logging.debug("DB file %s doesn't exist " % filename + \
                     "yet, it will get created")
             else:
-                logging.error("Error opening DB file %s" % self._db_file)
+                logging.error("Error opening DB file %s" % filename)
                 raise
+        if own_file:
+            self._replay_journal()
+        self._fill_missing_sizes()
+
+    def _replay_journal(self):
+        """
+        applies the changes left in the journal by the last runs
+        """
+        if self._journal is None:
+            return
+        changes = 0
+        for op, hash, record in self._journal.replay():
+            if op == journal.REMOVE:
+                self._unindex(hash)
+            else:
+                self._index(hash, record)
+            changes += 1
+        if changes:
+            self._dirty = True
+            logging.info("DB journal: %d changes replayed" % changes)
+
+    def _close_snapshot(self):
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+
+    def _load_snapshot(self):
+        """
+        opens the snapshot of the DB file if it's up to date with it,
+        returns False if the DB file must be read instead
+        """
+        if self._snapshot_file is None:
+            return False
+        try:
+            db_stat = os.stat(self._db_file)
+            db_snapshot = snapshot.Snapshot(self._snapshot_file)
+        except (IOError, OSError, ValueError) as e:
+            logging.debug("DB snapshot not used: %s" % e)
+            return False
+
+        if not db_snapshot.is_fresh(db_stat):
+            logging.info("DB snapshot %s is stale" % self._snapshot_file)
+            db_snapshot.close()
+            return False
+
+        self._snapshot = db_snapshot
+        self._unsized = db_snapshot.hashes_with_size(None)
+        logging.info("DB Load finished, %d entries in %s" %
+                     (len(db_snapshot), self._snapshot_file))
+        return True
+
+    def _write_snapshot(self):
+        """
+        writes the snapshot of the loaded DB file, for the next runs
+        """
+        if self._snapshot_file is None:
+            return
+        writer = snapshot.SnapshotWriter(self._snapshot_file)
+        try:
+            for row in self._hashes.sorted_rows():
+                writer.add(*row)
+            for hash, record in self._hashes.other_items():
+                writer.add_other(hash, record)
+        except:
+            writer.abort()
+            raise
+        writer.close(os.stat(self._db_file))
+
+    def _merged_rows(self):
+        """
+        yields the rows of the snapshot and the in-memory index sorted
+        by digest and date, the entries of the index replace the ones
+        of the snapshot
+        """
+        index_rows = self._hashes.sorted_rows()
+        if self._snapshot is None:
+            for row in index_rows:
+                yield row
+            return
+
+        # entries of the index kept without a row
+        other_keys = self._hashes.other_keys()
+        merged = heapq.merge((((row[0], row[1]), 0, row)
+                              for row in index_rows),
+                             (((row[0], row[1]), 1, row)
+                              for row in self._snapshot.rows()))
+        last_key = None
+        for key, source, row in merged:
+            if key == last_key:
+                continue
+            last_key = key
+            if source == 1 and key in other_keys:
+                continue
+            if self._removed and \
+                    dbindex.join_hash(key[0], key[1]) in self._removed:
+                continue
+            yield row
+
+    def _other_items(self):
+        items = {}
+        if self._snapshot is not None:
+            items.update((hash, record) for hash, record
+                         in self._snapshot.other_items()
+                         if hash not in self._hashes)
+        items.update(self._hashes.other_items())
+        for hash in self._removed:
+            items.pop(hash, None)
+        return items.items()
 
+    def entries(self):
+        """
+        yields (hash, record) for all the entries of the DB
+        """
+        for digest, date, size, file_dir, file_name, file_type in \
+                self._merged_rows():
+            yield (dbindex.join_hash(digest, date),
+                   dbindex.make_record(file_dir, file_name, file_type, size))
+        for hash, record in self._other_items():
+            yield hash, record
+
+    def __len__(self):
+        count = len(self._hashes)
+        if self._snapshot is not None:
+            count += len(self._snapshot) - len(self._removed) - \
+                sum(1 for hash in self._hashes
+                    if self._snapshot.get(hash) is not None)
+        return count
+
+    def merge_from(self, filename):
+        """
+        adds the entries of another CSV DB file, entries whose hash is
+        already indexed for a different file are reported as conflicts
+        and keep the existing entry, returns the number of conflicts
+        """
+        conflicts = 0
+        for hash, record in self._read_csv(filename):
+            existing = self._lookup(hash)
+            if existing is not None and \
+                    (existing['dir'], existing['name']) != \
+                    (record['dir'], record['name']):
+                logging.warning("DB merge conflict, %s/%s has the same hash "
+                                "as %s/%s: %s" % (record['dir'], record['name'],
+                                                  existing['dir'],
+                                                  existing['name'], hash))
+                conflicts += 1
+                continue
+            self._store(hash, record)
+        return conflicts
+
+    def migrate_from(self, filename):
+        """
+        imports all the entries of another DB file into this one
+        """
+        logging.info("DB migrating entries from %s" % filename)
+        self.load(merge=True, filename=filename)
+        self.write()
+
+    @stats.timed('db_write')
     def write(self):
+        """
+        makes the changes since the DB was loaded durable. While the
+        journal is under its limits they are only synced to it,
+        otherwise the DB file and its snapshot are rewritten
+        """
+        if not self._dirty and os.path.exists(self._db_file):
+            return
+
+        if self._journal is not None and not self._unjournaled and \
+                os.path.exists(self._db_file):
+            max_bytes, max_age = self._journal_limits
+            if self._journal.size() < max_bytes and \
+                    self._journal.age() < max_age:
+                self._journal.sync()
+                return
 
+        self._write_file()
+        if self._journal is not None:
+            self._journal.reset()
+
+    def _write_file(self):
+        """
+        writes the DB file, and its snapshot, with all the entries
+        """
         try:
             os.remove(self._db_file+".bak")
         except:
@@ -70,24 +335,204 @@ class PhotoDB:
         except:
             pass
 
-        with open(self._db_file, 'w') as f_out:
+        writer = None
+        if self._snapshot_file is not None:
+            writer = snapshot.SnapshotWriter(self._snapshot_file)
+
+        try:
+            with open(self._db_file, 'w') as f_out:
+
+                dbwriter = csv.writer(f_out, delimiter=',')
+                dbwriter.writerow(['directory', 'filename', 'type', 'md5', 'size'])
+
+                for row in self._merged_rows():
+                    digest, date, size, file_dir, file_name, file_type = row
+                    if size == dbindex.NO_SIZE:
+                        size = ''
+                    dbwriter.writerow([file_dir, file_name,
+                                       dbindex.TYPES[file_type],
+                                       dbindex.join_hash(digest, date), size])
+                    if writer is not None:
+                        writer.add(*row)
+
+                for hash, record in self._other_items():
+                    size = record.get('size')
+                    if size is None:
+                        size = ''
+                    dbwriter.writerow([record['dir'], record['name'],
+                                       record['type'], hash, size])
+                    if writer is not None:
+                        writer.add_other(hash, record)
+        except:
+            if writer is not None:
+                writer.abort()
+            raise
+
+        self._dirty = False
+        self._unjournaled = False
+        if writer is not None:
+            writer.close(os.stat(self._db_file))
+            # the entries in memory are in the new snapshot now
+            self._close_snapshot()
+            self._hashes = dbindex.CompactIndex()
+            self._removed = set()
+            self._load_snapshot()
+
+    def _store(self, hash, record):
+        self._index(hash, record)
+        self._dirty = True
+        self._unjournaled = True
+
+    def _add(self, hash, record):
+        """
+        stores an entry for a file just sorted or indexed, the
+        change is appended to the journal when there is one
+        """
+        if self._journal is None:
+            self._store(hash, record)
+            return
+        self._index(hash, record)
+        self._dirty = True
+        self._journal.append(journal.ADD, hash, record)
+
+    def _remove(self, hash, record):
+        """
+        drops the entry of a file gone from the output dir, the change
+        is appended to the journal when there is one
+        """
+        self._unindex(hash)
+        self._dirty = True
+        if self._journal is None:
+            self._unjournaled = True
+        else:
+            self._journal.append(journal.REMOVE, hash, record)
+
+    def _index(self, hash, record):
+        self._hashes[hash] = record
+        self._removed.discard(hash)
+        if record.get('size') is None:
+            self._unsized.add(hash)
+        else:
+            self._unsized.discard(hash)
+
+    def _unindex(self, hash):
+        if hash in self._hashes:
+            del self._hashes[hash]
+        if self._snapshot is not None and \
+                self._snapshot.get(hash) is not None:
+            self._removed.add(hash)
+        self._unsized.discard(hash)
+        self._partials.pop(hash, None)
+
+    def _lookup(self, hash):
+        record = self._hashes.get(hash)
+        if record is None and self._snapshot is not None and \
+                hash not in self._removed:
+            record = self._snapshot.get(hash)
+        return record
+
+    def _hashes_with_size(self, size):
+        hashes = self._hashes.hashes_with_size(size)
+        if self._snapshot is not None:
+            hashes.update(self._snapshot.hashes_with_size(size))
+            hashes.difference_update(self._removed)
+        return hashes
+
+    def _file_size(self, record):
+        filename = os.path.join(self._output_dir,
+                                record['dir'], record['name'])
+        try:
+            return os.path.getsize(filename)
+        except OSError:
+            logging.debug("Unable to stat %s, size left empty" % filename)
+            return None
+
+    def _fill_missing_sizes(self):
+        """
+        stats the sorted files of the entries without size (from DBs
+        written before sizes were stored) when the DB is loaded, so
+        is_duplicate() doesn't, the sizes are stored with the next
+        write
+        """
+        for hash in list(self._unsized):
+            record = self._lookup(hash)
+            record['size'] = self._file_size(record)
+            if record['size'] is not None:
+                self._store(hash, record)
+        if self._unsized:
+            logging.warning("%d DB entries point to missing files, they "
+                            "will only match files already hashed" %
+                            len(self._unsized))
+
+    def _unsized_hashes(self):
+        """
+        hashes of the entries whose size is unknown, their sorted
+        files were missing when the DB was loaded
+        """
+        return self._unsized
+
+    def _partial_hash_of(self, hash, record):
+        """
+        head+tail digest of the sorted file for an entry, None if
+        the file can't be read
+        """
+        try:
+            return self._partials[hash]
+        except KeyError:
+            pass
+
+        filename = os.path.join(self._output_dir,
+                                record['dir'], record['name'])
+        try:
+            partial = media.MediaFile.partial_hash_of(filename)
+        except IOError:
+            partial = None
+        self._partials[hash] = partial
+        return partial
+
+    @stats.timed('db_may_be_duplicate')
+    def may_be_duplicate(self, media_file):
+        """
+        cheap checks done before the full hash of media_file is
+        calculated: a sorted file with the same size must exist,
+        and the head+tail digests must match
+        """
+        try:
+            size = media_file.size()
+        except OSError:
+            return True
+
+        # entries whose sorted file is missing can't take part in the
+        # cheap checks, they only match a full hash already known
+        unsized = self._unsized_hashes()
+        if unsized and media_file.known_hash() in unsized:
+            return True
 
-            dbwriter = csv.writer(f_out, delimiter=',')
-            dbwriter.writerow(['directory', 'filename', 'type', 'md5'])
+        candidates = self._hashes_with_size(size)
+        if not candidates:
+            logging.debug("%s: no sorted file has %d bytes" %
+                          (media_file.get_path(), size))
+            return False
 
-            for hash in self._hashes.keys():
+        try:
+            partial = media_file.partial_hash()
+        except IOError:
+            return True
 
-                file_dir, file_name, file_type = (
-                    self._hashes[hash]['dir'],
-                    self._hashes[hash]['name'],
-                    self._hashes[hash]['type'])
+        for hash in candidates:
+            if self._partial_hash_of(hash, self._lookup(hash)) in (partial, None):
+                return True
 
-                dbwriter.writerow([file_dir, file_name, file_type, hash])
+        logging.debug("%s: head/tail differs from the sorted files of "
+                      "%d bytes" % (media_file.get_path(), size))
+        return False
 
+    @stats.timed('db_add')
     def add_to_db(self, file_dir, file_name, media_file):
         try:
             hash = media_file.hash()
-        except IOError as e:
+            size = media_file.size()
+        except (IOError, OSError) as e:
             logging.error("IOError %s trying to hash %s" %
                           (e,media_file.get_path()))
             return False
@@ -96,9 +541,10 @@ class PhotoDB:
 
         # remove output dir path + '/'
         file_dir = file_dir[len(self._output_dir) + 1:]
-        self._hashes[hash] = {'dir': file_dir,
-                              'name': file_name,
-                              'type': file_type}
+        self._add(hash, {'dir': file_dir,
+                           'name': file_name,
+                           'type': file_type,
+                           'size': size})
 
         logging.info("indexed %s/%s %s %s" % (file_dir,
                                               file_name,
@@ -106,16 +552,37 @@ class PhotoDB:
                                               hash))
         return True
 
+    def remove_from_db(self, file_dir, file_name, hash):
+        """
+        removes the entry of hash if it's still the one of file_name
+        in file_dir (relative to the output dir), returns True if so
+        """
+        record = self._lookup(hash)
+        if record is None or (record['dir'], record['name']) != \
+                (file_dir, file_name):
+            return False
+
+        self._remove(hash, record)
+        logging.info("removed %s/%s %s" % (file_dir, file_name, hash))
+        return True
+
+    @stats.timed('db_is_duplicate')
     def is_duplicate(self, media_file):
         """
         checks if the given file has been already sorted
         returns True if so, False if not
+
+        The full hash is only calculated when a sorted file
+        with the same size and head/tail digest exists
         """
+        if not self.may_be_duplicate(media_file):
+            return False
+
         hash = media_file.hash()
 
-        if hash in self._hashes:
+        filename_data = self._lookup(hash)
+        if filename_data is not None:
 
-            filename_data = self._hashes[hash]
             filename2 = self._output_dir + "/" + filename_data['dir']+'/'+filename_data['name']
 
             if not media_file.is_equal_to(filename2):
@@ -126,3 +593,207 @@ class PhotoDB:
 
             return True
         return False
+
+
+class SQLitePhotoDB(PhotoDB):
+    """
+    PhotoDB stored in an SQLite file, entries are looked up through
+    the indexes instead of being loaded in memory, and write() only
+    commits the entries added since the last write
+    """
+
+    BATCH_SIZE = 1000
+
+    SCHEMA = ["CREATE TABLE IF NOT EXISTS media ("
+              " hash TEXT PRIMARY KEY,"
+              " dir TEXT NOT NULL,"
+              " name TEXT NOT NULL,"
+              " type TEXT NOT NULL,"
+              " size INTEGER)",
+              "CREATE INDEX IF NOT EXISTS media_size ON media (size)",
+              "CREATE INDEX IF NOT EXISTS media_path ON media (dir, name)"]
+
+    def __init__(self, config, db_file=None):
+        self._conn = None
+        self._pending = {}
+        self._pending_sizes = {}
+        PhotoDB.__init__(self, config, db_file)
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._db_file,
+                                         check_same_thread=False)
+            self._conn.text_factory = str
+            with self._conn:
+                for statement in self.SCHEMA:
+                    self._conn.execute(statement)
+        return self._conn
+
+    def _count(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM media").fetchone()[0]
+
+    def _commit_rows(self, rows, clear=False):
+        """
+        inserts or replaces rows of (hash, dir, name, type, size),
+        in transactions of BATCH_SIZE rows
+        """
+        conn = self._connect()
+        if clear:
+            with conn:
+                conn.execute("DELETE FROM media")
+
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.BATCH_SIZE:
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO media "
+                                     "VALUES (?, ?, ?, ?, ?)", batch)
+                batch = []
+        if batch:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO media "
+                                 "VALUES (?, ?, ?, ?, ?)", batch)
+
+    def _foreign_rows(self, filename):
+        """
+        yields the rows of another DB file, which can be either
+        SQLite or the CSV format
+        """
+        if is_sqlite_file(filename):
+            conn = sqlite3.connect(filename)
+            conn.text_factory = str
+            try:
+                for row in conn.execute("SELECT hash, dir, name, type, size "
+                                        "FROM media"):
+                    yield row
+            finally:
+                conn.close()
+        else:
+            for hash, record in self._read_csv(filename):
+                size = record['size']
+                if size is None:
+                    size = self._file_size(record)
+                yield (hash, record['dir'], record['name'], record['type'],
+                       size)
+
+    @stats.timed('db_load')
+    def load(self, merge=False, filename=None):
+        """
+        opens the DB, entries are not loaded in memory.
+
+        If the path of a file is passed in 'filename', its entries
+        are imported (CSV or SQLite), replacing the existing ones
+        unless 'merge' is True
+        """
+        self._pending = {}
+        self._pending_sizes = {}
+        self._partials = {}
+        logging.info("----------")
+        logging.info("DB Loading %s" % self._db_file)
+        self._connect()
+
+        if filename is not None and filename != self._db_file:
+            try:
+                logging.info("DB importing %s" % filename)
+                self._commit_rows(self._foreign_rows(filename),
+                                  clear=not merge)
+            except IOError as e:
+                if e.errno==2:
+                    logging.error("DB file %s doesn't exist" % filename)
+                raise
+
+        self._fill_missing_sizes()
+        logging.info("DB Load finished, %d entries" % self._count())
+
+    def migrate_from(self, filename):
+        logging.info("DB migrating entries from %s" % filename)
+        self.load(merge=True, filename=filename)
+
+    @stats.timed('db_write')
+    def write(self):
+        if not self._pending:
+            return
+
+        rows = [(hash, record['dir'], record['name'], record['type'],
+                 record.get('size'))
+                for hash, record in self._pending.items()]
+        self._commit_rows(rows)
+        logging.debug("DB committed %d entries" % len(rows))
+        self._pending = {}
+        self._pending_sizes = {}
+
+    def _store(self, hash, record):
+        self._pending[hash] = record
+        self._pending_sizes.setdefault(record.get('size'), set()).add(hash)
+
+    def _remove(self, hash, record):
+        """
+        deletes the entry right away, and any pending one
+        """
+        pending = self._pending.pop(hash, None)
+        if pending is not None:
+            self._pending_sizes[pending.get('size')].discard(hash)
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM media WHERE hash = ?", (hash,))
+
+    def _lookup(self, hash):
+        try:
+            return self._pending[hash]
+        except KeyError:
+            pass
+
+        row = self._connect().execute(
+            "SELECT dir, name, type, size FROM media WHERE hash = ?",
+            (hash,)).fetchone()
+        if row is None:
+            return None
+        return {'dir': row[0], 'name': row[1], 'type': row[2], 'size': row[3]}
+
+    def entries(self):
+        for hash, record in self._pending.items():
+            yield hash, dict(record)
+        for row in self._connect().execute(
+                "SELECT hash, dir, name, type, size FROM media"):
+            if row[0] not in self._pending:
+                yield row[0], {'dir': row[1], 'name': row[2],
+                               'type': row[3], 'size': row[4]}
+
+    def __len__(self):
+        conn = self._connect()
+        added = sum(1 for hash in self._pending
+                    if conn.execute("SELECT 1 FROM media WHERE hash = ?",
+                                    (hash,)).fetchone() is None)
+        return self._count() + added
+
+    def _hashes_with_size(self, size):
+        hashes = set(self._pending_sizes.get(size, ()))
+        hashes.update(row[0] for row in self._connect().execute(
+            "SELECT hash FROM media WHERE size = ?", (size,)))
+        return hashes
+
+    def _fill_missing_sizes(self):
+        conn = self._connect()
+        unsized = conn.execute("SELECT hash, dir, name FROM media "
+                               "WHERE size IS NULL").fetchall()
+        updates = []
+        for hash, file_dir, file_name in unsized:
+            size = self._file_size({'dir': file_dir, 'name': file_name})
+            if size is not None:
+                updates.append((size, hash))
+        if updates:
+            with conn:
+                conn.executemany("UPDATE media SET size = ? "
+                                 "WHERE hash = ?", updates)
+
+        self._unsized = set(hash for hash, file_dir, file_name in unsized)
+        self._unsized.difference_update(hash for size, hash in updates)
+        if self._unsized:
+            logging.warning("%d DB entries point to missing files, they "
+                            "will only match files already hashed" %
+                            len(self._unsized))
+
+    def _unsized_hashes(self):
+        return self._unsized.union(self._pending_sizes.get(None, ()))
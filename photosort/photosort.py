@@ -7,7 +7,10 @@ __copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
 __license__ = "GPLv3"
 
 import argparse
+import cProfile
 import logging
+import shutil
+import sqlite3
 import traceback
 
 import sys
@@ -17,6 +20,60 @@ import config
 import walk
 import os
 import media
+import checkpoint
+import hashcache
+import inotify
+import iosched
+import manifest
+import pipeline
+import readiness
+import stats
+import timeskew
+
+def _rebuild_shard(args):
+    """
+    process pool worker for the sharded rebuilddb, indexes a top level
+    directory of the output dir into a partial DB file
+    """
+    config_filename, shard_dir, ignores, partial_file = args
+
+    shard_config = config.Config(config_filename)
+    hash_cache_file = shard_config.hash_cache_file()
+    if hash_cache_file is not None:
+        # the shared cache is only read, the digests of the shard go
+        # to its own cache, merged into the shared one by the parent
+        media.MediaFile.hash_cache = hashcache.HashCache(
+            partial_file + '.hashcache', base=hash_cache_file)
+    media.MediaFile.use_xattrs = shard_config.store_xattrs()
+
+    partial_db = photodb.PhotoDB(shard_config, db_file=partial_file + '.tmp')
+    walker = walk.WalkForMedia(
+        shard_dir, ignores=ignores,
+        tracker=readiness.ReadinessTracker(*shard_config.output_readiness()),
+        skew_cache=timeskew.SkewCache(shard_config.time_skew_file(),
+                                      shard_config.time_skew_ttl()))
+    indexed = 0
+    for entry in walker.find_media_entries():
+        try:
+            media_file = media.MediaFile.build_for(entry.path, entry.stat)
+            if partial_db.add_to_db(entry.directory, entry.name, media_file):
+                media_file.store_xattrs()
+                indexed += 1
+        except sqlite3.OperationalError:
+            # e.g. a locked cache, the file would be missing in the DB
+            raise
+        except Exception:
+            logging.critical("Unexpected error: %s" % (sys.exc_info()[0]))
+    partial_db.write()
+    hits = misses = 0
+    if media.MediaFile.hash_cache is not None:
+        media.MediaFile.hash_cache.flush()
+        hits = media.MediaFile.hash_cache.hits
+        misses = media.MediaFile.hash_cache.misses
+
+    os.rename(partial_file + '.tmp', partial_file)
+    return shard_dir, indexed, hits, misses
+
 
 class PhotoSort:
 
@@ -24,59 +81,455 @@ class PhotoSort:
 
         self._config = config.Config(config_filename)
         logging.basicConfig(filename=self._config.log_file(), level=log_level)
-        self._photodb = photodb.PhotoDB(self._config)
+        self._photodb = None
         self._duplicates_dir = self._config.duplicates_dir()
         self._dir_pattern = self._config.dir_pattern()
         self._file_prefix = self._config.file_prefix()
-        self._inputs = (self._config.sources()[source]['dir']
-                        for source in self._config.sources().keys())
+        self._config_filename = config_filename
+        self._inputs = [self._config.sources()[source]['dir']
+                        for source in self._config.sources().keys()]
         self._file_mode = self._config.output_chmod()
+        self._trackers = {}
+        self._skew_cache = timeskew.SkewCache(self._config.time_skew_file(),
+                                              self._config.time_skew_ttl())
+        media.MediaFile.verify_copies = self._config.verify_copies()
+        media.MediaFile.use_xattrs = self._config.store_xattrs()
+        media.MediaFile.io_scheduler = self._io_scheduler()
 
-    def _sync_source(self,src_dir):
-        walker = walk.WalkForMedia(src_dir)
-        for file_dir,file_name in walker.find_media():
-            file_path = os.path.join(file_dir,file_name)
-            media_file = media.MediaFile.build_for(file_path)
-            if self._photodb.is_duplicate(media_file):
-                file = media_file.get_filename()
-                duplicates_path = os.path.join(self._duplicates_dir,file)
+    def _io_scheduler(self):
+        scheduler = iosched.IOScheduler()
+        scheduler.set_limit(self._config.output_dir(),
+                            self._config.output_io_concurrency())
+        for source, value in self._config.sources().items():
+            scheduler.set_limit(value['dir'],
+                                self._config.source_io_concurrency(source))
+        return scheduler
 
-                logging.info("moving to duplicates: %s" %
-                     duplicates_path)
+    def _open_db(self):
+        """
+        returns the PhotoDB, it's loaded (with the hash cache) the first
+        time it's needed, so a sync of empty sources doesn't load it
+        """
+        if self._photodb is None:
+            hash_cache_file = self._config.hash_cache_file()
+            if hash_cache_file is not None:
+                media.MediaFile.hash_cache = hashcache.HashCache(hash_cache_file)
+            self._photodb = photodb.PhotoDB.build_for(self._config)
+        return self._photodb
 
-                media_file.rename_as(duplicates_path,self._file_mode)
-            else:
-                if media_file.move_to_directory_with_date(self._photodb._output_dir,
+    def _report_hash_cache(self):
+        hash_cache = media.MediaFile.hash_cache
+        if hash_cache is not None:
+            hash_cache.flush()
+            hash_cache.report()
+
+    def _move_media(self, media_file, duplicate):
+        """
+        moves media_file to the duplicates dir, or sorts it into the
+        output dir, returns True if it was sorted
+        """
+        if duplicate:
+            file = media_file.get_filename()
+            duplicates_path = os.path.join(self._duplicates_dir,file)
+
+            logging.info("moving to duplicates: %s" %
+                 duplicates_path)
+
+            media_file.rename_as(duplicates_path,self._file_mode)
+            return False
+        else:
+            return media_file.move_to_directory_with_date(self._open_db()._output_dir,
                                                      self._dir_pattern,
                                                      self._file_prefix,
-                                                     self._file_mode):
-                    self._photodb.add_to_db(media_file.get_directory(), media_file.get_filename(), media_file)
-        self._photodb.write()
+                                                     self._file_mode)
+
+    def _sync_pipeline(self):
+        return pipeline.SyncPipeline(
+            self._open_db, self._move_media,
+            readiness_workers=self._config.sync_workers('readiness'),
+            hash_workers=self._config.sync_workers('hash'),
+            move_workers=self._config.sync_workers('move'),
+            queue_size=self._config.sync_queue_size())
+
+    def _source_walker(self, source):
+        """
+        returns a walker for the source, the readiness of its files
+        is tracked across the walks of every sync
+        """
+        if source not in self._trackers:
+            self._trackers[source] = readiness.ReadinessTracker(
+                *self._config.source_readiness(source))
+        return walk.WalkForMedia(self._config.sources()[source]['dir'],
+                                 tracker=self._trackers[source],
+                                 skew_cache=self._skew_cache)
+
+    def _sync_paths(self, walkers, paths):
+        """
+        sorts the given files from the sources, returns the
+        paths that were not ready yet
+        """
+        walker_for = {}
+        entries = []
+        for path in sorted(paths):
+            for walker in walkers:
+                if walker.is_candidate(path):
+                    try:
+                        entries.append(walker.entry_for(path))
+                    except OSError:
+                        break   # moved away or deleted meanwhile
+                    walker_for[path] = walker
+                    break
 
-    def rebuild_db(self):
+        if not entries:
+            return set()
+
+        sync_pipeline = self._sync_pipeline()
+        sync_pipeline.run(entries,
+                          lambda path, st: walker_for[path].is_ready(path, st))
+
+        if sync_pipeline.sorted:
+            self._photodb.write()
+            self._report_hash_cache()
+        return set(sync_pipeline.not_ready)
+
+    def rebuild_db(self, jobs=1, resume=False, incremental=False):
         """
         registers in the DB the media files already existing in the
         target directory to be able to detect duplicates and avoid
         overwritting
+
+        With more than one job, the top level directories of the
+        target directory are indexed in parallel processes
+
+        Progress is checkpointed by directory, with 'resume' the
+        directories completed by an interrupted run are skipped
+
+        With 'incremental', only the directories changed since the
+        last incremental rebuild are indexed, and the entries of the
+        files gone from the target directory are removed
         """
-        walker = walk.WalkForMedia(self._config.output_dir(), ignores=self._inputs)
-        for file_dir,file_name in walker.find_media():
+        if incremental:
+            return self._rebuild_db_incremental()
+        if jobs > 1:
+            return self._rebuild_db_sharded(jobs, resume)
+
+        photo_db = self._open_db()
+        output_dir = self._config.output_dir()
+        progress = checkpoint.Checkpoint(
+            self._config.db_file() + '.rebuild', output_dir,
+            self._config.rebuild_checkpoint_interval())
+        if resume and progress.load():
+            logging.info("rebuilddb: resuming, %d directories already "
+                         "indexed" % len(progress.completed))
+        else:
+            progress.remove()
+
+        tracker = readiness.ReadinessTracker(*self._config.output_readiness())
+        walker = walk.WalkForMedia(output_dir, ignores=self._inputs,
+                                   tracker=tracker, skew_cache=self._skew_cache)
+        directory = None
+        skip = complete = False
+        for entry in walker.find_candidates():
+            # the files of each directory are found together
+            if entry.directory != directory:
+                if complete:
+                    progress.done(directory)
+                    if progress.due():
+                        self._save_checkpoint(progress)
+                directory = entry.directory
+                skip = progress.is_completed(directory)
+                complete = not skip
+            if skip:
+                continue
+
             try:
-                file_path = os.path.join(file_dir, file_name)
-                media_file = media.MediaFile.build_for(file_path)
-                self._photodb.add_to_db(file_dir, file_name, media_file)
-            except:
-                logging.critical("Unexpected error: %s" % (sys.exc_info()[0]))
+                if not walker.is_ready(entry.path, entry.stat):
+                    complete = False
+                    continue
+                media_file = media.MediaFile.build_for(entry.path, entry.stat)
+                if photo_db.add_to_db(entry.directory, entry.name,
+                                      media_file):
+                    media_file.store_xattrs()
+                else:
+                    complete = False
+            except Exception:
+                complete = False
+                logging.critical("Unexpected error indexing %s: %s" %
+                                 (entry.path, traceback.format_exc()))
+        photo_db.write()
+        self._report_hash_cache()
+        progress.remove()
+
+    def _rebuild_db_incremental(self):
+        output_dir = self._config.output_dir()
+        tracker = readiness.ReadinessTracker(*self._config.output_readiness())
+        walker = walk.WalkForMedia(output_dir, ignores=self._inputs,
+                                   tracker=tracker, skew_cache=self._skew_cache)
+        if not walker.is_walkable():
+            logging.error("rebuilddb: %s can't be walked, the DB is left "
+                          "as it is" % output_dir)
+            return
+
+        photo_db = self._open_db()
+        dir_manifest = manifest.Manifest(self._config.db_file() + '.manifest')
+        dir_manifest.load()
+
+        # file name -> (hash, size) of the entries of each directory,
+        # what is left once the directories are walked is gone
+        indexed = {}
+        for hash, record in photo_db.entries():
+            indexed.setdefault(record['dir'], {})[record['name']] = \
+                (hash, record['size'])
+
+        def relative(directory):
+            return directory[len(output_dir) + 1:]
+
+        def unchanged_subdirs(directory, st):
+            return dir_manifest.unchanged_subdirs(relative(directory),
+                                                  st.st_mtime)
+
+        dirs = {}
+        failed = []
+        skipped_dirs = unchanged = indexed_files = removed = 0
+        for directory, st, sub_dirs, media_entries in \
+                walker.find_dirs(unchanged_subdirs, failed):
+            file_dir = relative(directory)
+            files = indexed.pop(file_dir, {})
+            subdirs = [os.path.basename(sub_dir) for sub_dir in sub_dirs]
+            if media_entries is None:
+                skipped_dirs += 1
+                dirs[file_dir] = (st.st_mtime, dir_manifest.count(file_dir),
+                                  subdirs)
+                continue
+
+            complete = True
+            count = 0
+            previous = dir_manifest.dirs.get(file_dir)
+            for entry in media_entries:
+                hash, size = files.pop(entry.name, (None, None))
+                # changed files get a new ctime, the ones older than the
+                # last time the directory changed were indexed then
+                if hash is not None and previous is not None and \
+                        size == entry.stat.st_size and \
+                        max(entry.stat.st_mtime,
+                            entry.stat.st_ctime) <= previous[0]:
+                    unchanged += 1
+                    count += 1
+                    continue
+                try:
+                    if not walker.is_ready(entry.path, entry.stat):
+                        complete = False
+                        continue
+                    media_file = media.MediaFile.build_for(entry.path,
+                                                           entry.stat)
+                    if photo_db.add_to_db(directory, entry.name, media_file):
+                        media_file.store_xattrs()
+                        indexed_files += 1
+                        count += 1
+                        # a modified file, its old contents are gone
+                        if hash is not None and \
+                                hash != media_file.hash() and \
+                                photo_db.remove_from_db(file_dir, entry.name,
+                                                        hash):
+                            removed += 1
+                    else:
+                        complete = False
+                except Exception:
+                    complete = False
+                    logging.critical("Unexpected error indexing %s: %s" %
+                                     (entry.path, traceback.format_exc()))
+
+            for name, (hash, size) in sorted(files.items()):
+                if photo_db.remove_from_db(file_dir, name, hash):
+                    removed += 1
+
+            # a directory that was still changing is walked again
+            # the next time
+            if complete and time.time() - st.st_mtime > 2:
+                dirs[file_dir] = (st.st_mtime, count, subdirs)
+
+        # what is under the directories that couldn't be listed is kept
+        # as it was, they are walked again the next time
+        failed = [relative(directory) for directory in failed]
+        def is_unknown(file_dir):
+            for failed_dir in failed:
+                if not failed_dir or file_dir == failed_dir or \
+                        file_dir.startswith(failed_dir + '/'):
+                    return True
+            return False
+        for file_dir, known in dir_manifest.dirs.items():
+            if is_unknown(file_dir) and file_dir not in dirs:
+                dirs[file_dir] = known
+
+        # directories gone, or not walked anymore
+        for file_dir, files in sorted(indexed.items()):
+            if is_unknown(file_dir):
+                continue
+            for name, (hash, size) in sorted(files.items()):
+                if photo_db.remove_from_db(file_dir, name, hash):
+                    removed += 1
+
+        photo_db.write()
+        dir_manifest.write(dirs)
+        logging.info("rebuilddb: %d directories unchanged, %d files "
+                     "unchanged, %d indexed, %d entries removed" %
+                     (skipped_dirs, unchanged, indexed_files, removed))
+        self._report_hash_cache()
+
+    def _save_checkpoint(self, progress):
+        """
+        makes the entries indexed so far durable, and then records
+        the directories they came from as completed
+        """
         self._photodb.write()
+        if media.MediaFile.hash_cache is not None:
+            media.MediaFile.hash_cache.flush()
+        progress.save()
+
+    def _rebuild_shards(self, shards_dir):
+        """
+        returns the top level directories of the output dir, and the
+        media files found directly on it
+        """
+        output_dir = self._config.output_dir()
+        inputs = [os.path.abspath(input) for input in self._inputs]
+        shards = []
+        top_files = []
+        for name in sorted(os.listdir(output_dir)):
+            path = os.path.join(output_dir, name)
+            if name.startswith('.') or path == shards_dir or \
+                    os.path.abspath(path) in inputs:
+                continue
+            if os.path.isdir(path):
+                shards.append(path)
+            elif media.MediaFile.guess_file_type(name) != 'unknown':
+                top_files.append(name)
+        return shards, top_files
+
+    def _rebuild_db_sharded(self, jobs, resume=False):
+        """
+        rebuilds the DB with a pool of processes, each top level directory
+        of the output dir is indexed into its own partial DB, and all of
+        them are merged at the end. With 'resume', the partial DBs left
+        by an interrupted run are reused.
+        """
+        import multiprocessing  # delayed, only the sharded rebuild uses it
+
+        output_dir = self._config.output_dir()
+        shards_dir = self._config.db_file() + '.shards'
+        if not resume and os.path.isdir(shards_dir):
+            logging.info("rebuilddb: discarding the partial DBs in %s" %
+                         shards_dir)
+            shutil.rmtree(shards_dir)
+        if not os.path.isdir(shards_dir):
+            os.mkdir(shards_dir)
+
+        shards, top_files = self._rebuild_shards(shards_dir)
+        tasks = []
+        for shard_dir in shards:
+            partial_file = os.path.join(shards_dir,
+                                        os.path.basename(shard_dir) + '.db')
+            if os.path.exists(partial_file):
+                logging.info("rebuilddb: %s already indexed in %s" %
+                             (shard_dir, partial_file))
+            else:
+                tasks.append((self._config_filename, shard_dir,
+                              self._inputs, partial_file))
+
+        hits = misses = 0
+        if tasks:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                for shard_dir, indexed, shard_hits, shard_misses in \
+                        pool.imap_unordered(_rebuild_shard, tasks):
+                    logging.info("rebuilddb: %d files indexed in %s" %
+                                 (indexed, shard_dir))
+                    hits += shard_hits
+                    misses += shard_misses
+            finally:
+                pool.close()
+                pool.join()
+
+        # opened once the pool is gone, so its connections (and the
+        # ones of the hash cache) are never shared with the workers
+        photo_db = self._open_db()
+        hash_cache = media.MediaFile.hash_cache
+        if hash_cache is not None:
+            hash_cache.hits += hits
+            hash_cache.misses += misses
+            for shard_dir in shards:
+                shard_cache = os.path.join(
+                    shards_dir, os.path.basename(shard_dir) + '.db.hashcache')
+                if os.path.exists(shard_cache):
+                    hash_cache.merge_from(shard_cache)
+
+        for file_name in top_files:
+            media_file = media.MediaFile.build_for(
+                os.path.join(output_dir, file_name))
+            photo_db.add_to_db(output_dir, file_name, media_file)
+
+        conflicts = 0
+        for shard_dir in shards:
+            partial_file = os.path.join(shards_dir,
+                                        os.path.basename(shard_dir) + '.db')
+            conflicts += photo_db.merge_from(partial_file)
+        if conflicts:
+            logging.warning("rebuilddb: %d files with the same hash found "
+                            "in different places of %s" % (conflicts, output_dir))
+
+        photo_db.write()
+        self._report_hash_cache()
+        shutil.rmtree(shards_dir)
+
+    def migrate_db(self, filename):
+        """
+        imports the entries of an existing DB file (i.e. the CSV
+        photosort.db) into the configured DB
+        """
+        self._open_db().migrate_from(filename)
 
     def sync(self):
         """
-        ensures that the media files of the input directories are sorted
+        ensures that the media files of the input directories are sorted,
+        the sources are walked and sorted concurrently
         """
-        for source,value in self._config.sources().items():
-            self._sync_source(value['dir'])
+        sources = []
+        for source in sorted(self._config.sources().keys()):
+            walker = self._source_walker(source)
+            sources.append((self._config.sources()[source]['dir'],
+                            walker.find_candidates(), walker.is_ready))
+
+        sync_pipeline = self._sync_pipeline()
+        sync_pipeline.run_sources(sources)
+        for result in sync_pipeline.results:
+            if result.sorted or result.duplicates:
+                logging.info(str(result))
+
+        # not loaded at all when the sources had nothing to sort
+        if self._photodb is not None:
+            self._photodb.write()
+            self._report_hash_cache()
 
     def monitor(self):
+        """
+        keeps the media files of the input directories sorted,
+        waiting for inotify events when available
+        """
+        backend = self._config.monitor_backend()
+        if backend == 'auto':
+            if inotify.is_available():
+                backend = 'inotify'
+            else:
+                backend = 'poll'
+
+        if backend == 'inotify':
+            self._monitor_inotify()
+        elif backend == 'poll':
+            self._monitor_poll()
+        else:
+            raise ValueError("Unknown monitor backend: %s" % backend)
+
+    def _monitor_poll(self):
         """
         regularly (10s at the time of this writting)
         ensures that the media files of the input directories are sorted
@@ -85,11 +538,59 @@ class PhotoSort:
             self.sync()
             time.sleep(10)
 
+    def _watch_sources(self, watcher):
+        """
+        (re)adds the watches for the mounted sources, returns
+        their walkers
+        """
+        sources = [source for source, value in self._config.sources().items()
+                   if os.path.isdir(value['dir'])]
+        src_dirs = [self._config.sources()[source]['dir'] for source in sources]
+        for src_dir in src_dirs:
+            watcher.watch_tree(src_dir)
+        logging.info("monitoring %s with inotify" % ", ".join(src_dirs))
+        return [self._source_walker(source) for source in sources]
+
+    def _monitor_inotify(self):
+        """
+        sorts the files written or moved into the input directories
+        as inotify reports them, files not ready yet are checked again
+        every 10s, and everything is rescanned on inotify queue
+        overflows or every rescan_interval seconds
+        """
+        watcher = inotify.TreeWatcher([])
+        walkers = self._watch_sources(watcher)
+        rescan_interval = self._config.monitor_rescan_interval()
+
+        self.sync()
+        last_rescan = time.time()
+        pending = set()
+        while True:
+            timeout = max(0, last_rescan + rescan_interval - time.time())
+            if pending:
+                timeout = min(timeout, 10)
+
+            paths, overflow = watcher.wait(timeout)
+
+            if overflow or time.time() - last_rescan >= rescan_interval:
+                if overflow:
+                    logging.warning("inotify queue overflow, rescanning sources")
+                walkers = self._watch_sources(watcher)
+                self.sync()
+                last_rescan = time.time()
+                pending = set()
+                continue
+
+            pending.update(paths)
+            if pending:
+                logging.debug("%d changed paths to check" % len(pending))
+                pending = self._sync_paths(walkers, pending)
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('op', action="store",
-                        choices=['sync', 'rebuilddb', 'monitor'],
+                        choices=['sync', 'rebuilddb', 'monitor', 'migratedb'],
                         help="Operation")
 
     group = parser.add_argument_group('Common parameters')
@@ -99,11 +600,33 @@ def main():
     group.add_argument('--debug',
                        action="store_true",
                        help="Enable debugging")
+    group.add_argument('--jobs', action="store", type=int, default=1,
+                       help="Processes used by rebuilddb")
+    group.add_argument('--resume', action="store_true",
+                       help="Continue an interrupted rebuilddb")
+    group.add_argument('--incremental', action="store_true",
+                       help="Index only what changed since the last "
+                            "incremental rebuilddb")
+    group.add_argument('--from', action="store", dest="from_db",
+                       help="DB file to import entries from (migratedb)")
+    group.add_argument('--stats', action="store_true",
+                       help="Print and log statistics of each stage")
+    group.add_argument('--profile', action="store", metavar="FILE",
+                       help="Write cProfile data of the run to FILE")
     ns = parser.parse_args()
 
+    if ns.op == "migratedb" and ns.from_db is None:
+        parser.error("migratedb requires --from")
+
     log_level = logging.INFO
     if ns.debug:
         log_level = logging.DEBUG
+    if ns.stats:
+        stats.enable()
+    if ns.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
     photo_sort = PhotoSort(ns.config, log_level)
 
     try:
@@ -111,13 +634,24 @@ def main():
             photo_sort.sync()
 
         elif ns.op == "rebuilddb":
-            photo_sort.rebuild_db()
+            photo_sort.rebuild_db(jobs=ns.jobs, resume=ns.resume,
+                                  incremental=ns.incremental)
 
         elif ns.op == "monitor":
             photo_sort.monitor()
+
+        elif ns.op == "migratedb":
+            photo_sort.migrate_db(ns.from_db)
         else:
             print("Unknown operation: %s" % ns.op)
     except:
         logging.critical("Unexpected error: %s" % (sys.exc_info()[0]))
         logging.critical(traceback.format_exc())
+    finally:
+        if ns.profile:
+            profiler.disable()
+            profiler.dump_stats(ns.profile)
+        if ns.stats:
+            print("\n".join(stats.summary()))
+            stats.log_summary()
 
@@ -0,0 +1,277 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import logging
+import Queue
+import threading
+import time
+import traceback
+
+import media
+
+_DONE = object()    # end of stage marker
+
+
+class SourceResult:
+    """
+        what was sorted from a source in a pipeline run
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.sorted = 0
+        self.duplicates = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def rate(self):
+        return self.bytes / max(self.seconds, 1e-6)
+
+    def __str__(self):
+        return ("%s: %d files sorted, %d duplicates, %.1f MB in %.1fs "
+                "(%.1f MB/s)" % (self.name, self.sorted, self.duplicates,
+                                 self.bytes / 1048576.0, self.seconds,
+                                 self.rate() / 1048576))
+
+
+class SyncPipeline:
+    """
+        Sorts media files through stages connected by bounded queues,
+        so walking, readiness checks, hashing and moves of different
+        files overlap. Each source has its own threads for every stage:
+
+          walker -> readiness workers -> hash workers -> coordinator
+                                                         -> move workers
+
+        so a slow source doesn't hold the others back. The coordinator
+        runs in the calling thread, takes the files of each source in
+        the order they were found, and it's the only one deciding
+        duplicates and writing into the PhotoDB. A file isn't decided
+        while another one with the same size or name is being moved
+        (from any source), so duplicates within a batch are resolved
+        deterministically.
+    """
+
+    def __init__(self, open_db, move_media, readiness_workers=2,
+                 hash_workers=2, move_workers=2, queue_size=64):
+        self._open_db = open_db
+        self._move_media = move_media
+        self._readiness_workers = readiness_workers
+        self._hash_workers = hash_workers
+        self._move_workers = move_workers
+        self._queue_size = queue_size
+        self._db_lock = threading.Lock()
+        self._start_time = None
+        self._threads = []
+        self.not_ready = []
+        self.sorted = 0
+        self.duplicates = 0
+        self.results = []
+
+    def _db(self):
+        """
+        the PhotoDB, only opened once a file needs it,
+        must be called with _db_lock held
+        """
+        return self._open_db()
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+        return thread
+
+    def _produce(self, source, entries, out_q, out_workers):
+        try:
+            for seq, entry in enumerate(entries):
+                out_q.put(((source, seq), entry))
+        except Exception:
+            logging.critical("Unexpected error walking for media: %s" %
+                             traceback.format_exc())
+        for i in range(out_workers):
+            out_q.put(_DONE)
+
+    def _work(self, function, in_q, out_q):
+        while True:
+            item = in_q.get()
+            if item is _DONE:
+                return
+
+            seq, value = item
+            if value is not None:
+                try:
+                    value = function(value)
+                except Exception:
+                    logging.critical("Unexpected error: %s" %
+                                     traceback.format_exc())
+                    value = None
+            out_q.put((seq, value))
+
+    def _close(self, threads, out_q, out_workers):
+        for thread in threads:
+            thread.join()
+        for i in range(out_workers):
+            out_q.put(_DONE)
+
+    def _stage(self, function, workers, in_q, out_q, out_workers):
+        threads = [self._start(self._work, function, in_q, out_q)
+                   for i in range(workers)]
+        self._start(self._close, threads, out_q, out_workers)
+
+    def _check_ready(self, is_ready):
+        def check(entry):
+            if is_ready(entry.path, entry.stat):
+                return media.MediaFile.build_for(entry.path, entry.stat)
+            self.not_ready.append(entry.path)
+            return None
+        return check
+
+    def _prefetch(self, media_file):
+        """
+        reads what is_duplicate is going to need for media_file,
+        the full hash only if the cheap checks can't tell
+        """
+        media_file.partial_hash()
+        with self._db_lock:
+            may_be_duplicate = self._db().may_be_duplicate(media_file)
+        if may_be_duplicate:
+            media_file.hash()
+        return media_file
+
+    def _move(self, item):
+        media_file, duplicate = item
+        moved = self._move_media(media_file, duplicate)
+        if moved and not duplicate:
+            media_file.hash()   # so the coordinator doesn't read it
+            media_file.store_xattrs()
+        return media_file, duplicate, moved
+
+    def _finish_move(self, item, in_flight):
+        seq, value = item
+        size, name = in_flight.pop(seq)
+        if value is None:
+            return
+
+        media_file, duplicate, moved = value
+        result = self.results[seq[0]]
+        if duplicate:
+            self.duplicates += 1
+            result.duplicates += 1
+        elif moved:
+            with self._db_lock:
+                self._db().add_to_db(media_file.get_directory(),
+                                     media_file.get_filename(),
+                                     media_file)
+            self.sorted += 1
+            result.sorted += 1
+        else:
+            return
+        result.bytes += size
+        result.seconds = time.time() - self._start_time
+
+    def _collides(self, size, name, in_flight):
+        for other_size, other_name in in_flight.values():
+            if other_size == size or other_name == name:
+                return True
+        return False
+
+    def _decide(self, seq, media_file, in_flight, move_qs, done_q):
+        try:
+            size = media_file.size()
+            name = media_file.get_filename()
+            while self._collides(size, name, in_flight):
+                self._finish_move(done_q.get(), in_flight)
+            with self._db_lock:
+                duplicate = self._db().is_duplicate(media_file)
+        except (IOError, OSError) as e:
+            logging.error("Unable to check %s: %s" %
+                          (media_file.get_path(), e))
+            return
+
+        in_flight[seq] = (size, name)
+        move_qs[seq[0]].put((seq, (media_file, duplicate)))
+
+    def _start_source(self, source, entries, is_ready, result_q, done_q):
+        """
+        starts the walker and the workers of a source, its files
+        arrive to result_q, and the moves are made from the queue
+        it returns
+        """
+        ready_q = Queue.Queue(self._queue_size)
+        hash_q = Queue.Queue(self._queue_size)
+        move_q = Queue.Queue(self._queue_size)
+
+        self._start(self._produce, source, entries, ready_q,
+                    self._readiness_workers)
+        self._stage(self._check_ready(is_ready), self._readiness_workers,
+                    ready_q, hash_q, self._hash_workers)
+        self._stage(self._prefetch, self._hash_workers,
+                    hash_q, result_q, 1)
+        self._stage(self._move, self._move_workers,
+                    move_q, done_q, 0)
+        return move_q
+
+    def run(self, entries, is_ready):
+        """
+        sorts the media files of the walk.MediaEntry items in entries,
+        is_ready(path, stat) is called for each of them, the paths of
+        the ones not ready are left in self.not_ready
+        """
+        self.run_sources([(None, entries, is_ready)])
+
+    def run_sources(self, sources):
+        """
+        sorts the files of several (name, entries, is_ready) sources
+        concurrently, like run(), what was sorted from each of them
+        is left in self.results, the threads of all of them are
+        joined before it returns
+        """
+        self._start_time = time.time()
+        self._threads = []
+        self.results = [SourceResult(name) for name, entries, is_ready
+                        in sources]
+        result_q = Queue.Queue(self._queue_size)
+        done_q = Queue.Queue()
+        move_qs = [self._start_source(index, entries, is_ready,
+                                      result_q, done_q)
+                   for index, (name, entries, is_ready)
+                   in enumerate(sources)]
+
+        reorder = {}
+        next_seqs = [0] * len(sources)
+        in_flight = {}
+        walking = len(sources)
+        while walking:
+            item = result_q.get()
+            if item is _DONE:
+                walking -= 1
+            else:
+                seq, media_file = item
+                reorder[seq] = media_file
+
+                source = seq[0]
+                while (source, next_seqs[source]) in reorder:
+                    next_seq = (source, next_seqs[source])
+                    media_file = reorder.pop(next_seq)
+                    if media_file is not None:
+                        self._decide(next_seq, media_file, in_flight,
+                                     move_qs, done_q)
+                    next_seqs[source] += 1
+
+            while not done_q.empty():
+                self._finish_move(done_q.get(), in_flight)
+
+        for move_q in move_qs:
+            for i in range(self._move_workers):
+                move_q.put(_DONE)
+        while in_flight:
+            self._finish_move(done_q.get(), in_flight)
+
+        # they are all ending, none is left running when this returns
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,82 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import logging
+import threading
+import time
+
+
+class ReadinessTracker:
+    """
+        Remembers the (size, mtime) of the files seen in a source
+        across walks. A file is ready once it has been observed
+        unchanged a number of times in a row, or when it hasn't
+        been modified for some seconds.
+
+        Observations closer than 'interval' seconds to the last one
+        counted don't count, so bursts of walks (i.e. inotify events
+        of other files) can't make a stalled upload look finished.
+    """
+
+    # observations not repeated for this long are forgotten
+    EXPIRE_SECONDS = 24 * 3600
+
+    def __init__(self, observations=2, seconds=30, interval=10):
+        self._observations = observations
+        self._seconds = seconds
+        self._interval = interval
+        self._lock = threading.Lock()
+        # path -> (size, mtime, count, last seen, last counted)
+        self._seen = {}
+        self._next_expire = time.time() + self.EXPIRE_SECONDS
+
+    def _expire(self, now):
+        if now < self._next_expire:
+            return
+        self._seen = dict((path, seen) for path, seen in self._seen.items()
+                          if now - seen[3] < self.EXPIRE_SECONDS)
+        self._next_expire = now + self.EXPIRE_SECONDS
+
+    def observe(self, path, st):
+        """
+        records an observation of the file, returns how many times
+        in a row it has been seen with the same size and mtime
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            seen = self._seen.get(path)
+            if seen is None or seen[:2] != (st.st_size, st.st_mtime):
+                count, counted = 1, now
+            elif now - seen[4] >= self._interval:
+                count, counted = seen[2] + 1, now
+            else:
+                count, counted = seen[2], seen[4]
+            self._seen[path] = (st.st_size, st.st_mtime, count, now, counted)
+        return count
+
+    def forget(self, path):
+        with self._lock:
+            self._seen.pop(path, None)
+
+    def is_ready(self, path, st, modification_lapse):
+        """
+        tells if the file at path, with stat result st, is ready to be
+        sorted. modification_lapse returns the seconds since the file
+        was modified, it's only called if the observations aren't enough
+        """
+        count = self.observe(path, st)
+        if count < self._observations:
+            lapse = modification_lapse()
+            if lapse < self._seconds:
+                logging.debug("file %s not ready, seen %d times unchanged "
+                              "and modified %d seconds ago" %
+                              (path, count, lapse))
+                return False
+
+        self.forget(path)
+        return True
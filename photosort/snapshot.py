@@ -0,0 +1,257 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# Binary snapshot of the CSV PhotoDB, memory mapped and searched in
+# place, so a run doesn't need to parse the whole CSV to start:
+#
+#   header
+#   records      fixed width, sorted by digest and date
+#   size index   (size, record) pairs sorted by size
+#   dir table    (offset, length) of each directory in the strings
+#   strings      directories and file names
+#   other        JSON with the entries whose hash isn't an md5, their
+#                strings are bytes, written as latin-1 so any name can
+#                be kept
+#
+# The header keeps the size and mtime of the CSV file it was made
+# from, the snapshot is stale when they don't match anymore.
+
+import array
+import bisect
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+import dbindex
+
+MAGIC = 'PSSNAP\x00\x02'
+
+# magic, CSV size, CSV mtime, records, dirs, and the offsets of the
+# size index, dir table, strings and other sections
+HEADER = struct.Struct('<8sQdQQQQQQ')
+
+# digest, date, size, dir, name offset, name length, type
+RECORD = struct.Struct('<16sqqIIHBx')
+
+SIZE_ENTRY = struct.Struct('<qI')
+DIR_ENTRY = struct.Struct('<II')
+
+
+class _SizeKeys:
+    """
+    sequence of the sizes in the size index, for bisect
+    """
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def __len__(self):
+        return self._snapshot._count
+
+    def __getitem__(self, index):
+        return self._snapshot._size_entry(index)[0]
+
+
+class Snapshot:
+    """
+        Read only view of a snapshot file, entries are looked up with
+        binary searches on the mapped file
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        with open(filename, 'rb') as f_in:
+            self._mm = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, self.source_size, self.source_mtime, self._count,
+             dir_count, self._sizes_offset, self._dirs_offset,
+             self._strings_offset, self._other_offset) = \
+                HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            self.close()
+            raise ValueError("%s is not a PhotoDB snapshot" % filename)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("%s is not a PhotoDB snapshot" % filename)
+
+        self._dirs = [self._string(*DIR_ENTRY.unpack_from(
+            self._mm, self._dirs_offset + i * DIR_ENTRY.size))
+            for i in range(dir_count)]
+        self._other = dict((hash.encode('latin-1'), record) for hash, record
+                           in json.loads(self._mm[self._other_offset:]).items())
+
+    def close(self):
+        self._mm.close()
+
+    def is_fresh(self, source_stat):
+        """
+        tells if the snapshot was made from the file with source_stat
+        """
+        return (self.source_size, self.source_mtime) == \
+            (source_stat.st_size, source_stat.st_mtime)
+
+    def _string(self, offset, length):
+        start = self._strings_offset + offset
+        return self._mm[start:start + length]
+
+    def _row(self, index):
+        (digest, date, size, dir_id, name_offset, name_length,
+         file_type) = RECORD.unpack_from(self._mm,
+                                         HEADER.size + index * RECORD.size)
+        return (digest, date, size, self._dirs[dir_id],
+                self._string(name_offset, name_length), file_type)
+
+    def _digest(self, index):
+        offset = HEADER.size + index * RECORD.size
+        return self._mm[offset:offset + 16]
+
+    def _find(self, digest):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._digest(middle) < digest:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._digest(low) == digest:
+            return low
+        return None
+
+    def _size_entry(self, index):
+        return SIZE_ENTRY.unpack_from(self._mm, self._sizes_offset +
+                                      index * SIZE_ENTRY.size)
+
+    def __len__(self):
+        return self._count + len(self._other)
+
+    def get(self, hash, default=None):
+        key = dbindex.split_hash(hash)
+        if key is not None:
+            # the rows of a digest with different dates are together
+            index = self._find(key[0])
+            while index is not None and index < self._count and \
+                    self._digest(index) == key[0]:
+                digest, date, size, directory, name, file_type = \
+                    self._row(index)
+                if date == key[1]:
+                    return dbindex.make_record(directory, name, file_type,
+                                               size)
+                index += 1
+
+        record = self._other.get(hash)
+        return self._other_record(record) if record else default
+
+    def _other_record(self, record):
+        return dict((str(key), value if not isinstance(value, unicode)
+                     else value.encode('latin-1'))
+                    for key, value in record.items())
+
+    def hashes_with_size(self, size):
+        """
+        returns the set of hashes of the entries of the given size,
+        None for the ones without size
+        """
+        hashes = set(hash for hash, record in self._other.items()
+                     if record.get('size') == size)
+        if size is None:
+            size = dbindex.NO_SIZE
+        index = bisect.bisect_left(_SizeKeys(self), size)
+        while index < self._count:
+            entry_size, row = self._size_entry(index)
+            if entry_size != size:
+                break
+            hashes.add(dbindex.join_hash(*self._row(row)[:2]))
+            index += 1
+        return hashes
+
+    def rows(self):
+        """
+        yields (digest, date, size, directory, name, type) for the
+        entries with md5 hashes, sorted by digest and date
+        """
+        for index in xrange(self._count):
+            yield self._row(index)
+
+    def other_items(self):
+        return [(hash, self._other_record(record))
+                for hash, record in self._other.items()]
+
+
+class SnapshotWriter:
+    """
+        Writes a snapshot from rows sorted by digest and date, added
+        with add()
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._tmp_filename = filename + '.tmp'
+        self._f_out = open(self._tmp_filename, 'wb')
+        self._f_out.write('\x00' * HEADER.size)
+        self._strings = tempfile.TemporaryFile()
+        self._strings_size = 0
+        self._dir_ids = {}
+        self._dir_entries = []
+        self._sizes = array.array('l')
+        self._other = {}
+
+    def _add_string(self, value):
+        offset = self._strings_size
+        self._strings.write(value)
+        self._strings_size += len(value)
+        return offset
+
+    def add(self, digest, date, size, directory, name, file_type):
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._dir_ids[directory] = len(self._dir_entries)
+            self._dir_entries.append((self._add_string(directory),
+                                      len(directory)))
+        self._f_out.write(RECORD.pack(digest, date, size, dir_id,
+                                      self._add_string(name), len(name),
+                                      file_type))
+        self._sizes.append(size)
+
+    def add_other(self, hash, record):
+        self._other[hash] = record
+
+    def close(self, source_stat):
+        """
+        completes the snapshot, made from the file with source_stat
+        """
+        f_out = self._f_out
+        sizes_offset = f_out.tell()
+        sizes = self._sizes
+        for index in sorted(xrange(len(sizes)), key=sizes.__getitem__):
+            f_out.write(SIZE_ENTRY.pack(sizes[index], index))
+
+        dirs_offset = f_out.tell()
+        for offset, length in self._dir_entries:
+            f_out.write(DIR_ENTRY.pack(offset, length))
+
+        strings_offset = f_out.tell()
+        self._strings.seek(0)
+        shutil.copyfileobj(self._strings, f_out)
+        self._strings.close()
+
+        other_offset = f_out.tell()
+        f_out.write(json.dumps(self._other, encoding='latin-1'))
+
+        f_out.seek(0)
+        f_out.write(HEADER.pack(MAGIC, source_stat.st_size,
+                                source_stat.st_mtime, len(sizes),
+                                len(self._dir_entries), sizes_offset,
+                                dirs_offset, strings_offset, other_offset))
+        f_out.close()
+        os.rename(self._tmp_filename, self._filename)
+
+    def abort(self):
+        self._f_out.close()
+        self._strings.close()
+        os.unlink(self._tmp_filename)
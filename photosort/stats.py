@@ -0,0 +1,136 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# Per stage instrumentation: call counts, bytes read and latency
+# histograms of walking, readiness checks, EXIF parsing, hashing, DB
+# operations and moves. Disabled, a timed function only pays for the
+# check of the 'enabled' flag.
+
+import functools
+import logging
+import math
+import threading
+import time
+
+enabled = False
+
+_lock = threading.Lock()
+_stages = {}
+
+# latency histogram buckets grow by 2^(1/4) (~19%) from 1us
+BUCKET_BASE = 1e-6
+BUCKETS_PER_OCTAVE = 4
+
+
+class Stage:
+    """
+        Counters and latency histogram of one stage
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._buckets = {}
+
+    def add(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        if seconds <= BUCKET_BASE:
+            bucket = 0
+        else:
+            bucket = int(math.ceil(math.log(seconds / BUCKET_BASE, 2) *
+                                   BUCKETS_PER_OCTAVE))
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def percentile(self, percent):
+        """
+        upper bound of the latency bucket holding the percentile
+        """
+        if not self.calls:
+            return 0.0
+        rank = math.ceil(self.calls * percent / 100.0)
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                return BUCKET_BASE * 2 ** (float(bucket) / BUCKETS_PER_OCTAVE)
+        return 0.0
+
+
+def _stage(name):
+    try:
+        return _stages[name]
+    except KeyError:
+        return _stages.setdefault(name, Stage(name))
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+
+def record(name, seconds):
+    with _lock:
+        _stage(name).add(seconds)
+
+
+def count_bytes(name, nbytes):
+    with _lock:
+        _stage(name).bytes += nbytes
+
+
+def timed(name):
+    """
+    decorator recording the calls and latency of a function as
+    the 'name' stage, when the statistics are enabled
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.time() - start)
+        return wrapper
+    return decorator
+
+
+def stages():
+    with _lock:
+        return [_stages[name] for name in sorted(_stages)]
+
+
+def summary():
+    """
+    returns the statistics of each stage as lines of text
+    """
+    lines = ["%-20s %8s %10s %9s %9s %9s %10s" %
+             ('stage', 'calls', 'total(s)', 'p50(ms)', 'p95(ms)', 'p99(ms)',
+              'read(MB)')]
+    for stage in stages():
+        lines.append("%-20s %8d %10.3f %9.2f %9.2f %9.2f %10.1f" %
+                     (stage.name, stage.calls, stage.seconds,
+                      stage.percentile(50) * 1000,
+                      stage.percentile(95) * 1000,
+                      stage.percentile(99) * 1000,
+                      stage.bytes / 1048576.0))
+    return lines
+
+
+def log_summary():
+    for line in summary():
+        logging.info("stats: %s" % line)
@@ -8,6 +8,10 @@ __license__ = "GPLv3"
 import unittest
 import os.path
 import platform
+import shutil
+import tempfile
+
+import yaml
 
 if platform.python_version() < '2.7':
     unittest = __import__('unittest2')
@@ -17,3 +21,29 @@ else:
 class TestCase(unittest.TestCase):
     def get_data_path(self,file_path):
         return os.path.join(os.path.dirname(__file__),'data',file_path)
+
+    def make_tmpdir(self):
+        tmpdir = tempfile.mkdtemp(prefix='photosort-test-')
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        return tmpdir
+
+    def make_config(self, output_dir, sources=None, **output):
+        """
+        writes a configuration file sorting into output_dir
+        and returns the loaded Config object
+        """
+        from photosort import config
+
+        data = {'sources': sources or {},
+                'output': {'dir': output_dir,
+                           'dir_pattern': '%(year)d/%(year)04d_%(month)02d_%(day)02d',
+                           'duplicates_dir': 'duplicates',
+                           'chmod': '0o774',
+                           'log_file': 'photosort.log',
+                           'db_file': 'photosort.db'}}
+        data['output'].update(output)
+
+        config_file = os.path.join(output_dir, 'photosort.yml')
+        with open(config_file, 'w') as f_out:
+            yaml.safe_dump(data, f_out)
+        return config.Config(config_file)
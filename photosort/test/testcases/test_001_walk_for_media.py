@@ -7,6 +7,8 @@ __license__ = "GPLv3"
 
 import photosort.test
 from photosort import walk
+import os
+import shutil
 
 class TestWalkForMedia(photosort.test.TestCase):
 
@@ -18,8 +20,42 @@ class TestWalkForMedia(photosort.test.TestCase):
         files = [file for root, file in walker.find_media()]
         self.assertTrue('img1.jpg' in files)
 
+    def _tree(self):
+        tmpdir = self.make_tmpdir()
+        for path in ['a/img.jpg', 'a/notes.txt', 'b/inbox/img.jpg',
+                     'inbox/img.jpg', 'b/.hidden/img.jpg', 'b/mov.MP4']:
+            path = os.path.join(tmpdir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            shutil.copy(self.media1 + '/img1.jpg', path)
+        return tmpdir
+
     def test_ignores(self):
-        pass
+        tmpdir = self._tree()
+        walker = walk.WalkForMedia(tmpdir, ignores=[tmpdir + '/b/inbox'])
+        files = [os.path.relpath(entry.path, tmpdir)
+                 for entry in walker.find_candidates()]
+        self.assertEqual(files, ['a/img.jpg', 'b/mov.MP4', 'inbox/img.jpg'])
+
+    def test_entries_carry_stat(self):
+        tmpdir = self._tree()
+        walker = walk.WalkForMedia(tmpdir, extensions=['jpg'])
+        entries = list(walker.find_candidates())
+        self.assertEqual(len(entries), 3)
+        for entry in entries:
+            self.assertEqual(entry.path, os.path.join(entry.directory, entry.name))
+            self.assertEqual(entry.stat.st_size,
+                             os.path.getsize(self.media1 + '/img1.jpg'))
+
+    def test_is_candidate(self):
+        walker = walk.WalkForMedia(self.media1, ignores=[self.media1 + '/skip'])
+        self.assertTrue(walker.is_candidate(self.media1 + '/img1.jpg'))
+        self.assertTrue(walker.is_candidate(self.media1 + '/sub/img1.jpg'))
+        self.assertFalse(walker.is_candidate(self.media1 + '/notes.txt'))
+        self.assertFalse(walker.is_candidate(self.media1 + '/._img1.jpg'))
+        self.assertFalse(walker.is_candidate(self.media1 + '/.sub/img1.jpg'))
+        self.assertFalse(walker.is_candidate(self.media1 + '/skip/img1.jpg'))
+        self.assertFalse(walker.is_candidate(self.media1 + '/../img1.jpg'))
 
 if __name__ == '__main__':
     unittest.main()
@@ -6,6 +6,8 @@ __copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
 __license__ = "GPLv3"
 
 import photosort.test
+from photosort import copyfile
+from photosort import exif
 from photosort import media
 import shutil
 import tempfile
@@ -81,6 +83,93 @@ class TestPhotoMedia(photosort.test.TestCase):
 
         self.assertTrue(self.photo.is_equal_to(tmpdir+'/2013/2013_08_24/20130824130552_img1.jpg'))
 
+    def test_copy_hashing(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        tmpfile = tmpdir + '/' + self.photo.get_filename()
+        shutil.copy(self.photo.get_path(), tmpfile)
+        os.utime(tmpfile, (1000000000, 1000000000))
+
+        self.addCleanup(setattr, media.MediaFile, 'verify_copies', False)
+        for verify in (False, True):
+            media.MediaFile.verify_copies = verify
+            photo_t = media.MediaFile.build_for(tmpfile)
+            copied = tmpdir + '/copy_%s.jpg' % verify
+            result = photo_t._copy_to(copied)
+
+            self.assertEqual(result.digest, "a35de42abad366d0f6232a4abd0404c8")
+            self.assertEqual(photo_t._digest, result.digest)
+            self.assertTrue(self.photo.is_equal_to(copied))
+            self.assertEqual(os.stat(copied).st_mtime, 1000000000)
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             sorted(['img1.jpg', 'copy_False.jpg'] +
+                                    ['copy_True.jpg'] * verify))
+
+    def test_verify_copy_of_changing_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        tmpfile = tmpdir + '/' + self.photo.get_filename()
+        shutil.copy(self.photo.get_path(), tmpfile)
+
+        self.addCleanup(setattr, media.MediaFile, 'verify_copies', False)
+        media.MediaFile.verify_copies = True
+        photo_t = media.MediaFile.build_for(tmpfile)
+        photo_t._digest = "0" * 32
+        self.assertRaises(IOError, photo_t._copy_to, tmpdir + '/copy.jpg')
+        self.assertEqual(os.listdir(tmpdir), ['img1.jpg'])
+
+    def test_incomplete_copy_keeps_the_source(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        tmpfile = tmpdir + '/' + self.photo.get_filename()
+        shutil.copy(self.photo.get_path(), tmpfile)
+
+        copy_file = copyfile.copy_file
+        self.addCleanup(setattr, copyfile, 'copy_file', copy_file)
+        copyfile.copy_file = lambda src, dst, hasher=None: \
+            copyfile.CopyResult('sendfile', 0, 0.1, None)
+
+        photo_t = media.MediaFile.build_for(tmpfile)
+        self.assertRaises(IOError, photo_t._copy_to, tmpdir + '/copy.jpg')
+        self.assertEqual(os.listdir(tmpdir), ['img1.jpg'])
+        self.assertEqual(os.path.getsize(tmpfile),
+                         os.path.getsize(self.photo.get_path()))
+
+    def test_rename_is_recorded(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        tmpfile = tmpdir + '/' + self.photo.get_filename()
+        shutil.copy(self.photo.get_path(), tmpfile)
+
+        photo_t = media.MediaFile.build_for(tmpfile)
+        self.assertTrue(photo_t.rename_as(tmpdir + '/R.jpg'))
+        self.assertEqual(photo_t.copy_result.method, 'rename')
+        self.assertEqual(photo_t._digest, None)
+
+    def test_metadata_read_once(self):
+        opened = []
+        def counting_open(filename, *args):
+            opened.append(filename)
+            return open(filename, *args)
+        exif.open = counting_open
+        self.addCleanup(delattr, exif, 'open')
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        tmpfile = tmpdir + '/' + self.photo.get_filename()
+        shutil.copy(self.photo.get_path(), tmpfile)
+        dir_fmt = '%(year)d/%(year)04d_%(month)02d_%(day)02d'
+        file_fmt = '%(year)04d%(month)02d%(day)02d%(hour)02d%(minute)02d%(second)02d_'
+
+        photo_t = media.MediaFile.build_for(tmpfile)
+        photo_t.hash()
+        photo_t.datetime()
+        photo_t.move_to_directory_with_date(tmpdir, dir_fmt, file_fmt)
+        photo_t.hash()
+        photo_t.datetime()
+
+        self.assertEqual(opened, [tmpfile])
+
 if __name__ == '__main__':
     unittest.main()
    
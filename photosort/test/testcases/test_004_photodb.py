@@ -0,0 +1,167 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import media
+from photosort import photodb
+import os
+import shutil
+
+
+class TestPhotoDB(photosort.test.TestCase):
+
+    def setUp(self):
+        self.output_dir = self.make_tmpdir()
+        self.img1 = self.get_data_path('media1/img1.jpg')
+        self.img1dup = self.get_data_path('media1/img1_dup.jpg')
+        self.sorted_dir = os.path.join(self.output_dir, '2013', '2013_08_24')
+        os.makedirs(self.sorted_dir)
+        shutil.copy(self.img1, self.sorted_dir)
+        self.sorted_img1 = os.path.join(self.sorted_dir, 'img1.jpg')
+
+    def _index_img1(self, db):
+        photo = media.MediaFile.build_for(self.sorted_img1)
+        self.assertTrue(db.add_to_db(self.sorted_dir, 'img1.jpg', photo))
+
+    def test_engine_selection(self):
+        csv_db = photodb.PhotoDB.build_for(self.make_config(self.output_dir))
+        self.assertFalse(isinstance(csv_db, photodb.SQLitePhotoDB))
+
+        config = self.make_config(self.output_dir, db_engine='sqlite')
+        self.assertTrue(isinstance(photodb.PhotoDB.build_for(config),
+                                   photodb.SQLitePhotoDB))
+
+    def test_csv_write_and_load(self):
+        config = self.make_config(self.output_dir)
+        db = photodb.PhotoDB.build_for(config)
+        self._index_img1(db)
+        db.write()
+
+        db = photodb.PhotoDB.build_for(config)
+        self.assertTrue(db.is_duplicate(media.MediaFile.build_for(self.img1dup)))
+
+    def test_sqlite_write_and_load(self):
+        config = self.make_config(self.output_dir, db_engine='sqlite',
+                                  db_file='photosort.sqlite')
+        db = photodb.PhotoDB.build_for(config)
+        self._index_img1(db)
+
+        # pending entries are found before being written
+        self.assertTrue(db.is_duplicate(media.MediaFile.build_for(self.img1dup)))
+        db.write()
+
+        db = photodb.PhotoDB.build_for(config)
+        self.assertTrue(db.is_duplicate(media.MediaFile.build_for(self.img1dup)))
+        self.assertFalse(db.is_duplicate(
+            media.MediaFile.build_for(self.get_data_path('media2/mov1.mp4'))))
+
+    def test_sqlite_migration_from_csv(self):
+        csv_db = photodb.PhotoDB.build_for(self.make_config(self.output_dir))
+        self._index_img1(csv_db)
+        csv_db.write()
+
+        config = self.make_config(self.output_dir, db_engine='sqlite',
+                                  db_file='photosort.sqlite')
+        db = photodb.PhotoDB.build_for(config)
+        db.migrate_from(os.path.join(self.output_dir, 'photosort.db'))
+
+        db = photodb.PhotoDB.build_for(config)
+        photo = media.MediaFile.build_for(self.img1dup)
+        record = db._lookup(photo.hash())
+        self.assertEqual(record['dir'], '2013/2013_08_24')
+        self.assertEqual(record['size'], os.path.getsize(self.img1))
+
+    def test_size_mismatch_skips_hashing(self):
+        db = photodb.PhotoDB.build_for(self.make_config(self.output_dir))
+        self._index_img1(db)
+
+        movie = media.MediaFile.build_for(self.get_data_path('media2/mov1.mp4'))
+        self.assertFalse(db.is_duplicate(movie))
+        self.assertEqual(movie._digest, None)
+
+    def test_head_tail_mismatch_skips_hashing(self):
+        db = photodb.PhotoDB.build_for(self.make_config(self.output_dir))
+        self._index_img1(db)
+
+        # same size, different contents
+        with open(self.img1, 'rb') as f_in:
+            data = f_in.read()
+        other = os.path.join(self.make_tmpdir(), 'other.jpg')
+        with open(other, 'wb') as f_out:
+            f_out.write(data[::-1])
+
+        photo = media.MediaFile.build_for(other)
+        self.assertFalse(db.is_duplicate(photo))
+        self.assertEqual(photo._digest, None)
+
+    def test_legacy_csv_without_sizes(self):
+        config = self.make_config(self.output_dir)
+        with open(config.db_file(), 'w') as f_out:
+            f_out.write('directory,filename,type,md5\n')
+            f_out.write('2013/2013_08_24,img1.jpg,photo,'
+                        'a35de42abad366d0f6232a4abd0404c8 - 2013-08-24 13:05:52\n')
+
+        db = photodb.PhotoDB.build_for(config)
+        self.assertTrue(db.is_duplicate(media.MediaFile.build_for(self.img1dup)))
+        db.write()
+
+        db = photodb.PhotoDB.build_for(config)
+        self.assertEqual(db._hashes_with_size(os.path.getsize(self.img1)),
+                         set(['a35de42abad366d0f6232a4abd0404c8 - 2013-08-24 13:05:52']))
+
+    def _assert_sizes_filled(self, db):
+        file_size = photodb.PhotoDB._file_size
+        photodb.PhotoDB._file_size = None   # no stats once loaded
+        try:
+            self.assertTrue(db.is_duplicate(
+                media.MediaFile.build_for(self.img1dup)))
+        finally:
+            photodb.PhotoDB._file_size = file_size
+        self.assertEqual(db._hashes_with_size(os.path.getsize(self.img1)),
+                         set(['a35de42abad366d0f6232a4abd0404c8 - 2013-08-24 13:05:52']))
+
+    def test_csv_sizes_filled_when_loaded(self):
+        config = self.make_config(self.output_dir)
+        with open(config.db_file(), 'w') as f_out:
+            f_out.write('directory,filename,type,md5\n')
+            f_out.write('2013/2013_08_24,img1.jpg,photo,'
+                        'a35de42abad366d0f6232a4abd0404c8 - 2013-08-24 13:05:52\n')
+
+        self._assert_sizes_filled(photodb.PhotoDB.build_for(config))
+
+    def test_sqlite_sizes_filled_when_loaded(self):
+        config = self.make_config(self.output_dir, db_engine='sqlite',
+                                  db_file='photosort.sqlite')
+        db = photodb.PhotoDB.build_for(config)
+        db._store('a35de42abad366d0f6232a4abd0404c8 - 2013-08-24 13:05:52',
+                  {'dir': '2013/2013_08_24', 'name': 'img1.jpg',
+                   'type': 'photo', 'size': None})
+        db.write()
+
+        self._assert_sizes_filled(photodb.PhotoDB.build_for(config))
+
+    def test_missing_files_dont_force_hashing(self):
+        config = self.make_config(self.output_dir)
+        with open(config.db_file(), 'w') as f_out:
+            f_out.write('directory,filename,type,md5\n')
+            f_out.write('2013/2013_08_24,img1.jpg,photo,'
+                        'a35de42abad366d0f6232a4abd0404c8 - 2013-08-24 13:05:52\n')
+            f_out.write('2013/2013_08_24,gone.jpg,photo,'
+                        '0cc175b9c0f1b6a831c399e269772661\n')
+
+        db = photodb.PhotoDB.build_for(config)
+        movie = media.MediaFile.build_for(self.get_data_path('media2/mov1.mp4'))
+        self.assertFalse(db.is_duplicate(movie))
+        self.assertEqual(movie._digest, None)
+        self.assertTrue(db.is_duplicate(media.MediaFile.build_for(self.img1dup)))
+
+        hashed = media.MediaFile.build_for(self.get_data_path('media2/mov1.mp4'))
+        hashed._hash = '0cc175b9c0f1b6a831c399e269772661'
+        self.assertTrue(db.may_be_duplicate(hashed))
+
+if __name__ == '__main__':
+    unittest.main()
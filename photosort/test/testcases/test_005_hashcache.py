@@ -0,0 +1,81 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import hashcache
+from photosort import media
+import os
+import shutil
+
+
+class TestHashCache(photosort.test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = self.make_tmpdir()
+        self.cache_file = os.path.join(self.tmpdir, 'photosort.hashcache')
+        self.img1 = os.path.join(self.tmpdir, 'img1.jpg')
+        shutil.copy(self.get_data_path('media1/img1.jpg'), self.img1)
+
+        media.MediaFile.hash_cache = hashcache.HashCache(self.cache_file)
+        self.addCleanup(setattr, media.MediaFile, 'hash_cache', None)
+
+    def test_hit_after_hashing(self):
+        expected_hash = media.MediaFile.build_for(self.img1).hash()
+        cache = media.MediaFile.hash_cache
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        self.assertEqual(media.MediaFile.build_for(self.img1).hash(),
+                         expected_hash)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_persistence(self):
+        expected_hash = media.MediaFile.build_for(self.img1).hash()
+        media.MediaFile.hash_cache.flush()
+
+        cache = hashcache.HashCache(self.cache_file)
+        media.MediaFile.hash_cache = cache
+        self.assertEqual(media.MediaFile.build_for(self.img1).hash(),
+                         expected_hash)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_modified_file_is_rehashed(self):
+        media.MediaFile.build_for(self.img1).hash()
+
+        with open(self.img1, 'ab') as f_out:
+            f_out.write('more data')
+        st = os.stat(self.img1)
+        os.utime(self.img1, (st.st_atime, st.st_mtime + 10))
+
+        cache = media.MediaFile.hash_cache
+        media.MediaFile.build_for(self.img1).hash()
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_base_cache_is_only_read(self):
+        expected_hash = media.MediaFile.build_for(self.img1).hash()
+        media.MediaFile.hash_cache.flush()
+        img2 = os.path.join(self.tmpdir, 'img2.jpg')
+        shutil.copy(self.get_data_path('media1/img1_dup.jpg'), img2)
+
+        shard_file = os.path.join(self.tmpdir, 'shard.hashcache')
+        cache = hashcache.HashCache(shard_file, base=self.cache_file)
+        media.MediaFile.hash_cache = cache
+        self.assertEqual(media.MediaFile.build_for(self.img1).hash(),
+                         expected_hash)
+        media.MediaFile.build_for(img2).hash()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.flush()
+        img2_digest = cache.lookup(os.stat(img2))
+        img1_digest = cache.lookup(os.stat(self.img1))
+
+        shared = hashcache.HashCache(self.cache_file)
+        self.assertEqual(shared.lookup(os.stat(img2)), None)
+        shared.merge_from(shard_file)
+        self.assertEqual(shared.lookup(os.stat(img2)), img2_digest)
+        self.assertEqual(shared.lookup(os.stat(self.img1)), img1_digest)
+
+if __name__ == '__main__':
+    unittest.main()
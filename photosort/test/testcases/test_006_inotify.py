@@ -0,0 +1,57 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import inotify
+import os
+import unittest
+
+
+@unittest.skipUnless(inotify.is_available(), "inotify not available")
+class TestTreeWatcher(photosort.test.TestCase):
+
+    def setUp(self):
+        self.inbox = self.make_tmpdir()
+        self.watcher = inotify.TreeWatcher([self.inbox])
+        self.addCleanup(self.watcher.close)
+
+    def _write(self, path):
+        with open(path, 'w') as f_out:
+            f_out.write('data')
+
+    def test_written_files(self):
+        img = os.path.join(self.inbox, 'img.jpg')
+        self._write(img)
+        self._write(os.path.join(self.inbox, '.hidden.jpg'))
+
+        paths, overflow = self.watcher.wait(timeout=5, quiet=0.1)
+        self.assertEqual(paths, set([img]))
+        self.assertFalse(overflow)
+
+    def test_new_directories_are_watched(self):
+        new_dir = os.path.join(self.inbox, 'DCIM')
+        os.mkdir(new_dir)
+        self.watcher.wait(timeout=5, quiet=0.1)
+
+        img = os.path.join(new_dir, 'img.jpg')
+        self._write(img)
+        paths, overflow = self.watcher.wait(timeout=5, quiet=0.1)
+        self.assertEqual(paths, set([img]))
+
+    def test_burst_is_coalesced(self):
+        imgs = set(os.path.join(self.inbox, 'img%d.jpg' % i) for i in range(50))
+        for img in imgs:
+            self._write(img)
+
+        paths, overflow = self.watcher.wait(timeout=5, quiet=0.2)
+        self.assertEqual(paths, imgs)
+
+    def test_timeout(self):
+        self.assertEqual(self.watcher.wait(timeout=0.1), (set(), False))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import media
+from photosort import photosort as photosort_main
+from photosort import walk
+import logging
+import os
+import shutil
+import threading
+import time
+
+
+class TestSync(photosort.test.TestCase):
+
+    def setUp(self):
+        self.output_dir = self.make_tmpdir()
+        self.inbox = self.make_tmpdir()
+        self.inbox2 = self.make_tmpdir()
+
+        # ctime can't be moved back, files copied here look recent
+        lapse = walk.WalkForMedia._modification_lapse
+        walk.WalkForMedia._modification_lapse = lambda self, filename, st=None: 3600
+        self.addCleanup(setattr, walk.WalkForMedia, '_modification_lapse', lapse)
+
+    def _photo_sort(self, **output):
+        self.make_config(self.output_dir,
+                         sources={'inbox': {'dir': self.inbox},
+                                  'inbox2': {'dir': self.inbox2}},
+                         **output)
+        photo_sort = photosort_main.PhotoSort(
+            os.path.join(self.output_dir, 'photosort.yml'), logging.INFO)
+        self.addCleanup(setattr, media.MediaFile, 'hash_cache', None)
+        self.addCleanup(setattr, media.MediaFile, 'io_scheduler', None)
+        return photo_sort
+
+    def _drop(self, data_file, directory, name=None):
+        path = os.path.join(directory, name or os.path.basename(data_file))
+        shutil.copy(self.get_data_path(data_file), path)
+        old = time.time() - 3600
+        os.utime(path, (old, old))
+        return path
+
+    def _sorted_files(self):
+        found = []
+        for root, dirs, files in os.walk(self.output_dir):
+            found.extend(os.path.relpath(os.path.join(root, file), self.output_dir)
+                         for file in files if file.endswith('.jpg'))
+        return sorted(found)
+
+    def test_duplicates_in_a_batch(self):
+        for i in range(5):
+            self._drop('media1/img1.jpg', self.inbox, 'img1_%d.jpg' % i)
+
+        self._photo_sort().sync()
+
+        self.assertEqual(os.listdir(self.inbox), [])
+        self.assertEqual(self._sorted_files(),
+                         ['2013/2013_08_24/img1_0.jpg'] +
+                         ['duplicates/img1_%d.jpg' % i for i in range(1, 5)])
+
+    def test_duplicates_across_syncs(self):
+        self._drop('media1/img1.jpg', self.inbox)
+        photo_sort = self._photo_sort()
+        photo_sort.sync()
+
+        self._drop('media1/img1_dup.jpg', self.inbox)
+        self._photo_sort().sync()
+
+        self.assertEqual(self._sorted_files(),
+                         ['2013/2013_08_24/img1.jpg', 'duplicates/img1_dup.jpg'])
+
+    def test_not_ready_files_are_left(self):
+        self._drop('media1/img1.jpg', self.inbox)
+        empty = self._drop('media2/mov1.mp4', self.inbox)
+
+        self._photo_sort().sync()
+
+        self.assertEqual(os.listdir(self.inbox), ['mov1.mp4'])
+        self.assertEqual(self._sorted_files(), ['2013/2013_08_24/img1.jpg'])
+
+    def test_duplicates_across_sources(self):
+        for i in range(3):
+            self._drop('media1/img1.jpg', self.inbox, 'img1_%d.jpg' % i)
+            self._drop('media1/img1_dup.jpg', self.inbox2, 'dup_%d.jpg' % i)
+
+        self._photo_sort().sync()
+
+        self.assertEqual(os.listdir(self.inbox) + os.listdir(self.inbox2), [])
+        sorted_files = self._sorted_files()
+        self.assertEqual(len(sorted_files), 6)
+        self.assertEqual(len([name for name in sorted_files
+                              if name.startswith('2013/')]), 1)
+
+    def test_slow_sources_dont_block(self):
+        self._drop('media1/img1.jpg', self.inbox2)
+        photo_sort = self._photo_sort()
+        walker = photo_sort._source_walker('inbox2')
+        slow_walk = threading.Event()
+
+        def slow_entries():
+            slow_walk.wait(10)
+            return
+            yield
+
+        def wait_for_sorted():
+            for i in range(1000):
+                if self._sorted_files():
+                    break
+                time.sleep(0.01)
+            slow_walk.set()
+
+        waiter = threading.Thread(target=wait_for_sorted)
+        waiter.start()
+        sync_pipeline = photo_sort._sync_pipeline()
+        sync_pipeline.run_sources([('slow', slow_entries(),
+                                    lambda path, st: True),
+                                   ('inbox2', walker.find_candidates(),
+                                    walker.is_ready)])
+        waiter.join()
+
+        self.assertEqual([(result.name, result.sorted)
+                          for result in sync_pipeline.results],
+                         [('slow', 0), ('inbox2', 1)])
+        self.assertTrue(sync_pipeline.results[1].seconds < 10)
+
+    def test_no_threads_are_left(self):
+        self._drop('media1/img1.jpg', self.inbox)
+        photo_sort = self._photo_sort()
+        walker = photo_sort._source_walker('inbox')
+        threads = threading.enumerate()
+
+        sync_pipeline = photo_sort._sync_pipeline()
+        sync_pipeline.run(walker.find_candidates(), walker.is_ready)
+
+        self.assertEqual(sync_pipeline.sorted, 1)
+        self.assertEqual([thread for thread in threading.enumerate()
+                          if thread not in threads], [])
+
+    def test_no_threads_are_left_by_any_source(self):
+        self._drop('media1/img1.jpg', self.inbox)
+        self._drop('media1/img1_dup.jpg', self.inbox2)
+        photo_sort = self._photo_sort()
+        walkers = [photo_sort._source_walker(name)
+                   for name in ('inbox', 'inbox2')]
+        threads = threading.enumerate()
+
+        sync_pipeline = photo_sort._sync_pipeline()
+        sync_pipeline.run_sources([(name, walker.find_candidates(),
+                                    walker.is_ready)
+                                   for name, walker
+                                   in zip(('inbox', 'inbox2'), walkers)] +
+                                  [('empty', iter([]),
+                                    lambda path, st: True)])
+
+        self.assertEqual(sync_pipeline.sorted + sync_pipeline.duplicates, 2)
+        self.assertEqual([thread for thread in threading.enumerate()
+                          if thread not in threads], [])
+
+    def test_empty_sources_dont_load_the_db(self):
+        with open(os.path.join(self.inbox, 'notes.txt'), 'w') as f_out:
+            f_out.write('not media')
+        photo_sort = self._photo_sort()
+        photo_sort.sync()
+
+        self.assertEqual(photo_sort._photodb, None)
+        self.assertEqual(media.MediaFile.hash_cache, None)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir,
+                                                     'photosort.db')))
+
+        self._drop('media1/img1.jpg', self.inbox2)
+        photo_sort.sync()
+        self.assertNotEqual(photo_sort._photodb, None)
+        self.assertEqual(self._sorted_files(), ['2013/2013_08_24/img1.jpg'])
+
+if __name__ == '__main__':
+    unittest.main()
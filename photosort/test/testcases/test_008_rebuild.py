@@ -0,0 +1,328 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import hashcache
+from photosort import manifest
+from photosort import media
+from photosort import photodb
+from photosort import photosort as photosort_main
+from photosort import walk
+from photosort import xattrs
+import errno
+import logging
+import os
+import shutil
+import sqlite3
+
+
+class TestRebuildDB(photosort.test.TestCase):
+
+    def setUp(self):
+        self.output_dir = self.make_tmpdir()
+        self.inbox = os.path.join(self.output_dir, 'inbox')
+        os.mkdir(self.inbox)
+
+        # ctime can't be moved back, files copied here look recent
+        lapse = walk.WalkForMedia._modification_lapse
+        walk.WalkForMedia._modification_lapse = lambda self, filename, st=None: 3600
+        self.addCleanup(setattr, walk.WalkForMedia, '_modification_lapse', lapse)
+
+    def _place(self, data_file, relative_path):
+        path = os.path.join(self.output_dir, relative_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        shutil.copy(self.get_data_path(data_file), path)
+
+    def _write_movie(self, relative_path):
+        path = os.path.join(self.output_dir, relative_path)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f_out:
+            f_out.write('not really a movie')
+
+    def _photo_sort(self):
+        self.make_config(self.output_dir, sources={'inbox': {'dir': self.inbox}})
+        self.addCleanup(setattr, media.MediaFile, 'hash_cache', None)
+        self.addCleanup(setattr, media.MediaFile, 'io_scheduler', None)
+        return photosort_main.PhotoSort(
+            os.path.join(self.output_dir, 'photosort.yml'), logging.INFO)
+
+    def _entries(self):
+        db = photodb.PhotoDB(self.make_config(self.output_dir))
+        return sorted((record['dir'], record['name'])
+                      for hash, record in db.entries())
+
+    def test_sharded_rebuild(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+        self._write_movie('2014/2014_01_01/mov1.mp4')
+        self._place('media1/img1.jpg', 'inbox/img1.jpg')
+
+        self._photo_sort().rebuild_db(jobs=2)
+
+        self.assertEqual(self._entries(), [('2013/2013_08_24', 'img1.jpg'),
+                                           ('2014/2014_01_01', 'mov1.mp4')])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.output_dir, 'photosort.db.shards')))
+
+    def test_sharded_rebuild_fills_the_hash_cache(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+
+        self._photo_sort().rebuild_db(jobs=2)
+
+        cache = hashcache.HashCache(os.path.join(self.output_dir,
+                                                 'photosort.hashcache'))
+        path = os.path.join(self.output_dir, '2013', '2013_08_24', 'img1.jpg')
+        self.assertNotEqual(cache.lookup(os.stat(path)), None)
+
+    def test_sharded_rebuild_fails_on_db_errors(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+        add_to_db = photodb.PhotoDB.add_to_db
+        def locked_add_to_db(db, file_dir, file_name, media_file):
+            raise sqlite3.OperationalError('database is locked')
+        photodb.PhotoDB.add_to_db = locked_add_to_db
+        self.addCleanup(setattr, photodb.PhotoDB, 'add_to_db', add_to_db)
+
+        self.assertRaises(sqlite3.OperationalError,
+                          self._photo_sort().rebuild_db, jobs=2)
+
+    def test_conflicts_keep_the_first_entry(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+        self._place('media1/img1.jpg', '2014/2014_01_01/img1.jpg')
+
+        self._photo_sort().rebuild_db(jobs=2)
+
+        self.assertEqual(self._entries(), [('2013/2013_08_24', 'img1.jpg')])
+
+    def test_resume_reuses_partial_dbs(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+        self._write_movie('2014/2014_01_01/mov1.mp4')
+
+        shards_dir = os.path.join(self.output_dir, 'photosort.db.shards')
+        os.mkdir(shards_dir)
+        with open(os.path.join(shards_dir, '2013.db'), 'w') as f_out:
+            f_out.write('directory,filename,type,md5,size\n')
+            f_out.write('2013/2013_08_24,from_partial.jpg,photo,0123,10\n')
+
+        self._photo_sort().rebuild_db(jobs=2, resume=True)
+
+        self.assertEqual(self._entries(), [('2013/2013_08_24', 'from_partial.jpg'),
+                                           ('2014/2014_01_01', 'mov1.mp4')])
+
+    def test_partial_dbs_discarded_without_resume(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+
+        shards_dir = os.path.join(self.output_dir, 'photosort.db.shards')
+        os.mkdir(shards_dir)
+        with open(os.path.join(shards_dir, '2013.db'), 'w') as f_out:
+            f_out.write('directory,filename,type,md5,size\n')
+            f_out.write('2013/2013_08_24,from_partial.jpg,photo,0123,10\n')
+
+        self._photo_sort().rebuild_db(jobs=2)
+
+        self.assertEqual(self._entries(), [('2013/2013_08_24', 'img1.jpg')])
+
+    def _interrupted_rebuild(self, failing_dir):
+        """
+        runs a rebuild that dies when it gets to failing_dir, with
+        a checkpoint after every directory
+        """
+        self.make_config(self.output_dir, sources={'inbox': {'dir': self.inbox}},
+                         rebuild_checkpoint_interval=0)
+        photo_sort = photosort_main.PhotoSort(
+            os.path.join(self.output_dir, 'photosort.yml'), logging.INFO)
+        self.addCleanup(setattr, media.MediaFile, 'hash_cache', None)
+        self.addCleanup(setattr, media.MediaFile, 'io_scheduler', None)
+
+        build_for = media.MediaFile.build_for
+        def failing_build_for(filename, st=None):
+            if os.path.dirname(filename).endswith(failing_dir):
+                raise KeyboardInterrupt()
+            return build_for(filename, st)
+        media.MediaFile.build_for = staticmethod(failing_build_for)
+        try:
+            self.assertRaises(KeyboardInterrupt, photo_sort.rebuild_db)
+        finally:
+            media.MediaFile.build_for = staticmethod(build_for)
+
+    def test_resume(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+        self._write_movie('2014/2014_01_01/mov1.mp4')
+        self._write_movie('2014/2014_01_02/mov2.mp4')
+        with open(os.path.join(self.output_dir, '2014', '2014_01_02',
+                               'mov2.mp4'), 'ab') as f_out:
+            f_out.write(' either')
+        self._interrupted_rebuild('2014_01_02')
+
+        checkpoint_file = os.path.join(self.output_dir, 'photosort.db.rebuild')
+        with open(checkpoint_file) as f_in:
+            self.assertEqual(f_in.read().split(), ['2013/2013_08_24',
+                                                   '2014/2014_01_01'])
+        # the entries of the completed directories are in the journal
+        self.assertEqual(self._entries(), [('2013/2013_08_24', 'img1.jpg'),
+                                           ('2014/2014_01_01', 'mov1.mp4')])
+
+        os.remove(os.path.join(self.output_dir, '2013', '2013_08_24',
+                               'img1.jpg'))
+        self._photo_sort().rebuild_db(resume=True)
+
+        # completed directories weren't walked again
+        self.assertEqual(self._entries(), [('2013/2013_08_24', 'img1.jpg'),
+                                           ('2014/2014_01_01', 'mov1.mp4'),
+                                           ('2014/2014_01_02', 'mov2.mp4')])
+        self.assertFalse(os.path.exists(checkpoint_file))
+
+    def _set_mtime(self, relative_path, mtime):
+        path = os.path.join(self.output_dir, relative_path)
+        os.utime(path, (mtime, mtime))
+
+    def _built_paths(self):
+        """
+        records the paths of the media files built from then on
+        """
+        built = []
+        build_for = media.MediaFile.build_for
+        def recording_build_for(filename, st=None):
+            built.append(os.path.relpath(filename, self.output_dir))
+            return build_for(filename, st)
+        media.MediaFile.build_for = staticmethod(recording_build_for)
+        self.addCleanup(setattr, media.MediaFile, 'build_for',
+                        staticmethod(build_for))
+        return built
+
+    def _incremental_rebuild(self):
+        photo_sort = self._photo_sort()
+        photo_sort.rebuild_db(incremental=True)
+        media.MediaFile.hash_cache = None
+
+    def test_incremental_walks_changed_dirs(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+        self._write_movie('2014/2014_01_01/mov1.mp4')
+        for path in ('', '2013', '2013/2013_08_24', '2014', '2014/2014_01_01'):
+            self._set_mtime(path, 1000000000)
+        self._incremental_rebuild()
+        self.assertEqual(self._entries(), [('2013/2013_08_24', 'img1.jpg'),
+                                           ('2014/2014_01_01', 'mov1.mp4')])
+
+        self._write_movie('2014/2014_01_02/mov2.mp4')
+        with open(os.path.join(self.output_dir, '2014', '2014_01_02',
+                               'mov2.mp4'), 'ab') as f_out:
+            f_out.write(' either')
+        self._set_mtime('2014', 1000000100)
+        self._set_mtime('2014/2014_01_02', 1000000100)
+        built = self._built_paths()
+        self._incremental_rebuild()
+
+        self.assertEqual(built, ['2014/2014_01_02/mov2.mp4'])
+        self.assertEqual(self._entries(), [('2013/2013_08_24', 'img1.jpg'),
+                                           ('2014/2014_01_01', 'mov1.mp4'),
+                                           ('2014/2014_01_02', 'mov2.mp4')])
+
+    def test_incremental_prunes_deleted_files(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+        self._write_movie('2013/2013_08_25/mov1.mp4')
+        self._write_movie('2014/2014_01_01/mov2.mp4')
+        self._incremental_rebuild()
+
+        os.remove(os.path.join(self.output_dir, '2013', '2013_08_25',
+                               'mov1.mp4'))
+        shutil.rmtree(os.path.join(self.output_dir, '2014'))
+        self._incremental_rebuild()
+
+        self.assertEqual(self._entries(), [('2013/2013_08_24', 'img1.jpg')])
+
+    def test_incremental_keeps_what_cant_be_listed(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+        self._write_movie('2014/2014_01_01/mov1.mp4')
+        for path in ('', '2013', '2013/2013_08_24', '2014', '2014/2014_01_01'):
+            self._set_mtime(path, 1000000000)
+        self._incremental_rebuild()
+        entries = self._entries()
+
+        list_dir = walk.WalkForMedia._list_dir
+        def failing_list_dir(walker, directory):
+            if directory.endswith('2013'):
+                raise OSError(errno.EIO, os.strerror(errno.EIO), directory)
+            return list_dir(walker, directory)
+        walk.WalkForMedia._list_dir = failing_list_dir
+        self.addCleanup(setattr, walk.WalkForMedia, '_list_dir', list_dir)
+        self._set_mtime('', 1000000100)
+        self._set_mtime('2013', 1000000100)
+        self._incremental_rebuild()
+        self.assertEqual(self._entries(), entries)
+        with open(os.path.join(self.output_dir,
+                               'photosort.db.manifest')) as f_in:
+            self.assertTrue('2013/2013_08_24,' in f_in.read())
+
+        walk.WalkForMedia._list_dir = list_dir
+        is_walkable = walk.WalkForMedia.is_walkable
+        walk.WalkForMedia.is_walkable = lambda walker: False
+        self.addCleanup(setattr, walk.WalkForMedia, 'is_walkable',
+                        is_walkable)
+        shutil.rmtree(os.path.join(self.output_dir, '2013'))
+        self._incremental_rebuild()
+        self.assertEqual(self._entries(), entries)
+
+        walk.WalkForMedia.is_walkable = is_walkable
+        self._incremental_rebuild()
+        self.assertEqual(self._entries(), [('2014/2014_01_01', 'mov1.mp4')])
+
+    def test_incremental_skips_unchanged_files(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+        self._place('media2/mov1.mp4', '2013/2013_08_24/mov1.mp4')
+        self._incremental_rebuild()
+
+        # as if the directory changed after the files were written
+        path = os.path.join(self.output_dir, '2013', '2013_08_24', 'mov1.mp4')
+        with open(path, 'ab') as f_out:
+            f_out.write('more')
+        manifest.Manifest(os.path.join(self.output_dir,
+                                       'photosort.db.manifest')).write(
+            {'2013/2013_08_24': (os.stat(path).st_ctime + 10, 2, [])})
+        built = self._built_paths()
+        self._incremental_rebuild()
+
+        self.assertEqual(built, ['2013/2013_08_24/mov1.mp4'])
+
+    def test_incremental_forgets_modified_contents(self):
+        self._write_movie('2014/2014_01_01/mov1.mp4')
+        for path in ('', '2014', '2014/2014_01_01'):
+            self._set_mtime(path, 1000000000)
+        self._incremental_rebuild()
+        db = photodb.PhotoDB(self.make_config(self.output_dir))
+        [(old_hash, record)] = list(db.entries())
+
+        path = os.path.join(self.output_dir, '2014', '2014_01_01', 'mov1.mp4')
+        with open(path, 'ab') as f_out:
+            f_out.write(' anymore')
+        self._set_mtime('2014/2014_01_01', 1000000100)
+        self._incremental_rebuild()
+
+        db = photodb.PhotoDB(self.make_config(self.output_dir))
+        hashes = [hash for hash, record in db.entries()]
+        self.assertEqual(hashes, [media.MediaFile.build_for(path).hash()])
+        self.assertNotEqual(hashes, [old_hash])
+
+    def test_rebuild_trusts_xattrs(self):
+        self._place('media1/img1.jpg', '2013/2013_08_24/img1.jpg')
+        path = os.path.join(self.output_dir, '2013', '2013_08_24', 'img1.jpg')
+        if not xattrs.write(path, os.stat(path),
+                            {'digest': 'ffffffffffffffffffffffffffffffff',
+                             'algorithm': 'md5', 'exif_datetime': ''}):
+            self.skipTest("extended attributes not supported")
+        self.addCleanup(setattr, media.MediaFile, 'use_xattrs', False)
+        self.make_config(self.output_dir, sources={'inbox': {'dir': self.inbox}},
+                         xattrs=True, hash_cache='')
+        self.addCleanup(setattr, media.MediaFile, 'io_scheduler', None)
+        photosort_main.PhotoSort(os.path.join(self.output_dir, 'photosort.yml'),
+                                 logging.INFO).rebuild_db()
+
+        db = photodb.PhotoDB(self.make_config(self.output_dir))
+        self.assertEqual([hash for hash, record in db.entries()],
+                         ['ffffffffffffffffffffffffffffffff'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import exif
+from photosort import media
+import os
+import struct
+
+
+def tiff_with_dates(magic, endian, original, image_datetime=None,
+                    original_length=20):
+    """
+    builds a TIFF header with an IFD0 pointing to an Exif IFD
+    that holds DateTimeOriginal
+    """
+    ifd0_offset = 8
+    ifd0_entries = []
+    data_offset = ifd0_offset + 2 + 12 * 2 + 4
+    exif_ifd_offset = data_offset
+    data_offset += 2 + 12 + 4
+    data = ''
+
+    if image_datetime is not None:
+        ifd0_entries.append(struct.pack(endian + 'HHII', exif.TAG_DATETIME,
+                                        exif.TYPE_ASCII, 20, data_offset))
+        data += image_datetime + '\x00'
+    ifd0_entries.append(struct.pack(endian + 'HHII', exif.TAG_EXIF_IFD,
+                                    exif.TYPE_LONG, 1, exif_ifd_offset))
+    original_offset = data_offset + len(data)
+    data += original + '\x00'
+
+    ifd0 = struct.pack(endian + 'H', len(ifd0_entries)) + ''.join(ifd0_entries)
+    ifd0 = ifd0.ljust(2 + 12 * 2, '\x00') + '\x00' * 4
+    exif_ifd = struct.pack(endian + 'H', 1) + \
+        struct.pack(endian + 'HHII', exif.TAG_DATETIME_ORIGINAL,
+                    exif.TYPE_ASCII, original_length, original_offset) + \
+        '\x00' * 4
+    return magic + struct.pack(endian + 'I', ifd0_offset) + ifd0 + exif_ifd + data
+
+
+class TestExif(photosort.test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = self.make_tmpdir()
+
+    def _write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f_out:
+            f_out.write(data)
+        return path
+
+    def test_jpeg(self):
+        dates = exif.read_exif_dates(self.get_data_path('media1/img1.jpg'))
+        self.assertEqual(dates['DateTimeOriginal'], '2013:08:24 13:05:52')
+
+    def test_little_endian_raw(self):
+        path = self._write('img.cr2', tiff_with_dates('II*\x00', '<',
+                                                      '2012:01:02 03:04:05',
+                                                      '2012:01:02 03:04:06'))
+        self.assertEqual(exif.read_exif_dates(path),
+                         {'DateTimeOriginal': '2012:01:02 03:04:05',
+                          'DateTime': '2012:01:02 03:04:06'})
+
+    def test_big_endian_raw(self):
+        path = self._write('img.raw', tiff_with_dates('MM\x00*', '>',
+                                                      '2011:05:06 07:08:09'))
+        self.assertEqual(exif.read_exif_dates(path),
+                         {'DateTimeOriginal': '2011:05:06 07:08:09'})
+
+    def test_date_length_is_bounded(self):
+        path = self._write('img.cr2', tiff_with_dates('II*\x00', '<',
+                                                      '2012:01:02 03:04:05',
+                                                      '2012:01:02 03:04:06',
+                                                      original_length=1 << 20))
+        self.assertEqual(exif.read_exif_dates(path),
+                         {'DateTime': '2012:01:02 03:04:06'})
+
+    def test_orf_date_used_by_photo(self):
+        path = self._write('img.orf', tiff_with_dates('IIRO', '<',
+                                                      '2010:10:11 12:13:14')
+                           + 'image data' * 100)
+        photo = media.MediaFile.build_for(path)
+        self.assertEqual(str(photo.datetime()), '2010-10-11 12:13:14')
+
+    def test_jpeg_without_exif(self):
+        path = self._write('img.jpg', '\xff\xd8\xff\xe0\x00\x04ab\xff\xda')
+        self.assertEqual(exif.read_exif_dates(path), {})
+
+    def test_unknown_format(self):
+        path = self._write('img.png', '\x89PNG\r\n\x1a\n')
+        self.assertEqual(exif.read_exif_dates(path), None)
+
+    def test_truncated(self):
+        data = tiff_with_dates('II*\x00', '<', '2012:01:02 03:04:05')
+        path = self._write('img.cr2', data[:20])
+        self.assertEqual(exif.read_exif_dates(path), {})
+
+if __name__ == '__main__':
+    unittest.main()
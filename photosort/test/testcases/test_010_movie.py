@@ -0,0 +1,81 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import media
+from photosort import movie
+import datetime
+import os
+import struct
+import time
+
+
+def atom(atom_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), atom_type) + payload
+
+
+def mvhd(creation_time, version=0):
+    if version == 1:
+        times = struct.pack('>QQIQ', creation_time, creation_time, 1000, 0)
+    else:
+        times = struct.pack('>IIII', creation_time, creation_time, 1000, 0)
+    return atom('mvhd', chr(version) + '\x00\x00\x00' + times + '\x00' * 80)
+
+
+class TestMovieAtoms(photosort.test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = self.make_tmpdir()
+        self.creation = datetime.datetime(2014, 7, 1, 10, 20, 30)
+        self.creation_time = int(time.mktime(self.creation.timetuple())) + \
+            movie.QUICKTIME_EPOCH_OFFSET
+
+    def _write(self, name, *atoms):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f_out:
+            f_out.write(''.join(atoms))
+        return path
+
+    def test_moov_at_start(self):
+        path = self._write('mov.mp4', atom('ftyp', 'isom'),
+                           atom('moov', mvhd(self.creation_time)),
+                           atom('mdat', 'x' * 100))
+        self.assertEqual(media.MediaFile.build_for(path).datetime(),
+                         self.creation)
+
+    def test_moov_after_large_mdat(self):
+        path = os.path.join(self.tmpdir, 'mov.mov')
+        mdat_size = 5 * 1024 * 1024 * 1024   # sparse, needs 64 bit size
+        with open(path, 'wb') as f_out:
+            f_out.write(atom('ftyp', 'qt  '))
+            f_out.write(struct.pack('>I4sQ', 1, 'mdat', mdat_size))
+            f_out.seek(mdat_size - 16, os.SEEK_CUR)
+            f_out.write(atom('moov', atom('trak', '') +
+                             mvhd(self.creation_time, version=1)))
+
+        self.assertEqual(media.MediaFile.build_for(path).datetime(),
+                         self.creation)
+
+    def test_no_creation_time(self):
+        path = self._write('mov.mp4', atom('ftyp', 'isom'),
+                           atom('moov', mvhd(0)))
+        mtime = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+        self.assertEqual(media.MediaFile.build_for(path).datetime(), mtime)
+
+    def test_creation_time_out_of_range(self):
+        path = self._write('mov.mp4', atom('ftyp', 'isom'),
+                           atom('moov', mvhd(2 ** 63, version=1)))
+        mtime = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+        self.assertEqual(media.MediaFile.build_for(path).datetime(), mtime)
+
+    def test_other_formats_use_file_times(self):
+        path = self._write('mov.avi', atom('moov', mvhd(self.creation_time)))
+        mtime = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+        self.assertEqual(media.MediaFile.build_for(path).datetime(), mtime)
+
+if __name__ == '__main__':
+    unittest.main()
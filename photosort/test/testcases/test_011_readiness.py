@@ -0,0 +1,94 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import readiness
+from photosort import walk
+import os
+import time
+
+
+class TestReadinessTracker(photosort.test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = self.make_tmpdir()
+        self.path = os.path.join(self.tmpdir, 'img.jpg')
+        self._write('partial')
+
+    def _write(self, data):
+        with open(self.path, 'wb') as f_out:
+            f_out.write(data)
+        return os.stat(self.path)
+
+    def test_stable_observations(self):
+        tracker = readiness.ReadinessTracker(observations=3, seconds=30,
+                                             interval=0)
+        st = os.stat(self.path)
+        self.assertFalse(tracker.is_ready(self.path, st, lambda: 0))
+        self.assertFalse(tracker.is_ready(self.path, st, lambda: 0))
+        self.assertTrue(tracker.is_ready(self.path, st, lambda: 0))
+
+    def test_changes_restart_the_count(self):
+        tracker = readiness.ReadinessTracker(observations=2, seconds=30,
+                                             interval=0)
+        self.assertFalse(tracker.is_ready(self.path, os.stat(self.path), lambda: 0))
+        st = self._write('partial, and some more data')
+        self.assertFalse(tracker.is_ready(self.path, st, lambda: 0))
+        self.assertTrue(tracker.is_ready(self.path, st, lambda: 0))
+
+    def test_observations_are_spaced(self):
+        tracker = readiness.ReadinessTracker(observations=2, seconds=30,
+                                             interval=0.2)
+        st = os.stat(self.path)
+        for i in range(5):
+            self.assertFalse(tracker.is_ready(self.path, st, lambda: 0))
+        time.sleep(0.2)
+        self.assertTrue(tracker.is_ready(self.path, st, lambda: 0))
+
+    def test_old_files_are_ready(self):
+        tracker = readiness.ReadinessTracker(observations=2, seconds=30,
+                                             interval=0)
+        self.assertTrue(tracker.is_ready(self.path, os.stat(self.path), lambda: 31))
+
+    def test_walker_tracks_across_walks(self):
+        tracker = readiness.ReadinessTracker(observations=2, seconds=3600,
+                                             interval=0)
+        walker = walk.WalkForMedia(self.tmpdir, tracker=tracker)
+        self.assertEqual(list(walker.find_media()), [])
+        self.assertEqual(list(walker.find_media()), [[self.tmpdir, 'img.jpg']])
+
+    def test_empty_files_are_never_ready(self):
+        self._write('')
+        walker = walk.WalkForMedia(self.tmpdir)
+        for i in range(3):
+            self.assertFalse(walker.is_ready(self.path))
+
+    def test_time_skew_probed_when_needed(self):
+        tracker = readiness.ReadinessTracker(observations=2, seconds=30,
+                                             interval=0)
+        walker = walk.WalkForMedia(self.tmpdir, extensions=['png'],
+                                   tracker=tracker)
+        self.assertEqual(list(walker.find_media()), [])
+        self.assertEqual(walker._fs_time_skew, None)
+
+        walker = walk.WalkForMedia(self.tmpdir, tracker=tracker)
+        self.assertEqual(list(walker.find_media()), [])
+        self.assertNotEqual(walker._fs_time_skew, None)
+        self.assertEqual(list(walker.find_media()), [[self.tmpdir, 'img.jpg']])
+
+    def test_source_thresholds(self):
+        config = self.make_config(self.tmpdir,
+                                  sources={'inbox': {'dir': self.tmpdir,
+                                                     'ready_observations': 5,
+                                                     'ready_seconds': 600,
+                                                     'ready_interval': 60},
+                                           'card': {'dir': self.tmpdir}})
+        self.assertEqual(config.source_readiness('inbox'), (5, 600, 60))
+        self.assertEqual(config.source_readiness('card'), (2, 30, 10))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import copyfile
+import hashlib
+import os
+
+
+class TestCopyFile(photosort.test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = self.make_tmpdir()
+        self.src = os.path.join(self.tmpdir, 'movie.mov')
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        with open(self.src, 'wb') as f_out:
+            f_out.write(self.data)
+        self.dst = os.path.join(self.tmpdir, 'copy.mov')
+
+    def _unsupported(self, *args):
+        raise copyfile.Unsupported("not here")
+
+    def _without(self, *names):
+        methods = copyfile.KERNEL_METHODS
+        self.addCleanup(setattr, copyfile, 'KERNEL_METHODS', methods)
+        copyfile.KERNEL_METHODS = [(name, name in names and self._unsupported
+                                    or function)
+                                   for name, function in methods]
+
+    def _copied(self):
+        with open(self.dst, 'rb') as f_in:
+            return f_in.read()
+
+    def test_copy(self):
+        result = copyfile.copy_file(self.src, self.dst)
+        self.assertTrue(result.method in ('reflink', 'copy_file_range',
+                                          'sendfile', 'buffered'))
+        self.assertEqual(result.size, len(self.data))
+        self.assertEqual(result.digest, None)
+        self.assertTrue(result.rate() > 0)
+        self.assertEqual(self._copied(), self.data)
+
+    def test_fallbacks(self):
+        self._without('reflink', 'copy_file_range')
+        result = copyfile.copy_file(self.src, self.dst)
+        self.assertTrue(result.method in ('sendfile', 'buffered'))
+        self.assertEqual(self._copied(), self.data)
+
+        self._without('sendfile')
+        result = copyfile.copy_file(self.src, self.dst)
+        self.assertEqual(result.method, 'buffered')
+        self.assertEqual(self._copied(), self.data)
+
+    def test_kernel_copies_of_nothing(self):
+        # like copy_file_range on filesystems that don't implement it
+        def nothing(fd_in, fd_out, size):
+            return copyfile._kernel_loop(lambda fd_in, fd_out, count: 0,
+                                         fd_in, fd_out, size)
+        self.addCleanup(setattr, copyfile, 'KERNEL_METHODS',
+                        copyfile.KERNEL_METHODS)
+        copyfile.KERNEL_METHODS = [('copy_file_range', nothing)]
+
+        result = copyfile.copy_file(self.src, self.dst)
+        self.assertEqual(result.method, 'buffered')
+        self.assertEqual(result.size, len(self.data))
+        self.assertEqual(self._copied(), self.data)
+
+    def test_short_kernel_copy(self):
+        calls = []
+        def short(fd_in, fd_out, count):
+            calls.append(count)
+            return 1024 if len(calls) == 1 else 0
+        self.assertRaises(IOError, copyfile._kernel_loop, short,
+                          None, None, 4096)
+
+    def test_hashing_copy(self):
+        result = copyfile.copy_file(self.src, self.dst, hashlib.md5())
+        self.assertTrue(result.method in ('reflink', 'buffered'))
+        self.assertEqual(result.digest, hashlib.md5(self.data).hexdigest())
+        self.assertEqual(self._copied(), self.data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import media
+from photosort.benchmark import corpus
+from photosort.benchmark import runner
+from photosort.benchmark import startup
+import hashlib
+import os
+
+
+class TestBenchmark(photosort.test.TestCase):
+
+    def _generate(self, seed):
+        root = self.make_tmpdir()
+        summary = corpus.Corpus(root, 200, seed, duplicate_ratio=0.2,
+                                movie_size=256 * 1024).generate()
+        digests = {}
+        for directory, dirs, files in os.walk(root):
+            for name in files:
+                path = os.path.join(directory, name)
+                with open(path, 'rb') as f_in:
+                    digests[os.path.relpath(path, root)] = \
+                        hashlib.md5(f_in.read()).hexdigest()
+        return root, summary, digests
+
+    def test_corpus_is_reproducible(self):
+        root, summary, digests = self._generate(1)
+        self.assertEqual(self._generate(1)[1:], (summary, digests))
+        self.assertNotEqual(self._generate(2)[2], digests)
+
+        self.assertEqual(len(digests), 200)
+        self.assertEqual(len(set(digests.values())),
+                         200 - summary['duplicates'])
+        for kind in ('jpeg', 'png', 'raw', 'movie'):
+            self.assertTrue(summary[kind] > 0)
+
+    def test_corpus_dates(self):
+        root, summary, digests = self._generate(1)
+        for path in digests:
+            media_file = media.MediaFile.build_for(os.path.join(root, path))
+            if path.endswith('.png'):
+                self.assertEqual(media_file._exif_datetime(), None)
+            elif path.endswith('.mov'):
+                self.assertNotEqual(media_file._container_datetime(), None)
+            else:
+                self.assertNotEqual(media_file._exif_datetime(), None)
+
+    def test_run_and_compare(self):
+        self.addCleanup(setattr, media.MediaFile, 'io_scheduler', None)
+        results = runner.run(50, workdir=self.make_tmpdir(),
+                             movie_size=64 * 1024)
+        self.assertEqual(sorted(results['results'].keys()),
+                         ['exif', 'hash', 'photodb_is_duplicate',
+                          'photodb_load', 'photodb_write', 'rebuild_db',
+                          'sync', 'walk'])
+        self.assertEqual(results['results']['walk']['items'], 50)
+        self.assertEqual(results['results']['rebuild_db']['items'],
+                         50 - results['corpus']['duplicates'])
+
+        slower = {'results': dict((name, dict(result,
+                                              seconds=result['seconds'] * 2 + 1))
+                                  for name, result in
+                                  results['results'].items())}
+        self.assertEqual(runner.compare(results, results), [])
+        self.assertEqual(len(runner.compare(results, slower)), 8)
+        self.assertEqual(runner.compare(slower, results), [])
+
+    def test_startup(self):
+        results = startup.run(100, runs=1, workdir=self.make_tmpdir())
+        self.assertEqual(sorted(results['results'].keys()),
+                         ['interpreter', 'sync_empty_inbox'])
+        self.assertTrue(results['results']['sync_empty_inbox']['seconds'] >
+                        results['results']['interpreter']['seconds'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import media
+from photosort import stats
+import os
+
+
+class TestStats(photosort.test.TestCase):
+
+    def setUp(self):
+        stats.reset()
+        self.addCleanup(stats.reset)
+        self.addCleanup(setattr, stats, 'enabled', False)
+
+    def _stage(self, name):
+        return dict((stage.name, stage) for stage in stats.stages())[name]
+
+    def test_disabled(self):
+        media.MediaFile(self.get_data_path('media1/img1.jpg')).hash()
+        self.assertEqual(stats.stages(), [])
+
+    def test_percentiles(self):
+        stage = stats.Stage('test')
+        for i in range(1, 101):
+            stage.add(i / 1000.0)
+        self.assertEqual(stage.calls, 100)
+        for percent, seconds in [(50, 0.050), (95, 0.095), (99, 0.099)]:
+            self.assertTrue(seconds <= stage.percentile(percent) < seconds * 1.2)
+
+    def test_stages(self):
+        stats.enable()
+        path = self.get_data_path('media1/img1.jpg')
+        photo = media.MediaFile.build_for(path)
+        photo.hash()
+        photo.partial_hash()
+
+        self.assertEqual(self._stage('hash').calls, 1)
+        self.assertEqual(self._stage('hash').bytes, os.path.getsize(path))
+        self.assertEqual(self._stage('exif').calls, 1)
+        self.assertEqual(self._stage('partial_hash').bytes, 65536 + 18435)
+        self.assertEqual(len(stats.summary()), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import dbindex
+from photosort.benchmark import memory
+
+
+class TestCompactIndex(photosort.test.TestCase):
+
+    def setUp(self):
+        self.photo_hash = 'a35de42abad366d0f6232a4abd0404c8 - 2013-08-24 13:05:52'
+        self.photo = {'dir': '2013/2013_08_24', 'name': 'img1.jpg',
+                      'type': 'photo', 'size': 83971}
+        self.movie_hash = 'c2f1b3d96a0ed0e8e1b0f5f3a1d2c4b5'
+        self.movie = {'dir': '2013/2013_08_24', 'name': 'mov1.mp4',
+                      'type': 'movie', 'size': None}
+
+    def test_records(self):
+        index = dbindex.CompactIndex()
+        index[self.photo_hash] = self.photo
+        index[self.movie_hash] = self.movie
+
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index[self.photo_hash], self.photo)
+        self.assertEqual(index.get(self.movie_hash), self.movie)
+        self.assertTrue(self.photo_hash in index)
+        self.assertFalse(self.photo_hash[:32] in index)
+        self.assertEqual(index.get(self.photo_hash[:32]), None)
+        self.assertEqual(sorted(index.items()),
+                         sorted([(self.photo_hash, self.photo),
+                                 (self.movie_hash, self.movie)]))
+        self.assertEqual(index.hashes_with_size(83971), set([self.photo_hash]))
+        self.assertEqual(len(index._dirs), 1)
+
+    def test_other_hashes(self):
+        index = dbindex.CompactIndex()
+        for hash in ['A35DE42ABAD366D0F6232A4ABD0404C8',
+                     'a35de42abad366d0f6232a4abd0404c8 - 0000:00:00 00:00:00',
+                     'not a digest']:
+            index[hash] = self.photo
+            self.assertEqual(index[hash], self.photo)
+        self.assertEqual(len(index._rows), 0)
+        self.assertEqual(len(index.hashes_with_size(83971)), 3)
+
+    def test_dates_of_the_same_md5(self):
+        index = dbindex.CompactIndex()
+        raw = dict(self.photo, name='img1.cr2')
+        index[self.photo_hash[:32]] = raw
+        index[self.photo_hash] = self.photo
+
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index[self.photo_hash[:32]], raw)
+        self.assertEqual(index[self.photo_hash], self.photo)
+        self.assertEqual(index.hashes_with_size(83971),
+                         set([self.photo_hash, self.photo_hash[:32]]))
+
+        del index[self.photo_hash[:32]]
+        self.assertEqual(index.items().next(), (self.photo_hash, self.photo))
+        del index[self.photo_hash]
+        self.assertEqual(len(index), 0)
+
+    def test_replace_and_delete(self):
+        index = dbindex.CompactIndex()
+        index[self.photo_hash] = self.photo
+        moved = dict(self.photo, dir='2014/2014_01_01', size=10)
+        index[self.photo_hash] = moved
+
+        self.assertEqual(index[self.photo_hash], moved)
+        self.assertEqual(index.hashes_with_size(83971), set())
+        self.assertEqual(index.hashes_with_size(10), set([self.photo_hash]))
+
+        del index[self.photo_hash]
+        self.assertEqual(len(index), 0)
+        self.assertRaises(KeyError, index.__getitem__, self.photo_hash)
+        self.assertEqual(index.hashes_with_size(10), set())
+
+        index[self.movie_hash] = self.movie
+        self.assertEqual(len(index._digests), 1)    # the row is reused
+
+    def test_records_are_copies(self):
+        index = dbindex.CompactIndex()
+        index[self.photo_hash] = self.photo
+        index[self.photo_hash]['name'] = 'changed.jpg'
+        self.assertEqual(index[self.photo_hash]['name'], 'img1.jpg')
+
+    def test_memory_benchmark_records(self):
+        hashes, sizes = memory.build_dict(1000)
+        index = memory.build_compact(1000)
+        self.assertEqual(len(index), len(hashes))
+        self.assertEqual(sorted(index.items()), sorted(hashes.items()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import media
+from photosort import photodb
+import os
+import shutil
+
+
+class TestSnapshot(photosort.test.TestCase):
+
+    def setUp(self):
+        self.output_dir = self.make_tmpdir()
+        self.config = self.make_config(self.output_dir)
+        self.snapshot_file = os.path.join(self.output_dir, 'photosort.db.snap')
+        self.entries = {
+            'a35de42abad366d0f6232a4abd0404c8 - 2013-08-24 13:05:52':
+                {'dir': '2013/2013_08_24', 'name': 'img1.jpg',
+                 'type': 'photo', 'size': 83971},
+            '0cc175b9c0f1b6a831c399e269772661':
+                {'dir': '2014/2014_01_01', 'name': 'mov1.mp4',
+                 'type': 'movie', 'size': 83971},
+            '92eb5ffee6ae2fec3ad71c777531578f':
+                {'dir': '2014/2014_01_01', 'name': 'old.avi',
+                 'type': 'movie', 'size': None},
+            'not an md5':
+                {'dir': '2014/2014_01_01', 'name': 'other.jpg',
+                 'type': 'photo', 'size': 10}}
+
+        db = photodb.PhotoDB(self.config)
+        for hash, record in self.entries.items():
+            db._store(hash, record)
+        db.write()
+
+    def _load(self):
+        return photodb.PhotoDB(self.config)
+
+    def test_loaded_from_snapshot(self):
+        self.assertTrue(os.path.exists(self.snapshot_file))
+        db = self._load()
+        self.assertNotEqual(db._snapshot, None)
+        self.assertEqual(len(db._hashes), 0)
+
+        self.assertEqual(len(db), 4)
+        self.assertEqual(dict(db.entries()), self.entries)
+        for hash, record in self.entries.items():
+            self.assertEqual(db._lookup(hash), record)
+        self.assertEqual(db._lookup('0cc175b9c0f1b6a831c399e269772662'), None)
+        self.assertEqual(db._hashes_with_size(83971),
+                         set(hash for hash, record in self.entries.items()
+                             if record['size'] == 83971))
+        self.assertEqual(db._unsized, set(['92eb5ffee6ae2fec3ad71c777531578f']))
+
+    def test_duplicates_from_snapshot(self):
+        sorted_dir = os.path.join(self.output_dir, '2013', '2013_08_24')
+        os.makedirs(sorted_dir)
+        shutil.copy(self.get_data_path('media1/img1.jpg'), sorted_dir)
+
+        db = self._load()
+        self.assertTrue(db.is_duplicate(media.MediaFile.build_for(
+            self.get_data_path('media1/img1_dup.jpg'))))
+
+    def test_write_merges_new_entries(self):
+        db = self._load()
+        moved = dict(self.entries['0cc175b9c0f1b6a831c399e269772661'],
+                     dir='2015/2015_01_01')
+        db._store('0cc175b9c0f1b6a831c399e269772661', moved)
+        db._store('00000000000000000000000000000000',
+                  {'dir': '2015/2015_01_01', 'name': 'new.jpg',
+                   'type': 'photo', 'size': 5})
+        db.write()
+
+        self.entries['0cc175b9c0f1b6a831c399e269772661'] = moved
+        self.entries['00000000000000000000000000000000'] = \
+            {'dir': '2015/2015_01_01', 'name': 'new.jpg',
+             'type': 'photo', 'size': 5}
+        self.assertEqual(dict(db.entries()), self.entries)
+        db = self._load()
+        self.assertNotEqual(db._snapshot, None)
+        self.assertEqual(dict(db.entries()), self.entries)
+
+    def test_dates_of_the_same_md5(self):
+        raw_hash = 'a35de42abad366d0f6232a4abd0404c8'
+        raw = {'dir': '2013/2013_08_24', 'name': 'img1.cr2',
+               'type': 'photo', 'size': 83971}
+        later_hash = raw_hash + ' - 2014-01-01 00:00:00'
+        later = dict(raw, name='img2.jpg')
+        db = self._load()
+        db._store(raw_hash, raw)
+        db._store(later_hash, later)
+        self.entries[raw_hash] = raw
+        self.entries[later_hash] = later
+
+        self.assertEqual(dict(db.entries()), self.entries)
+        self.assertEqual(len(db), 6)
+        db.write()
+
+        db = self._load()
+        self.assertNotEqual(db._snapshot, None)
+        self.assertEqual(dict(db.entries()), self.entries)
+        self.assertEqual(len(db), 6)
+        for hash, record in self.entries.items():
+            self.assertEqual(db._lookup(hash), record)
+
+    def test_stale_snapshot(self):
+        with open(os.path.join(self.output_dir, 'photosort.db'), 'a') as f_out:
+            f_out.write('2016/2016_01_01,added.jpg,photo,'
+                        '11111111111111111111111111111111,7\r\n')
+
+        db = self._load()
+        self.assertEqual(db._snapshot, None)
+        self.assertEqual(len(db), 5)
+
+        db = self._load()
+        self.assertNotEqual(db._snapshot, None)
+        self.assertEqual(db._lookup('11111111111111111111111111111111')['name'],
+                         'added.jpg')
+
+    def test_names_that_arent_utf8(self):
+        db = self._load()
+        self.entries['not an md5 either'] = {'dir': '2014/caf\xe9',
+                                             'name': 'caf\xc3\xa9.jpg',
+                                             'type': 'photo', 'size': 20}
+        db._store('not an md5 either', self.entries['not an md5 either'])
+        db.write()
+
+        db = self._load()
+        self.assertNotEqual(db._snapshot, None)
+        self.assertEqual(dict(db.entries()), self.entries)
+
+    def test_corrupted_snapshot(self):
+        with open(self.snapshot_file, 'wb') as f_out:
+            f_out.write('garbage')
+        db = self._load()
+        self.assertEqual(dict(db.entries()), self.entries)
+
+    def test_unchanged_db_is_not_written(self):
+        db_file = os.path.join(self.output_dir, 'photosort.db')
+        os.utime(db_file, (1000000000, 1000000000))
+        self._load().write()
+        self.assertEqual(os.stat(db_file).st_mtime, 1000000000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import timeskew
+from photosort import walk
+import os
+
+
+class TestSkewCache(photosort.test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = self.make_tmpdir()
+        self.cache_file = os.path.join(self.tmpdir, 'photosort.timeskew')
+        self.probes = []
+        self.skew = 5.0
+        self.real_probe = timeskew.probe
+        timeskew.probe = self._probe
+        self.addCleanup(setattr, timeskew, 'probe', self.real_probe)
+
+    def _probe(self, directory):
+        self.probes.append(directory)
+        if self.skew is None:
+            raise IOError(30, "Read-only file system")
+        return self.skew
+
+    def _dir(self, name):
+        path = os.path.join(self.tmpdir, name)
+        os.mkdir(path)
+        return path
+
+    def test_shared_by_the_mount(self):
+        cache = timeskew.SkewCache()
+        self.assertEqual(cache.skew_for(self._dir('inbox')), 5.0)
+        self.assertEqual(cache.skew_for(self._dir('card')), 5.0)
+        self.assertEqual(self.probes, [os.path.join(self.tmpdir, 'inbox')])
+
+    def test_persisted(self):
+        timeskew.SkewCache(self.cache_file).skew_for(self.tmpdir)
+        self.skew = 7.0
+        self.assertEqual(timeskew.SkewCache(self.cache_file).skew_for(
+            self.tmpdir), 5.0)
+        self.assertEqual(len(self.probes), 1)
+
+    def test_probed_again_after_the_ttl(self):
+        cache = timeskew.SkewCache(self.cache_file, ttl=0)
+        cache.skew_for(self.tmpdir)
+        self.skew = 7.0
+        self.assertEqual(cache.skew_for(self.tmpdir), 7.0)
+        self.assertEqual(len(self.probes), 2)
+
+    def test_failures_use_the_last_skew(self):
+        cache = timeskew.SkewCache(ttl=0)
+        cache.skew_for(self.tmpdir)
+        self.skew = None
+        self.assertEqual(cache.skew_for(self.tmpdir), 5.0)
+        self.assertEqual(timeskew.SkewCache().skew_for(self.tmpdir), 0)
+
+    def test_corrupted_cache_file(self):
+        with open(self.cache_file, 'w') as f_out:
+            f_out.write('{garbage')
+        self.assertEqual(timeskew.SkewCache(self.cache_file).skew_for(
+            self.tmpdir), 5.0)
+
+    def test_walkers_share_the_cache(self):
+        cache = timeskew.SkewCache()
+        for name in ('inbox', 'card'):
+            walker = walk.WalkForMedia(self._dir(name), skew_cache=cache)
+            walker._modification_lapse(self.cache_file, os.stat(self.tmpdir))
+        self.assertEqual(len(self.probes), 1)
+
+    def test_probe(self):
+        self.assertTrue(isinstance(self.real_probe(self.tmpdir), float))
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+if __name__ == '__main__':
+    unittest.main()
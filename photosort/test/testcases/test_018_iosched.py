@@ -0,0 +1,114 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import iosched
+from photosort import media
+import collections
+import os
+import threading
+import time
+
+Stat = collections.namedtuple('Stat', ['st_dev', 'st_ino'])
+
+
+class TestIOScheduler(photosort.test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = self.make_tmpdir()
+        self.scheduler = iosched.IOScheduler()
+        self.dev = os.stat(self.tmpdir).st_dev
+
+    def _run(self, function, *args):
+        thread = threading.Thread(target=function, args=args)
+        thread.start()
+        return thread
+
+    def test_concurrency_limit(self):
+        self.scheduler.set_limit(self.tmpdir, 2)
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+
+        def work(inode):
+            with self.scheduler.slots((self.tmpdir, Stat(self.dev, inode))):
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.01)
+                with lock:
+                    active[0] -= 1
+
+        for thread in [self._run(work, inode) for inode in range(8)]:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+
+    def test_waiting_served_by_inode(self):
+        self.scheduler.set_limit(self.tmpdir, 1)
+        order = []
+
+        def work(inode):
+            with self.scheduler.slots((self.tmpdir, Stat(self.dev, inode))):
+                order.append(inode)
+
+        with self.scheduler.slots((self.tmpdir, Stat(self.dev, 0))):
+            device = self.scheduler._devices[self.dev]
+            threads = [self._run(work, inode) for inode in (5, 3, 9, 1)]
+            while len(device._waiting) < 4:
+                time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [1, 3, 5, 9])
+
+    def test_devices_are_independent(self):
+        self.scheduler.set_limit(self.tmpdir, 1)
+        with self.scheduler.slots((self.tmpdir, Stat(self.dev, 1))):
+            # would block if it shared the slot of self.dev
+            with self.scheduler.slots((self.tmpdir, Stat(self.dev + 1, 1)),
+                                      (self.tmpdir, Stat(self.dev + 2, 1))):
+                pass
+        self.assertEqual(self.scheduler._devices[self.dev + 1].limit,
+                         iosched.default_limit(self.tmpdir, self.dev + 1))
+
+    def test_filesystem_type(self):
+        mounts_file = os.path.join(self.tmpdir, 'mounts')
+        with open(mounts_file, 'w') as f_out:
+            f_out.write("/dev/sda1 / ext4 rw 0 0\n"
+                        "nas:/pictures /mnt/nas\\040pictures nfs4 rw 0 0\n"
+                        "tmpfs /mnt/nas\\040pictures/tmp tmpfs rw 0 0\n")
+        self.assertEqual(iosched.filesystem_type('/mnt/nas pictures/inbox',
+                                                 mounts_file), 'nfs4')
+        self.assertEqual(iosched.filesystem_type('/mnt/nas pictures/tmp/x',
+                                                 mounts_file), 'tmpfs')
+        self.assertEqual(iosched.filesystem_type('/mnt/nas', mounts_file),
+                         'ext4')
+
+    def test_media_files_use_the_scheduler(self):
+        self.scheduler.set_limit(self.tmpdir, 1)
+        media.MediaFile.io_scheduler = self.scheduler
+        self.addCleanup(setattr, media.MediaFile, 'io_scheduler', None)
+
+        path = os.path.join(self.tmpdir, 'img1.jpg')
+        with open(path, 'wb') as f_out:
+            f_out.write('data')
+        media_file = media.MediaFile(path)
+        self.assertEqual(media_file.hash(), '8d777f385d3dfec8815d20f7496026dc')
+        media_file.partial_hash()
+        self.assertEqual(self.scheduler._devices[self.dev].active, 0)
+
+    def test_source_limits(self):
+        config = self.make_config(self.tmpdir,
+                                  sources={'nas': {'dir': self.tmpdir,
+                                                   'io_concurrency': 1},
+                                           'card': {'dir': self.tmpdir}},
+                                  io_concurrency=3)
+        self.assertEqual(config.source_io_concurrency('nas'), 1)
+        self.assertEqual(config.source_io_concurrency('card'), None)
+        self.assertEqual(config.output_io_concurrency(), 3)
+
+if __name__ == '__main__':
+    unittest.main()
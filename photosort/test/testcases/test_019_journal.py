@@ -0,0 +1,121 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import media
+from photosort import photodb
+import os
+import shutil
+
+
+class TestJournal(photosort.test.TestCase):
+
+    RECORD = {'dir': '2013/2013_08_24', 'name': 'img1.jpg',
+              'type': 'photo', 'size': 83971}
+    HASH = 'a35de42abad366d0f6232a4abd0404c8 - 2013-08-24 13:05:52'
+
+    def setUp(self):
+        self.output_dir = self.make_tmpdir()
+        self.db_file = os.path.join(self.output_dir, 'photosort.db')
+        self.journal_file = self.db_file + '.journal'
+
+    def _db(self, **output):
+        return photodb.PhotoDB(self.make_config(self.output_dir, **output))
+
+    def _write_db(self, **output):
+        db = self._db(**output)
+        db._store('0cc175b9c0f1b6a831c399e269772661',
+                  {'dir': '2014/2014_01_01', 'name': 'mov1.mp4',
+                   'type': 'movie', 'size': 10})
+        db.write()
+        os.utime(self.db_file, (1000000000, 1000000000))
+        return self._db(**output)
+
+    def test_adds_survive_without_write(self):
+        sorted_dir = os.path.join(self.output_dir, '2013', '2013_08_24')
+        os.makedirs(sorted_dir)
+        shutil.copy(self.get_data_path('media1/img1.jpg'), sorted_dir)
+        db = self._write_db()
+        self.assertTrue(db.add_to_db(sorted_dir, 'img1.jpg',
+                                     media.MediaFile.build_for(
+                                         os.path.join(sorted_dir, 'img1.jpg'))))
+
+        db = self._db()
+        self.assertEqual(db._lookup(self.HASH), self.RECORD)
+        self.assertEqual(len(db), 2)
+
+    def test_write_only_syncs_the_journal(self):
+        db = self._write_db()
+        db._add(self.HASH, self.RECORD)
+        db.write()
+        self.assertEqual(os.stat(self.db_file).st_mtime, 1000000000)
+        self.assertTrue(os.path.exists(self.journal_file))
+        self.assertEqual(self._db()._lookup(self.HASH), self.RECORD)
+
+    def test_removes(self):
+        db = self._write_db()
+        self.assertFalse(db.remove_from_db('2014/2014_01_01', 'other.mp4',
+                                           '0cc175b9c0f1b6a831c399e269772661'))
+        self.assertTrue(db.remove_from_db('2014/2014_01_01', 'mov1.mp4',
+                                          '0cc175b9c0f1b6a831c399e269772661'))
+        db.write()
+
+        db = self._db()
+        self.assertEqual(db._lookup('0cc175b9c0f1b6a831c399e269772661'), None)
+        self.assertEqual(len(db), 0)
+        self.assertEqual(list(db.entries()), [])
+
+        db = self._db(db_journal_max_age=0)
+        db.write()
+        self.assertFalse(os.path.exists(self.journal_file))
+        self.assertEqual(len(self._db()), 0)
+
+    def test_compacted_by_size(self):
+        db = self._write_db(db_journal_max_bytes=100)
+        db._add(self.HASH, self.RECORD)
+        db.write()
+        self.assertNotEqual(os.stat(self.db_file).st_mtime, 1000000000)
+        self.assertFalse(os.path.exists(self.journal_file))
+
+        db = self._db()
+        self.assertEqual(db._lookup(self.HASH), self.RECORD)
+        self.assertNotEqual(db._snapshot, None)
+
+    def test_compacted_by_age(self):
+        db = self._write_db(db_journal_max_age=0)
+        db._add(self.HASH, self.RECORD)
+        db.write()
+        self.assertFalse(os.path.exists(self.journal_file))
+        self.assertEqual(self._db()._lookup(self.HASH), self.RECORD)
+
+    def test_torn_record(self):
+        db = self._write_db()
+        db._add(self.HASH, self.RECORD)
+        db.write()
+        with open(self.journal_file, 'ab') as f_out:
+            f_out.write('+,1380000000.000,0cc175b9c0f1b6a831c399e2697')
+
+        db = self._db()
+        self.assertEqual(db._lookup(self.HASH), self.RECORD)
+        self.assertEqual(db._lookup('0cc175b9c0f1b6a831c399e269772661')['size'],
+                         10)
+
+        other = dict(self.RECORD, name='img2.jpg')
+        db._add('92eb5ffee6ae2fec3ad71c777531578f', other)
+        db.write()
+        self.assertEqual(self._db()._lookup('92eb5ffee6ae2fec3ad71c777531578f'),
+                         other)
+
+    def test_disabled(self):
+        db = self._write_db(db_journal='')
+        db._add(self.HASH, self.RECORD)
+        db.write()
+        self.assertNotEqual(os.stat(self.db_file).st_mtime, 1000000000)
+        self.assertFalse(os.path.exists(self.journal_file))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import photosort.test
+from photosort import media
+from photosort import xattrs
+import errno
+import os
+import shutil
+
+FAKE_DIGEST = 'ffffffffffffffffffffffffffffffff'
+
+
+class TestXattrs(photosort.test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = self.make_tmpdir()
+        self.movie = os.path.join(self.tmpdir, 'mov1.mp4')
+        with open(self.movie, 'wb') as f_out:
+            f_out.write('data')
+        if not xattrs.write(self.movie, os.stat(self.movie), {}):
+            self.skipTest("extended attributes not supported in %s" %
+                          self.tmpdir)
+        media.MediaFile.use_xattrs = True
+        self.addCleanup(setattr, media.MediaFile, 'use_xattrs', False)
+
+    def test_changed_files_are_ignored(self):
+        xattrs.write(self.movie, os.stat(self.movie),
+                     {'digest': FAKE_DIGEST, 'algorithm': 'md5'})
+        self.assertEqual(xattrs.read(self.movie, os.stat(self.movie)),
+                         {'digest': FAKE_DIGEST, 'algorithm': 'md5'})
+
+        with open(self.movie, 'ab') as f_out:
+            f_out.write('more')
+        self.assertEqual(xattrs.read(self.movie, os.stat(self.movie)), None)
+        self.assertEqual(media.MediaFile(self.movie).hash(),
+                         '6816e239236f42deccdd84296350e18a')
+
+    def test_digest_trusted(self):
+        xattrs.write(self.movie, os.stat(self.movie),
+                     {'digest': FAKE_DIGEST, 'algorithm': 'md5'})
+        self.assertEqual(media.MediaFile(self.movie).hash(), FAKE_DIGEST)
+
+        photo = os.path.join(self.tmpdir, 'img1.jpg')
+        shutil.copy(self.get_data_path('media1/img1.jpg'), photo)
+        xattrs.write(photo, os.stat(photo),
+                     {'digest': FAKE_DIGEST, 'algorithm': 'md5',
+                      'exif_datetime': '2001-02-03 04:05:06'})
+        self.assertEqual(media.MediaFile.build_for(photo).hash(),
+                         FAKE_DIGEST + ' - 2001-02-03 04:05:06')
+
+    def test_stored(self):
+        photo = os.path.join(self.tmpdir, 'img1.jpg')
+        shutil.copy(self.get_data_path('media1/img1.jpg'), photo)
+        media_file = media.MediaFile.build_for(photo)
+        media_file.hash()
+        media_file.store_xattrs()
+
+        self.assertEqual(xattrs.read(photo, os.stat(photo)),
+                         {'digest': 'a35de42abad366d0f6232a4abd0404c8',
+                          'algorithm': 'md5',
+                          'exif_datetime': '2013-08-24 13:05:52'})
+
+    def test_unsupported(self):
+        def unsupported(path, name, value):
+            raise OSError(errno.ENOTSUP, os.strerror(errno.ENOTSUP), path)
+        set_xattr = xattrs._set
+        xattrs._set = unsupported
+        self.addCleanup(setattr, xattrs, '_set', set_xattr)
+        st = os.stat(self.movie)
+        self.addCleanup(xattrs._unsupported_devs.discard, st.st_dev)
+
+        media_file = media.MediaFile(self.movie)
+        self.assertEqual(media_file.hash(), '8d777f385d3dfec8815d20f7496026dc')
+        media_file.store_xattrs()
+        self.assertTrue(st.st_dev in xattrs._unsupported_devs)
+        self.assertEqual(xattrs.read(self.movie, st), None)
+
+if __name__ == '__main__':
+    unittest.main()
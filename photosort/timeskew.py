@@ -0,0 +1,135 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+import json
+import logging
+import os
+import threading
+import time
+
+# skew changes bigger than this (seconds) between probes are logged
+DRIFT_WARNING = 2.0
+
+
+def probe(directory):
+    """
+    discover the remote filesystem time skew with local datetime
+    this could be handled by ntp syncing all nodes, but we
+    can't have a guarantee on this
+    """
+    f_name = os.path.join(directory, ".timesync")
+    with open(f_name, 'w') as f:
+        f.write("touch!")
+
+    try:
+        ct1 = os.path.getmtime(f_name)
+        ct2 = os.path.getctime(f_name)
+    finally:
+        os.remove(f_name)   # cleanup the file
+
+    # it can differ from windows to UN*X
+    ct = max(ct1, ct2)
+
+    now = time.mktime(time.gmtime())
+
+    return ct - now     # remote-local
+
+
+def mount_point(path):
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+class SkewCache:
+    """
+        Time skew of each filesystem, measured with probe() in the
+        first directory walked on it and reused for every directory
+        of the same mount until it's 'ttl' seconds old. The skews are
+        kept in 'filename' between runs when one is given.
+
+        A failed probe (i.e. on a read only source) is logged, and
+        the last known skew of the mount (or 0) is used until the
+        next probe is due.
+    """
+
+    def __init__(self, filename=None, ttl=3600):
+        self._filename = filename
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._skews = None  # mount point -> {'dev', 'skew', 'measured'}
+        self._mounts = {}   # st_dev -> mount point
+
+    def _load(self):
+        self._skews = {}
+        if self._filename is None or not os.path.exists(self._filename):
+            return
+        try:
+            with open(self._filename, 'r') as f_in:
+                self._skews = dict((str(mount), skew) for mount, skew in
+                                   json.load(f_in).items())
+        except (IOError, ValueError) as e:
+            logging.warning("Ignoring the time skew cache %s: %s" %
+                            (self._filename, e))
+
+    def _save(self):
+        if self._filename is None:
+            return
+        tmp_filename = '%s.%d.tmp' % (self._filename, os.getpid())
+        try:
+            with open(tmp_filename, 'w') as f_out:
+                json.dump(self._skews, f_out)
+            os.rename(tmp_filename, self._filename)
+        except (IOError, OSError) as e:
+            logging.warning("Unable to write the time skew cache %s: %s" %
+                            (self._filename, e))
+
+    def _mount_point(self, st_dev, directory):
+        mount = self._mounts.get(st_dev)
+        if mount is None:
+            mount = self._mounts[st_dev] = mount_point(directory)
+        return mount
+
+    def skew_for(self, directory):
+        """
+        returns the time skew (remote-local, in seconds) of the
+        filesystem of directory
+        """
+        st_dev = os.stat(directory).st_dev
+        now = time.time()
+        with self._lock:
+            if self._skews is None:
+                self._load()
+            mount = self._mount_point(st_dev, directory)
+            known = self._skews.get(mount)
+            if known is not None and known['dev'] == st_dev and \
+                    0 <= now - known['measured'] < self._ttl:
+                return known['skew']
+
+            last_skew = known['skew'] if known is not None else 0
+            try:
+                skew = probe(directory)
+            except (IOError, OSError) as e:
+                logging.warning("Unable to probe the time skew of %s, "
+                                "using %.1fs: %s" % (mount, last_skew, e))
+                skew = last_skew
+            else:
+                if known is not None and \
+                        abs(skew - last_skew) > DRIFT_WARNING:
+                    logging.warning("Time skew of %s changed from %.1fs "
+                                    "to %.1fs" % (mount, last_skew, skew))
+                logging.debug("Time skew of %s: %.1fs" % (mount, skew))
+
+            self._skews[mount] = {'dev': st_dev, 'skew': skew,
+                                  'measured': now}
+            self._save()
+            return skew
+
+
+# shared by the walkers created without a cache of their own
+default_cache = SkewCache()
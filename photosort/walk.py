@@ -6,156 +6,300 @@ __email__ = "miguelangel@ajo.es"
 __copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
 __license__ = "GPLv3"
 
+import collections
 import datetime
+import errno
 import os
 import logging
-import fcntl
+import stat
 import time
 
 import media
+import readiness
+import stats
+import timeskew
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
-class WalkForMedia:
+
+class _DirEntry(object):
     """
-        A simple class to walk for JPEGs over a root dir
+        os.DirEntry lookalike for systems without scandir,
+        the stat results are cached
     """
-    def __init__(self, rootdir, ignores=[], extensions=[]):
-        self._rootdir = rootdir
-        self._ignores = ignores
-        self._extensions = extensions
-        self._fs_time_skew = self._fs_timeskew_to(rootdir)
+    __slots__ = ('name', 'path', '_stat', '_lstat')
 
-    def _fs_timeskew_to(self,rootdir):
-        """
-        discover the remote filesystem time skew with local datetime
-        this could be handled by ntp syncing all nodes, but we
-        can't have a guarantee on this
-        """
-        f_name = os.path.join(rootdir,".timesync")
-        with open(f_name,'w') as f:
-            f.write("touch!")
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stat = None
+        self._lstat = None
 
-        ct1 = os.path.getmtime(f_name)
-        ct2 = os.path.getctime(f_name)
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
 
-        os.remove(f_name) # cleanup the file
+    def is_symlink(self):
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        return stat.S_ISLNK(self._lstat.st_mode)
 
-        # it can differ from windows to UN*X
-        ct =max(ct1,ct2)
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
 
-        now = time.mktime(time.gmtime())
+    def is_file(self):
+        try:
+            return stat.S_ISREG(self.stat().st_mode)
+        except OSError:
+            return False
+
+
+def _scandir(directory):
+    if scandir is not None:
+        return scandir(directory)
+    return [_DirEntry(directory, name) for name in os.listdir(directory)]
 
-        return ct-now # remote-local
 
-    def _modification_lapse(self,filename):
+# a media file found by the walker, with the stat result of the file
+MediaEntry = collections.namedtuple('MediaEntry',
+                                    ['directory', 'name', 'path', 'stat'])
+
+
+class WalkForMedia:
+    """
+        A simple class to walk for JPEGs over a root dir
+    """
+    def __init__(self, rootdir, ignores=[], extensions=[], tracker=None,
+                 skew_cache=None):
+        self._rootdir = rootdir
+        if tracker is None:
+            tracker = readiness.ReadinessTracker()
+        self._tracker = tracker
+        if skew_cache is None:
+            skew_cache = timeskew.default_cache
+        self._skew_cache = skew_cache
+        # ignored directories, by absolute path
+        self._ignores = frozenset(os.path.abspath(ignore) for ignore in ignores)
+        if extensions:
+            self._extensions = frozenset(extension.lower()
+                                         for extension in extensions)
+        else:
+            self._extensions = media.MEDIA_EXTENSIONS
+        # looked up when a readiness check first needs it, so walking
+        # a source without media doesn't probe it
+        self._fs_time_skew = None
+
+    def _time_skew(self):
+        if self._fs_time_skew is None:
+            self._fs_time_skew = self._skew_cache.skew_for(self._rootdir)
+        return self._fs_time_skew
+
+    def _modification_lapse(self,filename,st=None):
         """
         return the lapse from last file modification (in seconds)
         """
-        ct1 = os.path.getmtime(filename)
-        ct2 = os.path.getctime(filename)
+        if st is None:
+            st = os.stat(filename)
+        ct1 = st.st_mtime
+        ct2 = st.st_ctime
 
         # it can differ from windows to UN*X
         ct = max(ct1,ct2)
 
         now = time.mktime(time.gmtime())
 
-        return now-ct + self._fs_time_skew
+        return now-ct + self._time_skew()
 
-    def _file_is_growing(self,filename):
-        size1 = os.path.getsize(filename)
-        time.sleep(2)
-        size2 = os.path.getsize(filename)
+    def _file_is_empty(self,filename,st=None):
+        if st is None:
+            st = os.stat(filename)
+        return st.st_size == 0
 
-        if size2>size1:
-            logging.debug("%s size1<2 = %d<%d",filename,size1,size2)
+    @stats.timed('readiness')
+    def _file_is_ready(self,filename,st=None):
+        # skip files that are yet incomplete from being moved around,
+        # they must keep the same size and mtime for a few walks, or
+        # not have been modified for a while
 
-        return size2>size1
+        if st is None:
+            st = os.stat(filename)
 
-    def _file_is_empty(self,filename):
-        return os.path.getsize(filename) == 0
-
-    def _file_is_locked(self,filename):
-        try:
-            with open(filename,'r') as file:
-                fcntl.flock(file.fileno(),fcntl.LOCK_EX)
-                fcntl.flock(file.fileno(),fcntl.LOCK_UN)
-        except IOError, e:
-                logging.debug("%s seems to be locked or gone" % filename)
-                return True
-        return False # we were able to lock/unlock, so nobody must be writing
-
-    def _file_is_ready(self,filename):
-        # we have a bunch of extra checks to avoid files
-        # that are yet incomplete from being moved around
-
-        if self._file_is_locked(filename):
-            logging.debug("file %s not ready because it's locked"
+        if self._file_is_empty(filename, st):
+            logging.debug("file %s not ready because it's empty"
                           % filename )
             return False
 
-        # skip files that were modified in the last 30 seconds
+        return self._tracker.is_ready(
+            filename, st, lambda: self._modification_lapse(filename, st))
 
-        mod_lapse = self._modification_lapse(filename)
+    def _is_ignored(self, directory):
+        return os.path.abspath(directory) in self._ignores
 
-        if mod_lapse<30:
-            logging.debug("file %s not ready because modification "
-                          "lapse is %d, it's probably copying yet"
-                          % (filename,mod_lapse) )
-            return False
+    def _is_media_name(self, name):
+        return name.lower().split('.')[-1] in self._extensions
 
-        # skip growing or empty files
+    def is_candidate(self, file_path):
+        """
+        tells if file_path would be considered by find_media,
+        without checking if it's ready
+        """
+        relative_path = os.path.relpath(file_path, self._rootdir)
+        parts = relative_path.split(os.sep)
+        if parts[0] == os.pardir:
+            return False
 
-        # skip this check, as it's a major slowdown, and lapse seems to work
-        #if self._file_is_growing(filename):
-        #     logging.debug("file %s not ready because it's growing"
-        #                  % filename )
-        #     return False
+        # hidden files and directories, and AppleDouble files
+        if [part for part in parts if part.startswith('.')]:
+            return False
 
-        if self._file_is_empty(filename):
-            logging.debug("file %s not ready because it's empty"
-                          % filename )
+        directory = self._rootdir
+        if self._is_ignored(directory):
             return False
+        for part in parts[:-1]:
+            directory = os.path.join(directory, part)
+            if self._is_ignored(directory):
+                return False
 
+        return self._is_media_name(parts[-1])
 
-        return True
+    def entry_for(self, file_path):
+        """
+        returns the MediaEntry for file_path
+        """
+        directory, name = os.path.split(file_path)
+        return MediaEntry(directory, name, file_path, os.stat(file_path))
 
-    def find_media(self):
+    def is_ready(self, file_path, st=None):
+        return self._file_is_ready(file_path, st)
 
+    @stats.timed('walk')
+    def _list_dir(self, directory):
+        return sorted(_scandir(directory), key=lambda entry: entry.name)
+
+    def is_walkable(self):
         if not os.path.isdir(self._rootdir):
             logging.info(self._rootdir +
                          " does not exists or it's not mounted, "
                          "cannot find media")
-            return
+            return False
 
         if os.path.split(self._rootdir)[-1].startswith('.'):
             logging.info(self._rootdir +
                          " is a hidden directory => ignoring")
-            return
+            return False
 
-        if self._rootdir in self._ignores:
+        if self._is_ignored(self._rootdir):
             logging.info(self._rootdir +
                          " in the list to be ignored => ignoring")
-            return
-
-        for root, subFolders, files in os.walk(self._rootdir):
+            return False
+        return True
 
-            subFolders[:] = [sf for sf in subFolders
-                    if not sf.startswith('.') 
-                    and not sf in self._ignores]
+    def _scan_dir(self, root):
+        """
+        lists root, returns the paths of the subdirectories to walk
+        and a MediaEntry for each of the media files in it
+        """
+        sub_dirs = []
+        media_entries = []
+        for entry in self._list_dir(root):
+
+            # skip hidden files and directories, and mac osx
+            # AppleDouble files (it puts a ._ in front of the name)
+            # to keep extra information
+
+            if entry.name.startswith('.'):
+                continue
+
+            if entry.is_dir():
+                if not entry.is_symlink() and \
+                        not self._is_ignored(entry.path):
+                    sub_dirs.append(entry.path)
+                continue
+
+            if not self._is_media_name(entry.name):
+                continue
+
+            try:
+                media_entries.append(MediaEntry(root, entry.name, entry.path,
+                                                entry.stat()))
+            except OSError as e:
+                logging.debug("%s is gone: %s" % (entry.path, e))
+        return sub_dirs, media_entries
+
+    def find_candidates(self):
+        """
+        yields a MediaEntry for each of the media files found,
+        without checking if they are ready
+        """
+        for directory, st, sub_dirs, media_entries in self.find_dirs():
+            for entry in media_entries:
+                yield entry
 
-            for file in files:
+    def find_dirs(self, unchanged_subdirs=None, failed=None):
+        """
+        yields (directory, stat, sub_dirs, media_entries) for each of
+        the directories walked, depth first in sorted order, so files
+        are always found in the same order
 
-                file_path = os.path.join(root, file)
+        unchanged_subdirs(directory, stat) can tell the names of the
+        subdirectories of a directory known not to have changed since
+        it was last walked, then it isn't listed and media_entries is
+        None for it
 
-                # skip mac osx AppleDouble files (it puts a ._ in front of the
-                # name) to keep extra information
+        The directories that exist but can't be listed (i.e. EIO or
+        EACCES) are appended to the 'failed' list, if one is given
+        """
+        if not self.is_walkable():
+            return
 
-                if file.startswith('.'):
+        pending_dirs = [self._rootdir]
+        while pending_dirs:
+            root = pending_dirs.pop()
+            try:
+                # before listing, so changes while it's listed are seen
+                # the next time
+                st = os.stat(root)
+                known = None
+                if unchanged_subdirs is not None:
+                    known = unchanged_subdirs(root, st)
+                if known is not None:
+                    sub_dirs = [os.path.join(root, name) for name in known]
+                    sub_dirs = [sub_dir for sub_dir in sub_dirs
+                                if not self._is_ignored(sub_dir)]
+                    media_entries = None
+                else:
+                    sub_dirs, media_entries = self._scan_dir(root)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    logging.debug("%s is gone: %s" % (root, e))
                     continue
+                logging.error("Unable to list %s: %s" % (root, e))
+                if failed is not None:
+                    failed.append(root)
+                continue
+
+            yield root, st, sub_dirs, media_entries
+            pending_dirs.extend(reversed(sub_dirs))
 
-                media_file = media.MediaFile.build_for(file_path)
-                file_type = media_file.type()
+    def find_media_entries(self):
+        """
+        yields a MediaEntry for each of the media files
+        found that are ready
+        """
+        for entry in self.find_candidates():
+            if self._file_is_ready(entry.path, entry.stat):
+                yield entry
 
-                if file_type != 'unknown':
-                    if self._file_is_ready(file_path):
-                       yield [root, file]
+    def find_media(self):
+        for entry in self.find_media_entries():
+            yield [entry.directory, entry.name]
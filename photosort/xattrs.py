@@ -0,0 +1,151 @@
+# -*- mode: python; coding: utf-8 -*-
+
+__author__ = "Miguel Angel Ajo Pelayo"
+__email__ = "miguelangel@ajo.es"
+__copyright__ = "Copyright (C) 2013 Miguel Angel Ajo Pelayo"
+__license__ = "GPLv3"
+
+# Extended attributes of the sorted files, they keep what is known
+# about the file contents with the file itself:
+#
+#   user.photosort.digest           digest of the contents
+#   user.photosort.algorithm        hash algorithm of the digest
+#   user.photosort.exif_datetime    EXIF date of photos, empty if none
+#   user.photosort.size             size and mtime of the file when
+#   user.photosort.mtime            they were written
+#
+# so they survive a lost DB, and the file being moved to another host.
+
+import ctypes
+import errno
+import logging
+import os
+import sys
+
+PREFIX = 'user.photosort.'
+
+# the ones a file must have for its attributes to be used
+REQUIRED = ('digest', 'algorithm', 'size', 'mtime')
+
+# filesystems (or mounts) where they can't be kept
+UNSUPPORTED_ERRORS = (errno.ENOTSUP, errno.EOPNOTSUPP, errno.EROFS)
+
+_libc = None
+_unsupported_devs = set()
+
+
+def _c_library():
+    global _libc
+    if _libc is None:
+        # the symbols of the process, libc is already loaded
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.getxattr.argtypes = [ctypes.c_char_p, ctypes.c_char_p,
+                                   ctypes.c_void_p, ctypes.c_size_t]
+        _libc.getxattr.restype = ctypes.c_ssize_t
+        _libc.setxattr.argtypes = [ctypes.c_char_p, ctypes.c_char_p,
+                                   ctypes.c_char_p, ctypes.c_size_t,
+                                   ctypes.c_int]
+        _libc.setxattr.restype = ctypes.c_int
+    return _libc
+
+
+def _raise_errno(path):
+    error = ctypes.get_errno()
+    raise OSError(error, os.strerror(error), path)
+
+
+def _get(path, name):
+    """
+    value of the attribute, None if the file doesn't have it
+    """
+    try:
+        if hasattr(os, 'getxattr'):
+            return os.getxattr(path, name)
+
+        libc = _c_library()
+        size = 256
+        while True:
+            buf = ctypes.create_string_buffer(size)
+            length = libc.getxattr(path, name, buf, size)
+            if length >= 0:
+                return buf.raw[:length]
+            if ctypes.get_errno() != errno.ERANGE:
+                _raise_errno(path)
+            size = libc.getxattr(path, name, None, 0)
+            if size < 0:
+                _raise_errno(path)
+    except OSError as e:
+        if e.errno == errno.ENODATA:
+            return None
+        raise
+
+
+def _set(path, name, value):
+    if hasattr(os, 'setxattr'):
+        os.setxattr(path, name, value)
+    elif _c_library().setxattr(path, name, value, len(value), 0) != 0:
+        _raise_errno(path)
+
+
+def is_available():
+    return sys.platform.startswith('linux')
+
+
+def read(path, st):
+    """
+    returns a dictionary with the attributes of the file (without
+    the PREFIX), None if it has none, or they were written before
+    the file changed (its size or mtime in 'st' are different)
+    """
+    if not is_available() or st.st_dev in _unsupported_devs:
+        return None
+
+    values = {}
+    try:
+        for name in REQUIRED:
+            value = _get(path, PREFIX + name)
+            if value is None:
+                return None
+            values[name] = value
+        exif_datetime = _get(path, PREFIX + 'exif_datetime')
+    except OSError as e:
+        logging.debug("Unable to read the attributes of %s: %s" % (path, e))
+        return None
+
+    if exif_datetime is not None:
+        values['exif_datetime'] = exif_datetime
+    try:
+        if int(values.pop('size')) != st.st_size or \
+                float(values.pop('mtime')) != st.st_mtime:
+            return None
+    except ValueError:
+        return None
+    return values
+
+
+def write(path, st, values):
+    """
+    sets the attributes in 'values' with the size and mtime of 'st',
+    returns False if they couldn't be set
+    """
+    if not is_available() or st.st_dev in _unsupported_devs:
+        return False
+
+    try:
+        for name, value in sorted(values.items()):
+            _set(path, PREFIX + name, value)
+        # last, attributes half written for a changed file don't match it
+        _set(path, PREFIX + 'size', str(st.st_size))
+        _set(path, PREFIX + 'mtime', repr(st.st_mtime))
+    except OSError as e:
+        if e.errno in UNSUPPORTED_ERRORS:
+            if st.st_dev not in _unsupported_devs:
+                _unsupported_devs.add(st.st_dev)
+                logging.warning("Extended attributes not supported for %s, "
+                                "digests are kept only in the DB: %s" %
+                                (path, e))
+        else:
+            logging.warning("Unable to set the attributes of %s: %s" %
+                            (path, e))
+        return False
+    return True
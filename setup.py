@@ -16,7 +16,8 @@ setuptools.setup(
             'console_scripts': [
                 'photosort = photosort.photosort:main'
             ]},
-        install_requires = ['pyaml', 'Pillow'],
+        install_requires = ['pyaml', 'Pillow',
+                            'scandir; python_version < "3.5"'],
         data_files = [('etc', ['etc/photosort.yml'])],
         test_suite = 'photosort.test.testcases'
         )